@@ -0,0 +1,90 @@
+import threading
+from collections import OrderedDict
+from typing import List
+import numpy as np
+import pandas as pd
+from data_models import DiaryEntry, MOOD_OPTIONS, entry_key
+from mood_rollups import MOOD_GROUPS
+
+MOOD_GROUP_ORDER = list(MOOD_OPTIONS.keys()) + ["その他"]
+WEEKDAY_LABELS = ["月", "火", "水", "木", "金", "土", "日"]
+# メモリに載せておく表の数（利用者数）
+MAX_CACHED_FRAMES = 32
+
+_frames = OrderedDict()
+_frames_lock = threading.Lock()
+
+def build_frame(entries: List[DiaryEntry]) -> pd.DataFrame:
+    """記録を列指向の DataFrame にする。以降の集計はすべてこの表に対するベクトル演算"""
+    dates = pd.to_datetime(pd.Series([e.date for e in entries], dtype="object"), format="%Y-%m-%d %H:%M:%S", errors="coerce")
+    moods = pd.Series([e.mood for e in entries], dtype="object")
+    frame = pd.DataFrame({
+        "date": dates,
+        "mood": moods.astype("category"),
+        "mood_intensity": np.fromiter((e.mood_intensity for e in entries), dtype=np.int8, count=len(entries)),
+        "category": pd.Series([e.category for e in entries], dtype="category"),
+        "mood_group": pd.Categorical(moods.map(MOOD_GROUPS).fillna("その他"), categories=MOOD_GROUP_ORDER),
+    })
+    frame = frame.dropna(subset=["date"])
+    return frame.sort_values("date", kind="stable").reset_index(drop=True)
+
+def entries_frame(cache_key: str, entries: List[DiaryEntry]) -> pd.DataFrame:
+    """cache_key（利用者ごとのファイルパスなど）単位で表をキャッシュする。件数と末尾の記録が同じなら作り直さない"""
+    signature = (len(entries), entry_key(entries[-1]) if entries else "")
+    with _frames_lock:
+        cached = _frames.get(cache_key)
+        if cached is not None and cached[0] == signature:
+            _frames.move_to_end(cache_key)
+            return cached[1]
+    frame = build_frame(entries)
+    with _frames_lock:
+        _frames[cache_key] = (signature, frame)
+        _frames.move_to_end(cache_key)
+        while len(_frames) > MAX_CACHED_FRAMES:
+            _frames.popitem(last=False)
+    return frame
+
+def rolling_mood(frame: pd.DataFrame, window: int = 7) -> pd.DataFrame:
+    """日ごとの平均気分と、window 日の移動平均（記録の無い日は除いて平均する）"""
+    if frame.empty:
+        return pd.DataFrame(columns=["date", "daily_avg", "rolling_avg", "count"])
+    daily = frame.set_index("date")["mood_intensity"].resample("D").agg(["sum", "count"])
+    sums = daily["sum"].rolling(window, min_periods=1).sum()
+    counts = daily["count"].rolling(window, min_periods=1).sum()
+    result = pd.DataFrame({
+        "daily_avg": daily["sum"] / daily["count"].replace(0, np.nan),
+        "rolling_avg": sums / counts.replace(0, np.nan),
+        "count": daily["count"],
+    })
+    return result.reset_index()
+
+def weekday_hour_heatmap(frame: pd.DataFrame) -> pd.DataFrame:
+    """曜日 × 時間帯ごとの記録数と平均気分"""
+    grouped = frame.groupby([frame["date"].dt.weekday.rename("weekday"), frame["date"].dt.hour.rename("hour")])["mood_intensity"]
+    result = grouped.agg(count="count", avg_mood="mean").reset_index()
+    result["weekday_label"] = np.array(WEEKDAY_LABELS)[result["weekday"].to_numpy()]
+    return result
+
+def category_distribution(frame: pd.DataFrame) -> pd.DataFrame:
+    """カテゴリごとの記録数・割合・平均気分"""
+    result = frame.groupby("category", observed=True)["mood_intensity"].agg(count="count", avg_mood="mean").reset_index()
+    result["share"] = result["count"] / max(len(frame), 1)
+    return result.sort_values("count", ascending=False, kind="stable").reset_index(drop=True)
+
+def mood_transitions(frame: pd.DataFrame) -> pd.DataFrame:
+    """連続する2件の記録で、気持ちのグループがどう移り変わったか（遷移元ごとの割合つき）"""
+    groups = frame["mood_group"].cat.codes.to_numpy()
+    size = len(MOOD_GROUP_ORDER)
+    counts = np.zeros((size, size), dtype=np.int64)
+    if len(groups) > 1:
+        np.add.at(counts, (groups[:-1], groups[1:]), 1)
+    totals = counts.sum(axis=1, keepdims=True)
+    shares = np.divide(counts, totals, out=np.zeros(counts.shape), where=totals > 0)
+    from_idx, to_idx = np.meshgrid(np.arange(size), np.arange(size), indexing="ij")
+    labels = np.array(MOOD_GROUP_ORDER)
+    return pd.DataFrame({
+        "from_group": labels[from_idx.ravel()],
+        "to_group": labels[to_idx.ravel()],
+        "count": counts.ravel(),
+        "share": shares.ravel(),
+    })
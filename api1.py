@@ -1,16 +1,28 @@
 # api.py
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+import base64
 import datetime
-from typing import List
+from typing import List, Optional
 import hashlib
+import tempfile
+import time
+from dataclasses import asdict, fields as dataclass_fields
 
 # 外部モジュールのインポート
 # 以下のファイルが同じディレクトリに存在している必要があります
-from data_models import DiaryEntry, Goal
-from data_manager import DiaryManager, GoalManager
-from bot_counselor import CounselingBot
+from data_models import DiaryEntry, Goal, SUMMARY_FIELDS, validate_entry
+from data_manager import DiaryManager, GoalManager, sync_changes
+from errors import raise_error
+from bot_jobs import get_job_queue
+from bot_backends import response_cache
+from data_cache import parsed_data_cache
+from storage import get_backend
+import journal_io
+import metrics
 
 app = FastAPI(
     title="習慣化ジャーナルAPI",
@@ -27,57 +39,254 @@ class DiaryEntryRequest(BaseModel):
     category: str
     user_email: str
 
-# APIのインスタンスを初期化
-bot = CounselingBot()
+class DiaryBatchItem(DiaryEntryRequest):
+    # 同じキーで送り直された記録は二重に保存しない（オフライン中に溜めた記録の再送用）
+    idempotency_key: Optional[str] = None
+    # 端末で書いた日時（YYYY-MM-DD HH:MM:SS か ISO 8601）。省略時はサーバーが受け取った日時
+    date: Optional[str] = None
+
+class DiaryBatchRequest(BaseModel):
+    entries: List[DiaryBatchItem]
+
+# 1回のバッチで受け付ける記録の数
+MAX_BATCH_ENTRIES = 500
+# 取り込むファイルをメモリに置く上限（超えた分は一時ファイルに書く）
+IMPORT_SPOOL_BYTES = 1024 * 1024
+# 取り込む本文の大きさの上限
+MAX_IMPORT_BYTES = 64 * 1024 * 1024
+
+# ボットの応答はバックグラウンドのワーカーで生成する
+job_queue = get_job_queue()
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # ラベルには利用者ごとに変わる実際のパスではなく、ルートの定義（/get_goals/{user_email} など）を使う
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        metrics.HTTP_REQUESTS.inc(path, request.method, str(status))
+        metrics.HTTP_LATENCY.observe(time.perf_counter() - started, path, request.method)
+
+def cache_metrics() -> list:
+    """出力のたびにキャッシュとグループコミットの統計を読む"""
+    caches = {"parsed_data": parsed_data_cache.stats(), "bot_response": response_cache.stats()}
+    samples = [
+        ("diary_cache_hits_total", "キャッシュのヒット数", "counter", [({"cache": name}, stats["hits"]) for name, stats in caches.items()]),
+        ("diary_cache_misses_total", "キャッシュのミス数", "counter", [({"cache": name}, stats["misses"]) for name, stats in caches.items()]),
+        ("diary_cache_hit_ratio", "キャッシュのヒット率", "gauge", [({"cache": name}, stats["hit_ratio"]) for name, stats in caches.items()]),
+        ("diary_cache_items", "キャッシュに載っている件数", "gauge", [({"cache": name}, stats["items"]) for name, stats in caches.items()]),
+    ]
+    group_commit = getattr(get_backend(), "group_commit", None)
+    if group_commit is not None:
+        stats = group_commit.stats()
+        samples.append(("diary_group_commit_batches_total", "グループコミットで書いた回数", "counter", [({}, stats["batches"])]))
+        samples.append(("diary_group_commit_records_total", "グループコミットで書いたレコード数", "counter", [({}, stats["records"])]))
+    return samples
+
+metrics.register_collector(cache_metrics)
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Prometheus のテキスト形式で指標を返します。
+    """
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 # --- 日記関連のエンドポイント ---
 @app.post("/save_diary/")
 def save_diary_entry(entry_request: DiaryEntryRequest):
     """
-    日記のエントリーを保存し、ボットの応答を返します。
+    日記のエントリーを保存してすぐに返します。
+    ボットの応答はバックグラウンドで生成されるので、/bot_response/ で取得してください。
     """
+    # 新しい日記エントリーを作成（応答は後から書き込まれる）
+    new_entry = request_entry(entry_request, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    error = validate_entry(new_entry)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
     try:
         # ユーザー固有のファイルパスを生成
-        diary_manager = DiaryManager(user_email=entry_request.user_email)
-
-        # AIボットの応答を生成
-        bot_response = bot.get_counseling_response(
-            content=entry_request.content,
-            mood=entry_request.mood,
-            mood_intensity=entry_request.mood_intensity,
-            category=entry_request.category
-        )
-
-        # 新しい日記エントリーを作成
-        new_entry = DiaryEntry(
-            date=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            title=entry_request.title,
-            content=entry_request.content,
-            mood=entry_request.mood,
-            mood_intensity=entry_request.mood_intensity,
-            category=entry_request.category,
-            user_email=entry_request.user_email,
-            bot_response=bot_response
-        )
+        diary_manager = DiaryManager(user_email=entry_request.user_email, on_error=raise_error)
 
         # 日記を保存
         diary_manager.add_entry(new_entry)
 
-        return {"message": "日記が正常に保存されました。", "bot_response": bot_response}
+        # AIボットの応答を予約
+        job = job_queue.submit(diary_manager, new_entry)
+
+        return {"message": "日記が正常に保存されました。", "entry_id": new_entry.id, "status": job["status"], "bot_response": job["bot_response"]}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"内部サーバーエラーが発生しました: {e}")
+
+def request_entry(entry_request: DiaryEntryRequest, date: str, entry_id: str = "") -> DiaryEntry:
+    return DiaryEntry(date=date, title=entry_request.title, content=entry_request.content, mood=entry_request.mood,
+                      mood_intensity=entry_request.mood_intensity, category=entry_request.category,
+                      user_email=entry_request.user_email, id=entry_id)
+
+def batch_entry_id(user_email: str, idempotency_key: str) -> str:
+    # キーから id を決めるので、再送されたものは保存済みの記録と同じ id になる
+    return hashlib.md5(f"{user_email}|{idempotency_key}".encode()).hexdigest()
+
+def validate_batch_item(item: DiaryBatchItem, entry: DiaryEntry) -> str:
+    """問題があればその内容、なければ空文字。記録の中身は /save_diary/ や取り込みと同じ validate_entry で見る"""
+    if not item.user_email.strip():
+        return "user_email を指定してください"
+    return validate_entry(entry)
+
+def batch_entry_date(value: Optional[str], now: datetime.datetime) -> str:
+    """端末から届いた日時を保存する形式にする。省略時は now、未来の日時（端末の時計のずれ）は now に丸める。
+    読めなければ ValueError"""
+    if not value or not value.strip():
+        return now.strftime("%Y-%m-%d %H:%M:%S")
+    moment = datetime.datetime.fromisoformat(value.strip())
+    if moment.tzinfo is not None:
+        # 時差付きならサーバーの現地時刻にそろえる
+        moment = moment.astimezone().replace(tzinfo=None)
+    return min(moment, now).strftime("%Y-%m-%d %H:%M:%S")
+
+@app.post("/save_diary/batch")
+def save_diary_batch(batch_request: DiaryBatchRequest):
+    """
+    複数の日記をまとめて保存します（オフライン中に溜めた記録の送信用）。
+    利用者ごとに1回の書き込みで保存し、entries と同じ順で記録ごとの結果を返します。
+    status は created / duplicate（同じ idempotency_key で保存済み）/ invalid / failed のいずれかです。
+    記録ごとに date（端末で書いた日時）を付けられ、省略時はサーバーが受け取った日時になります。
+    """
+    items = batch_request.entries
+    if len(items) > MAX_BATCH_ENTRIES:
+        raise HTTPException(status_code=400, detail=f"一度に送れる日記は{MAX_BATCH_ENTRIES}件までです")
+    now = datetime.datetime.now().replace(microsecond=0)
+    results = []
+    pending = {}
+    for index, item in enumerate(items):
+        result = {"index": index, "idempotency_key": item.idempotency_key, "entry_id": None, "status": "created", "error": ""}
+        results.append(result)
+        try:
+            date = batch_entry_date(item.date, now)
+        except ValueError:
+            result.update(status="invalid", error="date は YYYY-MM-DD HH:MM:SS の形式で指定してください")
+            continue
+        entry = request_entry(item, date, batch_entry_id(item.user_email, item.idempotency_key) if item.idempotency_key else "")
+        error = validate_batch_item(item, entry)
+        if error:
+            result.update(status="invalid", error=error)
+            continue
+        pending.setdefault(item.user_email, []).append((result, entry))
+    for user_email, user_items in pending.items():
+        try:
+            diary_manager = DiaryManager(user_email=user_email, on_error=raise_error)
+            added = {entry.id for entry in diary_manager.add_entries([entry for _, entry in user_items])}
+        except Exception as e:
+            for result, _ in user_items:
+                result.update(status="failed", error=f"保存に失敗しました: {e}")
+            continue
+        for result, entry in user_items:
+            result["entry_id"] = entry.id
+            if entry.id in added:
+                added.discard(entry.id)
+                # AIボットの応答を予約（待ち行列があふれた分はルールベースの応答になる）
+                job = job_queue.submit(diary_manager, entry)
+                result["bot_status"] = job["status"]
+            else:
+                result["status"] = "duplicate"
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    return {"results": results, "counts": counts}
+
+@app.get("/bot_response/{user_email}/{entry_id}")
+def get_bot_response(user_email: str, entry_id: str, wait: float = Query(0, ge=0, le=30)):
+    """
+    ボットの応答の生成状況を返します。status が pending / running の間は bot_response は空で、
+    partial にそこまでに生成された部分が入ります。
+    wait を指定すると、最大その秒数だけ完了を待ってから返します。
+    """
+    job = job_queue.wait(entry_id, wait) if wait else job_queue.status(entry_id)
+    if job is not None and job["user_email"] == user_email:
+        return {"entry_id": entry_id, "status": job["status"], "bot_response": job["bot_response"], "partial": job["partial"]}
+    try:
+        diary_manager = DiaryManager(user_email=user_email, on_error=raise_error)
+        summary = next((s for s in diary_manager.load_summaries() if s.id == entry_id), None)
+        entry = diary_manager.load_entry(summary) if summary is not None else None
+        if entry is None:
+            raise HTTPException(status_code=404, detail="日記が見つかりません")
+        if entry.bot_response:
+            return {"entry_id": entry_id, "status": "done", "bot_response": entry.bot_response}
+        # 他のワーカーが生成中なら、そちらが書き込むのを待つ（ここで予約し直すと応答を二重に作る）
+        if job_queue.leased_elsewhere(diary_manager, entry_id):
+            return {"entry_id": entry_id, "status": "pending", "bot_response": ""}
+        # 再起動などでジョブが失われていたら予約し直す
+        job = job_queue.submit(diary_manager, entry)
+        return {"entry_id": entry_id, "status": job["status"], "bot_response": job["bot_response"]}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"内部サーバーエラーが発生しました: {e}")
 
+DIARY_ENTRY_FIELDS = [field.name for field in dataclass_fields(DiaryEntry)]
+
+def encode_cursor(position: int) -> str:
+    return base64.urlsafe_b64encode(str(position).encode()).decode()
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        position = int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except Exception:
+        raise HTTPException(status_code=400, detail="cursor が不正です")
+    if position < 0:
+        raise HTTPException(status_code=400, detail="cursor が不正です")
+    return position
 
 @app.get("/get_diary_history/{user_email}")
-def get_diary_history(user_email: str):
+def get_diary_history(
+    user_email: str,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+):
     """
-    ユーザーの全日記エントリーを取得します。
+    ユーザーの日記エントリーを古い順に取得します。
+    limit / cursor でページ分割し、fields=title,date,mood のように返す項目を絞れます。
+    前回の ETag を If-None-Match で送ると、変更がなければ 304 を返します。
     """
+    selected_fields = None
+    if fields:
+        selected_fields = [name.strip() for name in fields.split(",") if name.strip()]
+        unknown = [name for name in selected_fields if name not in DIARY_ENTRY_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"不明な項目です: {', '.join(unknown)}")
+    start = decode_cursor(cursor) if cursor else 0
     try:
-        diary_manager = DiaryManager(user_email=user_email)
-        entries = diary_manager.load_entries()
-        # asdict()を使ってdataclassを辞書に変換し、JSONシリアライズ可能にする
-        return {"entries": [entry for entry in entries]}
+        diary_manager = DiaryManager(user_email=user_email, on_error=raise_error)
+        # ETag は版数とクエリから作るので、変更がなければファイルを読まずに 304 を返せる
+        version = diary_manager.entries_version()
+        etag = '"' + hashlib.md5(f"{version}|{limit}|{start}|{fields}".encode()).hexdigest() + '"'
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers={"ETag": etag})
+        # 見出しの項目だけを求められたら本文を読まずに返す
+        if selected_fields and all(name == "id" or name in SUMMARY_FIELDS for name in selected_fields):
+            entries = diary_manager.load_summaries()
+        else:
+            entries = diary_manager.load_entries()
+        page = entries[start:start + limit] if limit else entries[start:]
+        end = start + len(page)
+        if selected_fields:
+            items = [{name: getattr(entry, name) for name in selected_fields} for entry in page]
+        else:
+            items = [asdict(entry) for entry in page]
+        response.headers["ETag"] = etag
+        # 末尾まで返した場合も next_cursor を返すので、クライアントはそれで新着をポーリングできる
+        return {"entries": items, "total": len(entries), "next_cursor": encode_cursor(end), "has_more": end < len(entries)}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"内部サーバーエラーが発生しました: {e}")
 
@@ -88,9 +297,62 @@ def get_user_goals(user_email: str):
     ユーザーの全目標を取得します。
     """
     try:
-        goal_manager = GoalManager(user_email=user_email)
+        goal_manager = GoalManager(user_email=user_email, on_error=raise_error)
         goals = goal_manager.load_goals()
         # asdict()を使ってdataclassを辞書に変換し、JSONシリアライズ可能にする
         return {"goals": [goal for goal in goals]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"内部サーバーエラーが発生しました: {e}")
+
+# --- 同期エンドポイント ---
+@app.get("/sync/{user_email}")
+def sync(user_email: str, token: str = "", limit: int = Query(1000, ge=1, le=10000)):
+    """
+    前回の sync_token 以降に作成・変更・削除された日記と目標だけを返します。
+    初回やトークンが古い場合は reset=true で全件を返します。has_more が true なら続けて呼び出してください。
+    """
+    try:
+        return sync_changes(DiaryManager(user_email=user_email, on_error=raise_error), GoalManager(user_email=user_email, on_error=raise_error), token, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"内部サーバーエラーが発生しました: {e}")
+
+# --- エクスポート・インポート ---
+@app.get("/export/{user_email}")
+def export_journal(user_email: str, export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$")):
+    """
+    日記（古い順）と目標を NDJSON（1行1件、kind で日記か目標かを区別）または CSV で返します。
+    少しずつ読みながら送るので、履歴が長くてもサーバーのメモリは増えません。
+    """
+    diary_manager = DiaryManager(user_email=user_email, on_error=raise_error)
+    goal_manager = GoalManager(user_email=user_email, on_error=raise_error)
+    filename = journal_io.export_filename(export_format)
+    return StreamingResponse(journal_io.export_chunks(diary_manager, goal_manager, export_format),
+                             media_type=f"{journal_io.MEDIA_TYPES[export_format]}; charset=utf-8",
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.post("/import/{user_email}")
+async def import_journal(user_email: str, request: Request, import_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$")):
+    """
+    /export/ と同じ形式の本文（NDJSON または CSV）を取り込みます。
+    一定の件数ごとにまとめて保存し、保存済みの id の日記・目標は飛ばします。
+    本文が MAX_IMPORT_BYTES を超えると 413 を返します。
+    """
+    too_large = HTTPException(status_code=413, detail=f"取り込めるファイルは{MAX_IMPORT_BYTES // (1024 * 1024)}MBまでです")
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > MAX_IMPORT_BYTES:
+        raise too_large
+    # 本文は受け取りながら一時ファイルに溜め、取り込みは別スレッドで1行ずつ読みながら行う
+    with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES) as spool:
+        received = 0
+        async for chunk in request.stream():
+            # Content-Length のない（chunked の）本文も、受け取った量で打ち切る
+            received += len(chunk)
+            if received > MAX_IMPORT_BYTES:
+                raise too_large
+            spool.write(chunk)
+        spool.seek(0)
+        try:
+            return await run_in_threadpool(journal_io.import_file, DiaryManager(user_email=user_email, on_error=raise_error),
+                                           GoalManager(user_email=user_email, on_error=raise_error), spool, import_format)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"内部サーバーエラーが発生しました: {e}")
@@ -5,7 +5,16 @@ from data_models import Goal, DiaryEntry, MOOD_OPTIONS, ACHIEVEMENT_TIPS, THEME_
 from auth_manager import AuthManager
 from data_manager import GoalManager, DiaryManager
 from bot_counselor import CounselingBot
-from ui_components import get_css, goals_overview_widget, mood_selector
+from bot_jobs import get_job_queue
+from ui_components import get_css, goals_overview_widget, mood_selector, show_error
+import mood_rollups
+import journal_io
+from instrumentation import span
+import analytics
+import altair as alt
+
+# 記録一覧で一度に描く件数の選択肢（最初の値が既定）
+HISTORY_PAGE_SIZES = [20, 50, 100]
 
 def login_page():
     theme_name = st.session_state.get('theme_name', 'ソフトブルー')
@@ -16,7 +25,7 @@ def login_page():
     
     tab1, tab2 = st.tabs([" ログイン", " 新規登録"])
     
-    auth_manager = AuthManager()
+    auth_manager = AuthManager(on_error=show_error)
     
     with tab1:
         st.subheader("ログイン")
@@ -109,29 +118,31 @@ def write_diary_page(diary_manager: DiaryManager, bot: CounselingBot, goal_manag
         category = st.selectbox(" カテゴリ", ["仕事・学業", "人間関係", "恋愛", "家族", "健康", "その他"])
         content = st.text_area(" 今日の振り返り", height=200, placeholder="今日の出来事、感じたこと、学んだこと、目標への進捗など... 自由に書いてください。")
     with col2:
-        selected_mood = mood_selector()
+        mood_selector()
     
     if st.button(" 記録して相談する", type="primary"):
+        selected_mood = st.session_state.get('selected_mood')
         if title and content and selected_mood:
-            with st.spinner("あなたの気持ちに寄り添っています..."):
-                bot_response = bot.get_counseling_response(content, selected_mood['name'], selected_mood['intensity'], category)
-            entry = DiaryEntry(date=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), title=title, content=content, mood=selected_mood['name'], mood_intensity=selected_mood['intensity'], category=category, bot_response=bot_response)
+            entry = DiaryEntry(date=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), title=title, content=content, mood=selected_mood['name'], mood_intensity=selected_mood['intensity'], category=category)
             diary_manager.add_entry(entry)
+            # 記録はすぐに保存し、メッセージはバックグラウンドで用意する
+            get_job_queue().submit(diary_manager, entry)
             st.session_state.diary_saved = True
+            st.session_state.pending_bot_entry = entry.id
             st.success("記録が保存されました！")
-            st.markdown('<div class="bot-response">', unsafe_allow_html=True)
-            st.markdown("###  今日のメッセージ")
-            st.write(bot_response)
-            st.markdown('</div>', unsafe_allow_html=True)
         else:
             st.error("タイトル、内容、心模様を選択してください。")
     
+    if st.session_state.diary_saved and st.session_state.get('pending_bot_entry'):
+        bot_response_panel(diary_manager, st.session_state.pending_bot_entry)
+    
     if st.session_state.diary_saved:
         st.markdown("---")
         col1, col2, col3 = st.columns(3)
         with col1:
             if st.button("➕ 続けて記録", type="secondary"):
                 st.session_state.diary_saved = False
+                st.session_state.pending_bot_entry = None
                 st.rerun()
         with col2:
             if st.button(" 目標を確認"):
@@ -142,22 +153,56 @@ def write_diary_page(diary_manager: DiaryManager, bot: CounselingBot, goal_manag
                 st.session_state.current_page = " 記録を振り返る"
                 st.rerun()
 
+def show_bot_response(bot_response: str):
+    st.markdown('<div class="bot-response">', unsafe_allow_html=True)
+    st.markdown("###  今日のメッセージ")
+    st.write(bot_response)
+    st.markdown('</div>', unsafe_allow_html=True)
+
+def bot_response_panel(diary_manager: DiaryManager, entry_id: str):
+    job_queue = get_job_queue()
+    job = job_queue.status(entry_id)
+    if job is None:
+        # 完了したジョブが待ち行列から消えていれば、保存済みの応答を表示する
+        summary = next((s for s in reversed(diary_manager.load_summaries()) if s.id == entry_id), None)
+        entry = diary_manager.load_entry(summary) if summary is not None else None
+        if entry is not None and entry.bot_response:
+            show_bot_response(entry.bot_response)
+        else:
+            st.session_state.pending_bot_entry = None
+    elif job["status"] in ("pending", "running"):
+        # 生成中のメッセージを届いた分から表示する
+        st.markdown('<div class="bot-response">', unsafe_allow_html=True)
+        st.markdown("###  今日のメッセージ")
+        with st.spinner("あなたの気持ちに寄り添っています..."), span("bot.stream"):
+            streamed = st.write_stream(job_queue.stream(entry_id))
+        st.markdown('</div>', unsafe_allow_html=True)
+        job = job_queue.status(entry_id)
+        if job is not None and job["bot_response"] != streamed:
+            # 途中で打ち切られて別の応答で埋めた場合は、保存された内容で描き直す
+            st.rerun()
+    else:
+        show_bot_response(job["bot_response"])
+
 def history_page(diary_manager: DiaryManager, goal_manager: GoalManager):
     st.header(" 記録を振り返る")
     goals_overview_widget(goal_manager)
-    entries = diary_manager.load_entries()
-    if not entries:
+    # 一覧と絞り込みは見出しだけで行い、本文は開いた記録の分だけ読む
+    entries_version = diary_manager.entries_version()
+    summaries = diary_manager.load_summaries()
+    if not summaries:
         st.info("まだ記録がありません。今日から始めてみましょう。")
         return
     
+    rollups = diary_manager.load_rollups(summaries, entries_version)
     col1, col2, col3 = st.columns(3)
     with col1:
         st.markdown('<div class="stats-card">', unsafe_allow_html=True)
-        st.metric("記録日数", len(entries))
+        st.metric("記録日数", rollups.total["count"])
         st.markdown('</div>', unsafe_allow_html=True)
     with col2:
-        if entries:
-            avg_mood = sum(entry.mood_intensity for entry in entries) / len(entries)
+        if summaries:
+            avg_mood = mood_rollups.bucket_average(rollups.total)
             st.markdown('<div class="stats-card">', unsafe_allow_html=True)
             st.metric("平均気分", f"{avg_mood:.1f}/5")
             st.markdown('</div>', unsafe_allow_html=True)
@@ -167,7 +212,7 @@ def history_page(diary_manager: DiaryManager, goal_manager: GoalManager):
         st.metric("設定目標数", len(goals))
         st.markdown('</div>', unsafe_allow_html=True)
     
-    col1, col2, col3 = st.columns(3)
+    col1, col2, col3, col4 = st.columns([3, 2, 2, 1])
     with col1:
         search_term = st.text_input(" 記録を検索", placeholder="キーワードで検索...")
     with col2:
@@ -175,30 +220,104 @@ def history_page(diary_manager: DiaryManager, goal_manager: GoalManager):
     with col3:
         mood_categories = list(MOOD_OPTIONS.keys())
         filter_mood_cat = st.selectbox("気持ちで絞る", ["すべて"] + mood_categories)
+    with col4:
+        page_size = st.selectbox("表示件数", HISTORY_PAGE_SIZES, key="history_page_size")
     
-    filtered_entries = entries
+    # 新しい順。検索時は索引の関連度順
+    filtered_entries = list(reversed(summaries))
     if search_term:
-        filtered_entries = [e for e in filtered_entries if search_term.lower() in e.content.lower() or search_term.lower() in e.title.lower()]
+        by_id = {summary.id: summary for summary in summaries}
+        filtered_entries = [by_id[e.id] for e in diary_manager.search_entries(search_term) if e.id in by_id]
     if filter_category != "すべて":
         filtered_entries = [e for e in filtered_entries if e.category == filter_category]
     if filter_mood_cat != "すべて":
         category_moods = [mood['name'] for mood in MOOD_OPTIONS[filter_mood_cat]]
         filtered_entries = [e for e in filtered_entries if e.mood in category_moods]
     
+    # 件数は絞り込みの結果から出し、描くのは先頭から history_visible 件だけ。
+    # 条件や表示件数が変わったら1ページ目に戻す
+    filter_state = (search_term, filter_category, filter_mood_cat, page_size)
+    if st.session_state.get('history_filter') != filter_state:
+        st.session_state.history_filter = filter_state
+        st.session_state.history_visible = page_size
+    visible_count = st.session_state.history_visible
+    
     st.subheader(f" 記録一覧 ({len(filtered_entries)}件)")
-    for entry in reversed(filtered_entries):
-        mood_color = "#d3d3d3"
-        for category, moods in MOOD_OPTIONS.items():
-            for mood in moods:
-                if mood['name'] == entry.mood:
-                    mood_color = mood['color']
-                    break
-        with st.expander(f"{entry.mood} {entry.title} - {entry.date.split()[0]}"):
-            st.markdown(f"""<div style="border-left: 4px solid {mood_color}; padding-left: 1rem; margin: 0.5rem 0;"><strong>心模様:</strong> {entry.mood} (強度: {entry.mood_intensity}/5)<br><strong>カテゴリ:</strong> {entry.category}<br><strong>記録時刻:</strong> {entry.date}</div>""", unsafe_allow_html=True)
-            st.write(entry.content)
-            if entry.bot_response:
-                st.markdown("** その時のメッセージ:**")
-                st.info(entry.bot_response)
+    with span("ui.history_list"):
+        seen_ids = set()
+        for i, summary in enumerate(filtered_entries[:visible_count]):
+            mood_color = "#d3d3d3"
+            for category, moods in MOOD_OPTIONS.items():
+                for mood in moods:
+                    if mood['name'] == summary.mood:
+                        mood_color = mood['color']
+                        break
+            # 開閉を覚えるためのキー（内容から id を振った古い記録は重なることがある）
+            key = f"history_entry_{summary.id}" if summary.id not in seen_ids else f"history_entry_{summary.id}_{i}"
+            seen_ids.add(summary.id)
+            expander = st.expander(f"{summary.mood} {summary.title} - {summary.date.split()[0]}", key=key, on_change="rerun")
+            with expander:
+                st.markdown(f"""<div style="border-left: 4px solid {mood_color}; padding-left: 1rem; margin: 0.5rem 0;"><strong>心模様:</strong> {summary.mood} (強度: {summary.mood_intensity}/5)<br><strong>カテゴリ:</strong> {summary.category}<br><strong>記録時刻:</strong> {summary.date}</div>""", unsafe_allow_html=True)
+                if not expander.open:
+                    continue
+                entry = diary_manager.load_entry(summary)
+                if entry is None:
+                    st.warning("記録を読み込めませんでした")
+                    continue
+                st.write(entry.content)
+                if entry.bot_response:
+                    st.markdown("** その時のメッセージ:**")
+                    st.info(entry.bot_response)
+    
+    if visible_count < len(filtered_entries):
+        st.caption(f"{len(filtered_entries)}件中 {visible_count}件を表示しています")
+        if st.button(f"さらに{min(page_size, len(filtered_entries) - visible_count)}件を表示"):
+            st.session_state.history_visible = visible_count + page_size
+            st.rerun()
+
+def analytics_page(diary_manager: DiaryManager):
+    st.header(" 分析レポート")
+    # 集計に使うのは日時・気分・カテゴリだけなので見出しで足りる
+    entries = diary_manager.load_summaries()
+    if not entries:
+        st.info("まだ記録がありません。記録が増えると、気持ちの傾向が見えてきます。")
+        return
+    frame = analytics.entries_frame(diary_manager.entries_file, entries)
+    if frame.empty:
+        st.info("日時を読み取れる記録がありません。")
+        return
+    
+    st.subheader(" 気分の推移")
+    window = st.slider("移動平均の日数", min_value=3, max_value=30, value=7)
+    trend = analytics.rolling_mood(frame, window)
+    daily_points = alt.Chart(trend.dropna(subset=["daily_avg"])).mark_circle(opacity=0.35).encode(
+        x=alt.X("date:T", title="日付"), y=alt.Y("daily_avg:Q", title="平均気分", scale=alt.Scale(domain=[0, 5])),
+        tooltip=[alt.Tooltip("date:T", title="日付"), alt.Tooltip("daily_avg:Q", title="その日の平均", format=".1f"), alt.Tooltip("count:Q", title="記録数")])
+    rolling_line = alt.Chart(trend).mark_line().encode(x="date:T", y=alt.Y("rolling_avg:Q", title="平均気分"))
+    st.altair_chart(daily_points + rolling_line)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader(" 曜日と時間帯")
+        heatmap = analytics.weekday_hour_heatmap(frame)
+        st.altair_chart(alt.Chart(heatmap).mark_rect().encode(
+            x=alt.X("hour:O", title="時"), y=alt.Y("weekday_label:N", title="曜日", sort=analytics.WEEKDAY_LABELS),
+            color=alt.Color("avg_mood:Q", title="平均気分", scale=alt.Scale(domain=[0, 5])),
+            tooltip=[alt.Tooltip("count:Q", title="記録数"), alt.Tooltip("avg_mood:Q", title="平均気分", format=".1f")]))
+    with col2:
+        st.subheader(" カテゴリ")
+        categories = analytics.category_distribution(frame)
+        st.altair_chart(alt.Chart(categories).mark_bar().encode(
+            x=alt.X("count:Q", title="記録数"), y=alt.Y("category:N", title="カテゴリ", sort="-x"),
+            color=alt.Color("avg_mood:Q", title="平均気分", scale=alt.Scale(domain=[0, 5])),
+            tooltip=[alt.Tooltip("share:Q", title="割合", format=".0%"), alt.Tooltip("avg_mood:Q", title="平均気分", format=".1f")]))
+    
+    st.subheader(" 気持ちの移り変わり")
+    transitions = analytics.mood_transitions(frame)
+    st.altair_chart(alt.Chart(transitions).mark_rect().encode(
+        x=alt.X("to_group:N", title="次の記録", sort=analytics.MOOD_GROUP_ORDER), y=alt.Y("from_group:N", title="前の記録", sort=analytics.MOOD_GROUP_ORDER),
+        color=alt.Color("share:Q", title="割合", legend=alt.Legend(format=".0%")),
+        tooltip=[alt.Tooltip("count:Q", title="回数"), alt.Tooltip("share:Q", title="割合", format=".0%")]))
 
 def tips_page():
     st.header(" 目標達成のためのTips")
@@ -210,32 +329,54 @@ def tips_page():
             with cols[i % 2]:
                 st.markdown(f"""<div class="tip-card"><div class="tip-title">{tip['title']}</div><div class="tip-content">{tip['content']}</div></div>""", unsafe_allow_html=True)
 
-def settings_page(auth_manager: AuthManager):
+def open_settings_section(section: str):
+    st.session_state.settings_section = section
+
+def settings_page(auth_manager: AuthManager, diary_manager: DiaryManager, goal_manager: GoalManager):
     if 'settings_section' not in st.session_state:
         st.session_state.settings_section = "menu"
-    
+    settings_sections(auth_manager, diary_manager, goal_manager)
+
+EXPORT_FORMAT_LABELS = {"ndjson": "NDJSON（1行1件のJSON）", "csv": "CSV（Excel などで開けます）"}
+
+def data_section(diary_manager: DiaryManager, goal_manager: GoalManager):
+    st.header("📦 データのエクスポート・インポート")
+    st.markdown("### エクスポート")
+    st.caption("これまでの日記と目標をすべてファイルに書き出します。")
+    export_format = st.radio("形式", journal_io.EXPORT_FORMATS, format_func=EXPORT_FORMAT_LABELS.get, horizontal=True, key="export_format")
+    # ファイルはボタンが押されたときに作る
+    st.download_button("ダウンロード", data=lambda: journal_io.export_file(diary_manager, goal_manager, export_format),
+                       file_name=journal_io.export_filename(export_format), mime=journal_io.MEDIA_TYPES[export_format],
+                       on_click="ignore", type="primary")
+    st.markdown("### インポート")
+    st.caption("エクスポートしたファイルを取り込みます。取り込み済みの日記・目標は重複して登録されません。")
+    uploaded = st.file_uploader("ファイルを選択", type=["ndjson", "jsonl", "csv"], key="import_file")
+    if uploaded is not None and st.button("取り込む", key="import_button"):
+        with st.spinner("取り込んでいます..."):
+            result = journal_io.import_file(diary_manager, goal_manager, uploaded, journal_io.detect_format(uploaded.name))
+        st.success(f"日記{result['entries']}件・目標{result['goals']}件を取り込みました（登録済みのため飛ばしたもの: {result['skipped']}件）")
+        if result["failed"]:
+            st.error(f"{result['failed']}件は保存に失敗しました。時間をおいてもう一度取り込んでください")
+        if result["errors"]:
+            with st.expander(f"読み込めなかった行（{len(result['errors'])}件）"):
+                st.text("\n".join(result["errors"]))
+
+@st.fragment
+def settings_sections(auth_manager: AuthManager, diary_manager: DiaryManager, goal_manager: GoalManager):
+    # 項目の切り替えはこの中だけを描き直す。テーマとニックネームはページ全体に効くので変更時は全体を描き直す
     if st.session_state.settings_section == "menu":
         st.header(" 設定")
         st.markdown("""<div style="background: var(--card); padding: 1rem; border-radius: 12px; margin-bottom: 2rem; border: 1px solid var(--border);"><p style="margin: 0; text-align: center; color: var(--text-secondary);">設定したい項目を選択してください</p></div>""", unsafe_allow_html=True)
         col1, col2 = st.columns(2)
         with col1:
-            if st.button(" アカウント情報", use_container_width=True):
-                st.session_state.settings_section = "account"
-                st.rerun()
-            if st.button("🎨 テーマ設定", use_container_width=True):
-                st.session_state.settings_section = "theme"
-                st.rerun()
+            st.button(" アカウント情報", on_click=open_settings_section, args=("account",), width="stretch")
+            st.button("🎨 テーマ設定", on_click=open_settings_section, args=("theme",), width="stretch")
         with col2:
-            if st.button(" ニックネーム変更", use_container_width=True):
-                st.session_state.settings_section = "nickname"
-                st.rerun()
-            if st.button(" プラン・課金", use_container_width=True):
-                st.session_state.settings_section = "billing"
-                st.rerun()
+            st.button(" ニックネーム変更", on_click=open_settings_section, args=("nickname",), width="stretch")
+            st.button(" プラン・課金", on_click=open_settings_section, args=("billing",), width="stretch")
+            st.button("📦 データのエクスポート・インポート", on_click=open_settings_section, args=("data",), width="stretch")
     else:
-        if st.button("← 設定メニューに戻る", type="secondary"):
-            st.session_state.settings_section = "menu"
-            st.rerun()
+        st.button("← 設定メニューに戻る", type="secondary", on_click=open_settings_section, args=("menu",))
         if st.session_state.settings_section == "account":
             st.header(" アカウント情報")
             current_email = st.session_state.user_email
@@ -246,11 +387,9 @@ def settings_page(auth_manager: AuthManager):
                 st.info(f"** メールアドレス**\n{current_email}")
             with col2:
                 st.info(f"** ニックネーム**\n{current_nickname}")
-            auth_users = auth_manager.load_users()
-            for user in auth_users:
-                if user.email == current_email:
-                    st.markdown(f"** アカウント作成日:** {user.created_date}")
-                    break
+            user = auth_manager.get_user(current_email)
+            if user is not None:
+                st.markdown(f"** アカウント作成日:** {user.created_date}")
         elif st.session_state.settings_section == "nickname":
             st.header(" ニックネーム変更")
             current_nickname = st.session_state.user_nickname
@@ -284,6 +423,8 @@ def settings_page(auth_manager: AuthManager):
                         st.rerun()
             st.markdown("### テーマ変更の方法")
             st.info(" 画面上部の🎨ボタンでも素早くテーマを切り替えできます")
+        elif st.session_state.settings_section == "data":
+            data_section(diary_manager, goal_manager)
         elif st.session_state.settings_section == "billing":
             st.header(" プラン・課金")
             st.markdown("""<div class="plan-card"><h3> フリープラン</h3><div class="plan-price">無料</div><div class="plan-feature"> 基本的な日記機能</div><div class="plan-feature"> 目標設定機能</div><div class="plan-feature"> 心模様記録</div><div class="plan-feature"> 基本的な振り返り機能</div><p style="margin-top: 1rem; color: #28a745; font-weight: bold;">現在のプラン</p></div>""", unsafe_allow_html=True)
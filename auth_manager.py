@@ -1,16 +1,19 @@
-import streamlit as st
 import datetime
-import json
-import os
 import hashlib
 import re
-from typing import List
-from dataclasses import asdict
+from typing import List, Optional
 from data_models import User
+from storage import StorageBackend, get_backend, USERS_FILE
+from errors import ConflictError, ErrorHandler, StorageError, ValidationError, log_error
+from instrumentation import trace_methods
 
+@trace_methods("auth")
 class AuthManager:
-    def __init__(self):
-        self.users_file = "users.json"
+    def __init__(self, backend: StorageBackend = None, on_error: ErrorHandler = None):
+        self.backend = backend or get_backend()
+        # 入力の誤りと保存の失敗は on_error に渡す
+        self.on_error = on_error or log_error
+        self.users_file = USERS_FILE
     
     def hash_password(self, password: str) -> str:
         return hashlib.sha256(password.encode()).hexdigest()
@@ -28,43 +31,38 @@ class AuthManager:
     
     def load_users(self) -> List[User]:
         try:
-            if os.path.exists(self.users_file):
-                with open(self.users_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    users = []
-                    for user_data in data:
-                        if 'nickname' not in user_data:
-                            user_data['nickname'] = user_data['email'].split('@')[0]
-                        users.append(User(**user_data))
-                    return users
+            return self.backend.load_users()
         except:
             pass
         return []
     
+    def get_user(self, email: str) -> Optional[User]:
+        try:
+            return self.backend.get_user(email)
+        except:
+            return None
+    
     def save_users(self, users: List[User]):
         try:
-            with open(self.users_file, 'w', encoding='utf-8') as f:
-                json.dump([asdict(user) for user in users], f, ensure_ascii=False, indent=2)
+            self.backend.save_users(users)
         except Exception as e:
-            st.error(f"ユーザー情報の保存に失敗しました: {e}")
+            self.on_error(StorageError(f"ユーザー情報の保存に失敗しました: {e}"))
     
     def register_user(self, email: str, password: str, nickname: str) -> bool:
         if not self.validate_email(email):
-            st.error("有効なメールアドレスを入力してください")
+            self.on_error(ValidationError("有効なメールアドレスを入力してください"))
             return False
         
         if not self.validate_password(password):
-            st.error("パスワードは8文字以上で、英字と数字の両方を含む必要があります")
+            self.on_error(ValidationError("パスワードは8文字以上で、英字と数字の両方を含む必要があります"))
             return False
         
         if not nickname.strip():
-            st.error("ニックネームを入力してください")
+            self.on_error(ValidationError("ニックネームを入力してください"))
             return False
         
-        users = self.load_users()
-        
-        if any(user.email == email for user in users):
-            st.error("このメールアドレスは既に登録されています")
+        if self.get_user(email) is not None:
+            self.on_error(ValidationError("このメールアドレスは既に登録されています"))
             return False
         
         new_user = User(
@@ -74,28 +72,35 @@ class AuthManager:
             created_date=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         )
         
-        users.append(new_user)
-        self.save_users(users)
+        try:
+            self.backend.add_user(new_user)
+        except ConflictError:
+            # 確認の後に別の画面・ワーカーが同じアドレスで登録した
+            self.on_error(ValidationError("このメールアドレスは既に登録されています"))
+            return False
+        except Exception as e:
+            self.on_error(StorageError(f"ユーザー情報の保存に失敗しました: {e}"))
+            return False
         return True
     
     def authenticate_user(self, email: str, password: str) -> tuple[bool, str]:
-        users = self.load_users()
-        password_hash = self.hash_password(password)
-        
-        for user in users:
-            if user.email == email and user.password_hash == password_hash:
-                return True, user.nickname
+        user = self.get_user(email)
+        if user is not None and user.password_hash == self.hash_password(password):
+            return True, user.nickname
         return False, ""
     
     def update_nickname(self, email: str, new_nickname: str) -> bool:
         if not new_nickname.strip():
-            st.error("ニックネームを入力してください")
+            self.on_error(ValidationError("ニックネームを入力してください"))
             return False
         
-        users = self.load_users()
-        for user in users:
-            if user.email == email:
-                user.nickname = new_nickname.strip()
-                self.save_users(users)
-                return True
-        return False
\ No newline at end of file
+        user = self.get_user(email)
+        if user is None:
+            return False
+        user.nickname = new_nickname.strip()
+        try:
+            self.backend.update_user(user)
+        except Exception as e:
+            self.on_error(StorageError(f"ユーザー情報の保存に失敗しました: {e}"))
+            return False
+        return True
\ No newline at end of file
@@ -0,0 +1 @@
+# 性能計測用のスクリプト群。リポジトリのルートで python -m benchmarks.<名前> として実行する
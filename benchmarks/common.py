@@ -0,0 +1,45 @@
+"""ベンチマーク間で共有する計測と結果の出力"""
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Callable
+from data_cache import parsed_data_cache
+from group_commit import percentile
+import mood_rollups
+import search_index
+
+def measure(func: Callable, repeat: int, setup: Callable = None) -> dict:
+    """func を repeat 回呼んだ時間（ミリ秒）の要約。setup があれば毎回その戻り値を引数に渡し、setup 自体は計らない"""
+    samples = []
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+        started = time.perf_counter()
+        func(*args)
+        samples.append((time.perf_counter() - started) * 1000)
+    return {
+        "runs": repeat,
+        "median_ms": round(statistics.median(samples), 4),
+        "p95_ms": round(percentile(samples, 0.95), 4),
+        "min_ms": round(min(samples), 4),
+    }
+
+def clear_caches():
+    """プロセス内に持っているパース結果・検索索引・気分集計を捨てる（次の読み込みをファイルからにする）"""
+    parsed_data_cache.clear()
+    search_index.clear_indexes()
+    mood_rollups.clear_rollups()
+
+def environment() -> dict:
+    return {"python": sys.version.split()[0], "platform": platform.platform(), "cpus": os.cpu_count()}
+
+def write_report(report: dict, output: str = None):
+    """結果を JSON で output に書く。output がなければ標準出力に出す"""
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
@@ -0,0 +1,67 @@
+"""日記の追記をスレッドから同時に行い、グループコミットの有無でスループットと遅延を比べる。
+
+    python -m benchmarks.group_commit --threads 16 --entries 50 --windows 0,2,5
+"""
+import argparse
+import json
+import tempfile
+import threading
+import time
+from data_models import DiaryEntry
+from group_commit import percentile
+from storage import JsonBackend
+
+def run_scenario(window_ms: float, threads: int, entries: int, users: int) -> dict:
+    with tempfile.TemporaryDirectory() as data_dir:
+        backend = JsonBackend(data_dir, group_commit_ms=window_ms)
+        latencies = []
+        latencies_lock = threading.Lock()
+        start = threading.Barrier(threads)
+
+        def worker(worker_id: int):
+            user_email = f"user{worker_id % users}@example.com"
+            samples = []
+            start.wait()
+            for i in range(entries):
+                entry = DiaryEntry("2024-01-01 21:00:00", f"タイトル{worker_id}-{i}", "今日の振り返り", "穏やか", 3, "その他", id=f"{worker_id}-{i}")
+                started = time.perf_counter()
+                backend.add_entry(user_email, entry)
+                samples.append((time.perf_counter() - started) * 1000)
+            with latencies_lock:
+                latencies.extend(samples)
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        saved = sum(len(backend.load_entries(f"user{i}@example.com")) for i in range(users))
+        result = {
+            "window_ms": window_ms,
+            "users": users,
+            "saved": saved,
+            "entries_per_sec": len(latencies) / elapsed,
+            "ack_ms_p50": percentile(latencies, 0.50),
+            "ack_ms_p99": percentile(latencies, 0.99),
+        }
+        if backend.group_commit is not None:
+            result["group_commit"] = backend.group_commit.stats()
+        return result
+
+def main():
+    parser = argparse.ArgumentParser(description="グループコミットの効果を測る")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--entries", type=int, default=50, help="スレッドごとの追加件数")
+    parser.add_argument("--windows", default="0,2,5", help="まとめる待ち時間（ミリ秒、カンマ区切り。0 は無効）")
+    args = parser.parse_args()
+    report = []
+    # 1人に書き込みが集中する場合と、利用者が分かれている場合
+    for users in (1, args.threads):
+        for window_ms in [float(w) for w in args.windows.split(",")]:
+            report.append(run_scenario(window_ms, args.threads, args.entries, users))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
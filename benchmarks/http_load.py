@@ -0,0 +1,111 @@
+"""FastAPI アプリにプロセス内から（TestClient で）負荷をかけ、ルートごとのスループットと遅延を測る。
+
+各スレッドは決まった割合でルートを選んで呼ぶ。データは benchmarks.synthetic で作る。
+
+    python -m benchmarks.http_load --threads 8 --requests 200 --users 20 --entries 1000 --output http.json
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from group_commit import percentile
+from benchmarks.common import environment, write_report
+from benchmarks.synthetic import CATEGORIES, MOODS, diary_text, populate, user_email
+
+# ルートと選ばれる重み
+ROUTE_WEIGHTS = {
+    "get_diary_history": 40,
+    "get_diary_history.summary": 20,
+    "get_goals": 15,
+    "sync": 15,
+    "save_diary": 10,
+}
+
+def send(client, route: str, email: str, rng: random.Random):
+    if route == "get_diary_history":
+        return client.get(f"/get_diary_history/{email}", params={"limit": 50})
+    if route == "get_diary_history.summary":
+        return client.get(f"/get_diary_history/{email}", params={"limit": 50, "fields": "id,date,title,mood"})
+    if route == "get_goals":
+        return client.get(f"/get_goals/{email}")
+    if route == "sync":
+        return client.get(f"/sync/{email}", params={"limit": 100})
+    mood = rng.choice(MOODS)
+    return client.post("/save_diary/", json={"title": "今日のこと", "content": diary_text(rng, 3), "mood": mood["name"],
+                                             "mood_intensity": mood["intensity"], "category": rng.choice(CATEGORIES), "user_email": email})
+
+def run_load(threads: int, requests_per_thread: int, users: int, seed: int) -> dict:
+    from fastapi.testclient import TestClient
+    import api1
+    client = TestClient(api1.app)
+    routes, weights = list(ROUTE_WEIGHTS), list(ROUTE_WEIGHTS.values())
+    latencies = {route: [] for route in routes}
+    statuses = {}
+    lock = threading.Lock()
+    start = threading.Barrier(threads)
+
+    def worker(worker_id: int):
+        rng = random.Random(f"{seed}:worker:{worker_id}")
+        samples = []
+        start.wait()
+        for _ in range(requests_per_thread):
+            route = rng.choices(routes, weights)[0]
+            started = time.perf_counter()
+            response = send(client, route, user_email(rng.randrange(users)), rng)
+            samples.append((route, (time.perf_counter() - started) * 1000, response.status_code))
+        with lock:
+            for route, ms, status in samples:
+                latencies[route].append(ms)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    # 一時ディレクトリを消す前に、保存で予約されたボットの応答の書き込みを終わらせる
+    api1.job_queue.executor.shutdown(wait=True)
+    total = threads * requests_per_thread
+    return {
+        "requests": total,
+        "requests_per_sec": round(total / elapsed, 2),
+        "statuses": statuses,
+        "routes": {route: {"requests": len(samples), "p50_ms": round(percentile(samples, 0.50), 3),
+                           "p99_ms": round(percentile(samples, 0.99), 3)} for route, samples in latencies.items() if samples},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="API にプロセス内から負荷をかける")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="スレッドごとのリクエスト数")
+    parser.add_argument("--users", type=int, default=20, help="日記を持つ利用者の数")
+    parser.add_argument("--entries", type=int, default=1000, help="利用者ごとの日記の件数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="結果の JSON を書き出すファイル（省略時は標準出力）")
+    args = parser.parse_args()
+    # ボットは遅延なしのスタブにし、データは一時ディレクトリに書く
+    os.environ.setdefault("DIARY_BOT_MODEL", "local")
+    sys.path.insert(0, os.getcwd())
+    output = os.path.abspath(args.output) if args.output else None
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.chdir(data_dir)
+        from storage import get_backend
+        populate(get_backend(), args.users, args.entries, seed=args.seed)
+        report = {
+            "benchmark": "http_load",
+            "threads": args.threads,
+            "users": args.users,
+            "entries_per_user": args.entries,
+            "seed": args.seed,
+            "environment": environment(),
+            "load": run_load(args.threads, args.requests, args.users, args.seed),
+        }
+    write_report(report, output)
+
+if __name__ == "__main__":
+    main()
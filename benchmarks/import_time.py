@@ -0,0 +1,87 @@
+"""API ワーカーの起動コストを測る。
+
+各対象を新しいプロセスで python -X importtime 付きで import し、
+import にかかった時間（importtime の累計）、プロセス全体の経過時間、最大 RSS を中央値で報告する。
+"api1 + streamlit" は streamlit を読み込んでいた頃の API ワーカーに相当する。
+
+    python -m benchmarks.import_time --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TARGETS = {
+    "api1": ["api1"],
+    "api1 + streamlit": ["streamlit", "api1"],
+    "data_manager": ["data_manager"],
+    "auth_manager": ["auth_manager"],
+    "streamlit": ["streamlit"],
+}
+
+CHILD_CODE = """
+import resource, sys
+{imports}
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, int('streamlit' in sys.modules), len(sys.modules))
+"""
+
+def parse_importtime(stderr: str) -> int:
+    """-X importtime の出力から、最上位の import の累計時間（マイクロ秒）を合計する"""
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith("  "):
+            # 先頭の空白1つは区切り、それより深いものは入れ子の import
+            total += int(cumulative)
+    return total
+
+def measure(modules: list) -> dict:
+    code = CHILD_CODE.format(imports="\n".join(f"import {module}" for module in modules))
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    elapsed = time.perf_counter() - started
+    rss_kb, has_streamlit, module_count = map(int, result.stdout.split())
+    return {
+        "import_ms": parse_importtime(result.stderr) / 1000,
+        "process_ms": elapsed * 1000,
+        "max_rss_mb": rss_kb / 1024,
+        "modules": module_count,
+        "loads_streamlit": bool(has_streamlit),
+    }
+
+def run(repeat: int) -> dict:
+    report = {}
+    for name, modules in TARGETS.items():
+        samples = [measure(modules) for _ in range(repeat)]
+        report[name] = {
+            "import_ms": statistics.median(s["import_ms"] for s in samples),
+            "process_ms": statistics.median(s["process_ms"] for s in samples),
+            "max_rss_mb": statistics.median(s["max_rss_mb"] for s in samples),
+            "modules": samples[-1]["modules"],
+            "loads_streamlit": samples[-1]["loads_streamlit"],
+        }
+    before, after = report["api1 + streamlit"], report["api1"]
+    report["api_worker_savings"] = {
+        "import_ms": before["import_ms"] - after["import_ms"],
+        "max_rss_mb": before["max_rss_mb"] - after["max_rss_mb"],
+    }
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="API ワーカーの import 時間と RSS を測る")
+    parser.add_argument("--repeat", type=int, default=5, help="対象ごとの計測回数（中央値を報告）")
+    args = parser.parse_args()
+    report = run(args.repeat)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if report["api1"]["loads_streamlit"]:
+        sys.exit("api1 が streamlit を読み込んでいます")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""DiaryManager / GoalManager / AuthManager の全メソッドと sync_changes を、日記の件数と利用者数を変えて測る。
+
+読み込み系はキャッシュを捨ててから読む cold と、続けて読む warm の両方を測る。
+データは benchmarks.synthetic で作るので、同じ seed なら同じデータで比べられる。
+
+    python -m benchmarks.managers --sizes 10,1000,50000 --users 100000 --output managers.json
+"""
+import argparse
+import os
+import tempfile
+from dataclasses import replace
+from auth_manager import AuthManager
+from data_manager import DiaryManager, GoalManager, sync_changes
+from data_models import Goal
+from storage import JsonBackend, SqliteBackend
+from benchmarks.common import clear_caches, environment, measure, write_report
+from benchmarks.synthetic import PASSWORD, generate_entries, populate, user_email
+
+class Fixture:
+    """1回分の計測に使うバックエンドとマネージャー。作り直すとバックエンドが持つ利用者の表なども空になる"""
+
+    def __init__(self, backend_name: str, data_dir: str, email: str):
+        if backend_name == "sqlite":
+            self.backend = SqliteBackend(os.path.join(data_dir, "diary.sqlite3"))
+        else:
+            self.backend = JsonBackend(data_dir)
+        self.email = email
+        self.diary = DiaryManager(email, self.backend)
+        self.goals = GoalManager(email, self.backend)
+        self.auth = AuthManager(self.backend)
+
+# (名前, 計る処理, 読み込みだけか)。読み込みだけのものは cold も測る
+def cases(size: int, seed: int) -> list:
+    # 追加用の日記は既存のものと id が重ならないように別の seed で作る
+    extra = generate_entries("extra@example.com", 1, seed + 1)[0]
+    counter = iter(range(10 ** 9))
+
+    def new_entry(f: Fixture):
+        return replace(extra, id=f"bench-{next(counter)}", user_email=f.email)
+
+    def add_then_delete_goal(f: Fixture):
+        goal_id = f"bench-goal-{next(counter)}"
+        f.goals.add_goal(Goal(goal_id, "計測用の目標", "", "week", "2030-12-31", "2024-01-01 00:00:00", f.email))
+        return goal_id
+
+    registered = user_email(0)
+    return [
+        ("diary.load_entries", lambda f: f.diary.load_entries(), True),
+        ("diary.load_summaries", lambda f: f.diary.load_summaries(), True),
+        ("diary.load_entry", lambda f: f.diary.load_entry(f.diary.load_summaries()[size // 2]), True),
+        ("diary.entries_version", lambda f: f.diary.entries_version(), True),
+        ("diary.search_entries", lambda f: f.diary.search_entries("疲れ"), True),
+        ("diary.load_rollups", lambda f: f.diary.load_rollups(), True),
+        ("diary.add_entry", lambda f: f.diary.add_entry(new_entry(f)), False),
+        ("diary.add_entries", lambda f: f.diary.add_entries([new_entry(f) for _ in range(50)]), False),
+        ("diary.update_bot_response", lambda f: f.diary.update_bot_response(f.diary.load_entries()[-1], "応援しています。"), False),
+        ("diary.save_entries", lambda f: f.diary.save_entries(f.diary.load_entries()), False),
+        ("diary.compact", lambda f: f.diary.compact(), False),
+        ("goals.load_goals", lambda f: f.goals.load_goals(), True),
+        ("goals.goals_version", lambda f: f.goals.goals_version(), True),
+        ("goals.save_goals", lambda f: f.goals.save_goals(f.goals.load_goals()), False),
+        ("goals.add_goal+delete_goal", lambda f: f.goals.delete_goal(add_then_delete_goal(f)), False),
+        ("sync_changes.reset", lambda f: sync_changes(f.diary, f.goals), True),
+        ("sync_changes.delta", lambda f: sync_changes(f.diary, f.goals, f.diary.change_log.current_token()), True),
+        ("auth.hash_password", lambda f: f.auth.hash_password(PASSWORD), True),
+        ("auth.validate_email", lambda f: f.auth.validate_email(registered), True),
+        ("auth.validate_password", lambda f: f.auth.validate_password(PASSWORD), True),
+        ("auth.load_users", lambda f: f.auth.load_users(), True),
+        ("auth.get_user", lambda f: f.auth.get_user(registered), True),
+        ("auth.authenticate_user", lambda f: f.auth.authenticate_user(registered, PASSWORD), True),
+        ("auth.register_user", lambda f: f.auth.register_user(f"new{next(counter)}@example.com", PASSWORD, "新規"), False),
+        ("auth.update_nickname", lambda f: f.auth.update_nickname(registered, "ニックネーム"), False),
+        ("auth.save_users", lambda f: f.auth.save_users(f.auth.load_users()), False),
+    ]
+
+def run_size(backend_name: str, size: int, users: int, repeat: int, cold_repeat: int, seed: int, only: list) -> dict:
+    with tempfile.TemporaryDirectory() as data_dir:
+        email = user_email(0)
+        populate(Fixture(backend_name, data_dir, email).backend, users, size, seed=seed, entry_users=1)
+        warm = Fixture(backend_name, data_dir, email)
+        results = {}
+        for name, func, read_only in cases(size, seed):
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+            # 1回目はファイルの読み込みを含むので warm には数えない
+            func(warm)
+            result = {"warm": measure(lambda: func(warm), repeat)}
+            if read_only:
+                def cold():
+                    clear_caches()
+                    return (Fixture(backend_name, data_dir, email),)
+                result["cold"] = measure(func, cold_repeat, setup=cold)
+            results[name] = result
+        return {"entries_per_user": size, "users": users, "results": results}
+
+def main():
+    parser = argparse.ArgumentParser(description="マネージャーの各メソッドを測る")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--sizes", default="10,1000", help="利用者あたりの日記の件数（カンマ区切り。50000 も指定できる）")
+    parser.add_argument("--users", type=int, default=1000, help="users ファイルに登録する利用者の数")
+    parser.add_argument("--repeat", type=int, default=20, help="warm で繰り返す回数")
+    parser.add_argument("--cold-repeat", type=int, default=5, help="cold で繰り返す回数")
+    parser.add_argument("--only", default="", help="この接頭辞で始まる計測だけを行う（カンマ区切り。例: diary.load,auth.）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="結果の JSON を書き出すファイル（省略時は標準出力）")
+    args = parser.parse_args()
+    only = [prefix for prefix in args.only.split(",") if prefix]
+    report = {
+        "benchmark": "managers",
+        "backend": args.backend,
+        "seed": args.seed,
+        "environment": environment(),
+        "runs": [run_size(args.backend, int(size), args.users, args.repeat, args.cold_repeat, args.seed, only)
+                 for size in args.sizes.split(",")],
+    }
+    write_report(report, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""API に同時にリクエストを送ってから /metrics を取得し、Prometheus のテキスト形式として正しいかを確かめる。
+
+あわせて、指標の記録がスレッド間で取りこぼしなく数えられるかと、その速さも測る。
+形式と取りこぼしの確かめ方は tests/test_metrics.py のものを使う（pytest ではそちらが小さい規模で走る）。
+
+    python -m benchmarks.metrics_scrape --threads 8 --requests 50
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from tests.test_metrics import check_concurrent_records, check_histograms, parse_exposition, request_count
+
+def scrape_check(threads: int, requests_per_thread: int) -> dict:
+    from fastapi.testclient import TestClient
+    import api1
+    client = TestClient(api1.app)
+    errors = []
+
+    def worker(worker_id: int):
+        user_email = f"user{worker_id}@example.com"
+        try:
+            for i in range(requests_per_thread):
+                if i % 5 == 0:
+                    client.post("/save_diary/", json={"title": f"記録{i}", "content": "今日は仕事で疲れた", "mood": "穏やか",
+                                                      "mood_intensity": 3, "category": "仕事・学業", "user_email": user_email})
+                else:
+                    client.get(f"/get_diary_history/{user_email}", params={"limit": 10})
+        except Exception as e:
+            errors.append(repr(e))
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    response = client.get("/metrics")
+    assert response.status_code == 200 and response.headers["content-type"].startswith("text/plain")
+    families = parse_exposition(response.text)
+    check_histograms(families)
+    counted = request_count(families)
+    assert counted == threads * requests_per_thread, f"リクエスト数が合いません: {counted} != {threads * requests_per_thread}"
+    return {
+        "requests": threads * requests_per_thread,
+        "requests_per_sec": threads * requests_per_thread / elapsed,
+        "errors": errors,
+        "families": sorted(families),
+        "storage_read_bytes": families["diary_storage_read_bytes_total"]["samples"][0][2],
+        "storage_written_bytes": families["diary_storage_written_bytes_total"]["samples"][0][2],
+    }
+
+def contention_check(threads: int, increments: int) -> dict:
+    """同じ指標を全スレッドから記録し、合計が合うか（tests/test_metrics.py と同じ確認）と1回あたりの時間を見る"""
+    elapsed = check_concurrent_records(threads, increments)
+    return {"threads": threads, "records": threads * increments * 2, "ns_per_record": elapsed / (threads * increments * 2) * 1e9}
+
+def main():
+    parser = argparse.ArgumentParser(description="/metrics の出力を確かめる")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=50, help="スレッドごとのリクエスト数")
+    parser.add_argument("--increments", type=int, default=100000, help="取りこぼし確認でスレッドごとに記録する回数")
+    args = parser.parse_args()
+    # ボットは遅延なしのスタブにし、データは一時ディレクトリに書く
+    os.environ.setdefault("DIARY_BOT_MODEL", "local")
+    sys.path.insert(0, os.getcwd())
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.chdir(data_dir)
+        report = {"scrape": scrape_check(args.threads, args.requests), "contention": contention_check(args.threads, args.increments)}
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
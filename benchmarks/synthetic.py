@@ -0,0 +1,103 @@
+"""計測用の合成データ。同じ seed からは常に同じ利用者・日記・目標ができる。
+
+本文は日本語の文の断片をつなげて作り、気持ちは MOOD_OPTIONS、カテゴリは画面の選択肢から選ぶ。
+
+    python -m benchmarks.synthetic --data-dir /tmp/diary --users 3 --entries 1000
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import random
+from typing import List
+from data_models import DiaryEntry, Goal, User, MOOD_OPTIONS
+from storage import JsonBackend, StorageBackend
+
+# 日記を書く画面のカテゴリの選択肢
+CATEGORIES = ["仕事・学業", "人間関係", "恋愛", "家族", "健康", "その他"]
+MOODS = [mood for moods in MOOD_OPTIONS.values() for mood in moods]
+# 合成した利用者のパスワード（authenticate_user の計測に使う）
+PASSWORD = "password123"
+
+OPENINGS = ["今日は", "朝から", "昼休みに", "仕事の後で", "夜になって", "久しぶりに", "週末は", "帰り道で"]
+EVENTS = [
+    "会議で自分の意見を言えた", "残業が続いて少し疲れている", "友人と長電話をした", "家族と夕食を囲んだ",
+    "ジョギングを三十分続けた", "締め切りに追われて焦った", "新しい本を読み始めた", "眠れない夜が続いている",
+    "上司に仕事を褒められた", "恋人とささいなことで喧嘩した", "試験勉強がはかどらなかった", "部屋の片付けをした",
+    "英語の単語を二十個覚えた", "同僚の相談に乗った", "頭痛がして早めに休んだ", "久しぶりに料理をした",
+]
+FEELINGS = [
+    "少し気持ちが軽くなった", "まだもやもやしている", "自分を褒めてあげたい", "明日はもっとうまくやりたい",
+    "思っていたより楽しかった", "どうしても不安が消えない", "小さな達成感があった", "ゆっくり休みたいと思った",
+]
+REFLECTIONS = [
+    "目標に向けて一歩ずつ進めている気がする。", "無理をしすぎないように気をつけたい。", "感謝の気持ちを忘れないようにしたい。",
+    "できなかったことより、できたことを数えよう。", "周りの人に助けられていると感じた。", "明日の朝は少し早起きしてみる。",
+]
+TITLES = ["振り返り", "今日のこと", "小さな一歩", "疲れた日", "うれしかったこと", "考えたこと", "がんばった日", "ひとやすみ"]
+GOAL_TITLES = ["英語の勉強を習慣化する", "毎朝ストレッチをする", "週に三回走る", "本を月に二冊読む", "早寝早起きを続ける", "日記を毎日書く"]
+
+def diary_text(rng: random.Random, sentences: int) -> str:
+    parts = []
+    for _ in range(sentences):
+        parts.append(f"{rng.choice(OPENINGS)}{rng.choice(EVENTS)}。{rng.choice(FEELINGS)}。")
+    parts.append(rng.choice(REFLECTIONS))
+    return "".join(parts)
+
+def user_email(index: int) -> str:
+    return f"user{index:06d}@example.com"
+
+def generate_entries(email: str, count: int, seed: int = 0, sentences: int = 4) -> List[DiaryEntry]:
+    """1利用者分の日記を古い順に count 件作る（1日に1〜2件、2020-01-01 から）"""
+    rng = random.Random(f"{seed}:{email}:entries")
+    day = datetime.datetime(2020, 1, 1, 7, 0, 0)
+    entries = []
+    for i in range(count):
+        day += datetime.timedelta(hours=rng.choice([12, 24, 36]), minutes=rng.randrange(60))
+        mood = rng.choice(MOODS)
+        entries.append(DiaryEntry(
+            date=day.strftime("%Y-%m-%d %H:%M:%S"), title=f"{rng.choice(TITLES)} {i + 1}",
+            content=diary_text(rng, rng.randint(max(sentences - 2, 1), sentences + 2)),
+            mood=mood['name'], mood_intensity=mood['intensity'], category=rng.choice(CATEGORIES),
+            user_email=email, id=hashlib.md5(f"{seed}:{email}:{i}".encode()).hexdigest(),
+        ))
+    return entries
+
+def generate_goals(email: str, count: int, seed: int = 0) -> List[Goal]:
+    rng = random.Random(f"{seed}:{email}:goals")
+    return [Goal(id=hashlib.md5(f"{seed}:{email}:goal:{i}".encode()).hexdigest(), title=rng.choice(GOAL_TITLES), description="",
+                 category=rng.choice(["day", "week", "month", "year"]), deadline="2030-12-31", created_date="2024-01-01 00:00:00",
+                 user_email=email) for i in range(count)]
+
+def generate_users(count: int, seed: int = 0) -> List[User]:
+    # パスワードのハッシュは全員同じなので一度だけ計算する
+    password_hash = hashlib.sha256(PASSWORD.encode()).hexdigest()
+    rng = random.Random(f"{seed}:users")
+    return [User(email=user_email(i), password_hash=password_hash, nickname=f"ユーザー{i}",
+                 created_date=f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 12:00:00") for i in range(count)]
+
+def populate(backend: StorageBackend, users: int, entries_per_user: int, goals_per_user: int = 3,
+             seed: int = 0, entry_users: int = None) -> List[str]:
+    """users 人を登録し、先頭の entry_users 人（既定は全員）に日記と目標を書き込む。書き込んだ利用者のメールアドレスを返す"""
+    backend.save_users(generate_users(users, seed))
+    emails = [user_email(i) for i in range(users if entry_users is None else min(entry_users, users))]
+    for email in emails:
+        # 1件ずつ追記せず、スナップショットとして一度に書く
+        backend.save_entries(email, generate_entries(email, entries_per_user, seed))
+        backend.save_goals(email, generate_goals(email, goals_per_user, seed))
+    return emails
+
+def main():
+    parser = argparse.ArgumentParser(description="合成データを書き出す")
+    parser.add_argument("--data-dir", required=True)
+    parser.add_argument("--users", type=int, default=3)
+    parser.add_argument("--entries", type=int, default=1000, help="利用者ごとの日記の件数")
+    parser.add_argument("--entry-users", type=int, default=None, help="日記を書き込む利用者の数（既定は全員）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    emails = populate(JsonBackend(args.data_dir), args.users, args.entries, seed=args.seed, entry_users=args.entry_users)
+    print(json.dumps({"data_dir": args.data_dir, "users": args.users, "entry_users": len(emails), "entries_per_user": args.entries,
+                      "seed": args.seed}, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
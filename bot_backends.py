@@ -0,0 +1,256 @@
+import json
+import os
+import re
+import threading
+import time
+import tomllib
+import unicodedata
+from collections import OrderedDict
+from typing import Iterator, Optional
+import requests
+from requests.adapters import HTTPAdapter
+
+# 既定値。環境変数 DIARY_LLM_* で変更できる
+DEFAULT_LLM_BASE_URL = "https://api.openai.com/v1"
+DEFAULT_LLM_MODEL = "gpt-4o-mini"
+DEFAULT_LLM_TIMEOUT = 20.0
+DEFAULT_LLM_RETRIES = 2
+DEFAULT_LLM_POOL_SIZE = 8
+DEFAULT_RESPONSE_CACHE_SIZE = 1024
+# 再試行する HTTP ステータス
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+SYSTEM_PROMPT = (
+    "あなたは習慣化ジャーナルのカウンセラーです。利用者の日記を読み、"
+    "気持ちに寄り添いながら、具体的で前向きな助言を日本語で3〜4文で返してください。"
+)
+
+_api_key = None
+_api_key_lock = threading.Lock()
+
+# st.secrets と同じ場所にある secrets.toml（後に読んだものが優先）
+SECRETS_PATHS = (os.path.join(os.path.expanduser("~"), ".streamlit", "secrets.toml"), os.path.join(".streamlit", "secrets.toml"))
+
+def read_secret(name: str) -> str:
+    """streamlit を読み込まずに secrets.toml から値を読む（API のワーカーを軽く保つため）"""
+    value = ""
+    for path in SECRETS_PATHS:
+        try:
+            with open(path, 'rb') as f:
+                value = tomllib.load(f).get(name, value)
+        except (OSError, tomllib.TOMLDecodeError):
+            continue
+    return value
+
+def get_api_key() -> str:
+    """API キーをプロセスで一度だけ読む（環境変数 OPENAI_API_KEY、なければ secrets.toml）"""
+    global _api_key
+    with _api_key_lock:
+        if _api_key is None:
+            _api_key = os.environ.get("OPENAI_API_KEY", "") or read_secret("OPENAI_API_KEY")
+        return _api_key
+
+def cache_key(content: str, mood: str, mood_intensity: int, category: str) -> tuple:
+    # 全角半角と空白の揺れは同じ日記として扱う
+    normalized = re.sub(r"\s+", " ", unicodedata.normalize("NFKC", content)).strip()
+    return (normalized, mood, int(mood_intensity), category)
+
+class ResponseCache:
+    """応答のプロセス共通 LRU キャッシュ"""
+
+    def __init__(self, max_items: int = DEFAULT_RESPONSE_CACHE_SIZE):
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[str]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: tuple, value: str):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "items": len(self._items),
+                "max_items": self.max_items,
+            }
+
+class StubCounselingModel:
+    """外部モデルの代わりに使うローカルのモデル。delay 秒かけてルールベースの応答を chunk_size 文字ずつ返す"""
+
+    def __init__(self, delay: float = 1.0, fail: bool = False, chunk_size: int = 4):
+        self.delay = delay
+        self.fail = fail
+        self.chunk_size = chunk_size
+
+    def stream(self, bot, content: str, mood: str, mood_intensity: int, category: str, timeout: float = None) -> Iterator[str]:
+        text = bot.get_counseling_response(content, mood, mood_intensity, category)
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+        step = self.delay / max(len(chunks), 1)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for i, chunk in enumerate(chunks):
+            if deadline is not None and time.monotonic() + step > deadline:
+                time.sleep(max(deadline - time.monotonic(), 0))
+                raise TimeoutError("応答の生成が時間内に終わりませんでした")
+            time.sleep(step)
+            if self.fail and i == len(chunks) // 2:
+                raise RuntimeError("スタブモデルの応答に失敗しました")
+            yield chunk
+
+    def generate(self, bot, content: str, mood: str, mood_intensity: int, category: str, timeout: float = None) -> str:
+        return "".join(self.stream(bot, content, mood, mood_intensity, category, timeout))
+
+class OpenAIChatModel:
+    """OpenAI 互換の Chat Completions API を呼ぶモデル。
+
+    HTTP 接続はプロセスで1つのセッションを使い回し、接続プールに保持する。
+    締め切り（timeout 秒）の範囲で、接続エラーと 429 / 5xx は指数バックオフで再試行する。
+    """
+
+    def __init__(self, api_key: str, model: str = DEFAULT_LLM_MODEL, base_url: str = DEFAULT_LLM_BASE_URL,
+                 timeout: float = DEFAULT_LLM_TIMEOUT, retries: int = DEFAULT_LLM_RETRIES, pool_size: int = DEFAULT_LLM_POOL_SIZE):
+        self.model = model
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.timeout = timeout
+        self.retries = retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"})
+
+    def _payload(self, content: str, mood: str, mood_intensity: int, category: str) -> dict:
+        return {
+            "model": self.model,
+            "stream": True,
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": f"カテゴリ: {category}\n気持ち: {mood}（強さ {mood_intensity}/5）\n\n{content}"},
+            ],
+        }
+
+    def _open(self, payload: dict, deadline: float) -> requests.Response:
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("応答の生成が時間内に終わりませんでした")
+            try:
+                response = self.session.post(self.url, json=payload, stream=True, timeout=(min(remaining, 5.0), remaining))
+            except (requests.ConnectionError, requests.Timeout):
+                response = None
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                response.raise_for_status()
+                return response
+            if response is not None:
+                response.close()
+            if attempt >= self.retries:
+                if response is None:
+                    raise TimeoutError("モデルに接続できませんでした")
+                response.raise_for_status()
+            time.sleep(min(0.5 * 2 ** attempt, max(deadline - time.monotonic(), 0)))
+            attempt += 1
+
+    def stream(self, bot, content: str, mood: str, mood_intensity: int, category: str, timeout: float = None) -> Iterator[str]:
+        deadline = time.monotonic() + min(timeout if timeout is not None else self.timeout, self.timeout)
+        with self._open(self._payload(content, mood, mood_intensity, category), deadline) as response:
+            for line in response.iter_lines(decode_unicode=True):
+                if time.monotonic() > deadline:
+                    raise TimeoutError("応答の生成が時間内に終わりませんでした")
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    return
+                delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+
+    def generate(self, bot, content: str, mood: str, mood_intensity: int, category: str, timeout: float = None) -> str:
+        return "".join(self.stream(bot, content, mood, mood_intensity, category, timeout))
+
+class CachedModel:
+    """同じ日記への応答をキャッシュから返すラッパー。生成に成功した応答だけを保存する"""
+
+    def __init__(self, model, cache: ResponseCache):
+        self.model = model
+        self.cache = cache
+
+    def stream(self, bot, content: str, mood: str, mood_intensity: int, category: str, timeout: float = None) -> Iterator[str]:
+        key = cache_key(content, mood, mood_intensity, category)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+        if hasattr(self.model, "stream"):
+            chunks = []
+            for chunk in self.model.stream(bot, content, mood, mood_intensity, category, timeout):
+                chunks.append(chunk)
+                yield chunk
+            text = "".join(chunks)
+        else:
+            text = self.model.generate(bot, content, mood, mood_intensity, category, timeout)
+            yield text
+        self.cache.put(key, text)
+
+    def generate(self, bot, content: str, mood: str, mood_intensity: int, category: str, timeout: float = None) -> str:
+        return "".join(self.stream(bot, content, mood, mood_intensity, category, timeout))
+
+response_cache = ResponseCache(int(os.environ.get("DIARY_BOT_CACHE_SIZE", DEFAULT_RESPONSE_CACHE_SIZE)))
+
+def create_model():
+    """DIARY_BOT_MODEL でモデルを選ぶ。
+
+    openai: OpenAI 互換 API / stub: 遅い外部モデルを模したスタブ / local: 遅延なしの決定的なスタブ /
+    rule: ルールベースのみ（None）。未指定なら API キーがあるときだけ openai を使う。
+    """
+    provider = os.environ.get("DIARY_BOT_MODEL", "")
+    if provider == "stub":
+        model = StubCounselingModel(delay=float(os.environ.get("DIARY_BOT_STUB_DELAY", "1.0")))
+    elif provider == "local":
+        model = StubCounselingModel(delay=0)
+    elif provider == "openai" or (provider == "" and get_api_key()):
+        model = OpenAIChatModel(
+            get_api_key(),
+            model=os.environ.get("DIARY_LLM_MODEL", DEFAULT_LLM_MODEL),
+            base_url=os.environ.get("DIARY_LLM_BASE_URL", DEFAULT_LLM_BASE_URL),
+            timeout=float(os.environ.get("DIARY_LLM_TIMEOUT", DEFAULT_LLM_TIMEOUT)),
+            retries=int(os.environ.get("DIARY_LLM_RETRIES", DEFAULT_LLM_RETRIES)),
+            pool_size=int(os.environ.get("DIARY_LLM_POOL_SIZE", DEFAULT_LLM_POOL_SIZE)),
+        )
+    else:
+        return None
+    if response_cache.max_items > 0:
+        model = CachedModel(model, response_cache)
+    return model
+
+_model = None
+_model_created = False
+_model_lock = threading.Lock()
+
+def get_model():
+    """プロセス共通のモデル。HTTP クライアントとキャッシュは最初の呼び出しで一度だけ作る"""
+    global _model, _model_created
+    with _model_lock:
+        if not _model_created:
+            _model = create_model()
+            _model_created = True
+        return _model
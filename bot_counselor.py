@@ -1,11 +1,56 @@
-import streamlit as st
+from typing import Iterator
+from bot_backends import StubCounselingModel, get_api_key, get_model
+from keyword_automaton import KeywordAutomaton
+from instrumentation import trace_methods
 
+# 本文から読み取るテーマとキーワード
+THEME_KEYWORDS = {
+    "睡眠": ["眠れ", "寝れな", "寝られな", "寝不足", "睡眠", "不眠", "夜更かし", "徹夜", "寝つけ", "寝付け", "夜中に目が覚め", "朝起きられ"],
+    "試験": ["試験", "テスト", "受験", "模試", "期末", "中間考査", "資格", "入試", "追試", "赤点", "レポート提出", "単位"],
+    "残業": ["残業", "終電", "休日出勤", "長時間労働", "激務", "持ち帰り", "仕事が終わらな", "定時で帰れな", "サービス残業", "締め切り", "締切"],
+    "人間関係": ["上司", "同僚", "部下", "先輩", "後輩", "友達", "友人", "喧嘩", "けんか", "陰口", "無視され", "いじめ", "仲間外れ", "気まず"],
+}
+
+THEME_ADVICE = {
+    "睡眠": "眠れない夜が続くと心も疲れやすくなります。寝る前の1時間は画面から離れて、同じ時間に布団に入ることから試してみてください。",
+    "試験": "試験前は不安になって当然です。範囲を小さく区切って「今日はここまで」と決めると、積み重ねが目に見えて安心につながります。",
+    "残業": "遅くまで本当にお疲れ様です。帰宅後は仕事のことを考えない時間を少しでも作り、体を休めることを優先してください。",
+    "人間関係": "相手の言動に心が揺れるのは、あなたが人を大切にしている証拠です。感じたことを書き出して、距離の取り方を一緒に考えていきましょう。",
+}
+
+# 起動時に一度だけ組み立てる
+THEME_MATCHER = KeywordAutomaton({keyword: theme for theme, keywords in THEME_KEYWORDS.items() for keyword in keywords})
+# 応答に添えるテーマの数
+MAX_THEMES = 2
+
+def detect_themes(content: str) -> list:
+    """本文に多く現れたテーマから順に返す（同数なら THEME_KEYWORDS の順）"""
+    counts = THEME_MATCHER.count_labels(content)
+    order = list(THEME_KEYWORDS)
+    return sorted(counts, key=lambda theme: (-counts[theme], order.index(theme)))[:MAX_THEMES]
+
+@trace_methods("bot")
 class CounselingBot:
-    def __init__(self):
-        try:
-            self.api_key = st.secrets.get("OPENAI_API_KEY", "")
-        except:
-            self.api_key = ""
+    def __init__(self, model=None):
+        # キーとモデル（HTTP クライアント・応答キャッシュ）はプロセスで一度だけ用意する
+        self.api_key = get_api_key()
+        # 応答に時間のかかるモデル。None ならルールベースの応答をその場で返す
+        self.model = model if model is not None else get_model()
+    
+    def generate_response(self, content: str, mood: str, mood_intensity: int, category: str, timeout: float = None) -> str:
+        """バックグラウンドのワーカーから呼ぶ入口。timeout 秒を超えたら TimeoutError"""
+        if self.model is None:
+            return self.get_counseling_response(content, mood, mood_intensity, category)
+        return self.model.generate(self, content, mood, mood_intensity, category, timeout)
+    
+    def stream_response(self, content: str, mood: str, mood_intensity: int, category: str, timeout: float = None) -> Iterator[str]:
+        """応答を少しずつ返すジェネレータ。ストリーミングできないモデルは全文を1回で返す"""
+        if self.model is None:
+            yield self.get_counseling_response(content, mood, mood_intensity, category)
+        elif hasattr(self.model, "stream"):
+            yield from self.model.stream(self, content, mood, mood_intensity, category, timeout)
+        else:
+            yield self.model.generate(self, content, mood, mood_intensity, category, timeout)
         
     def get_counseling_response(self, content: str, mood: str, mood_intensity: int, category: str) -> str:
         intensity_responses = {
@@ -30,4 +75,16 @@ class CounselingBot:
         
         advice = category_advice.get(category, "あなたなりのペースで、ゆっくりと歩んでいけば大丈夫です。")
         
-        return f"{base_response}\n\n{advice}\n\n今日も一日お疲れ様でした。あなたの成長を応援しています。"
\ No newline at end of file
+        # 本文に書かれたテーマに合わせた助言を添える
+        theme_advice = "".join(f"{THEME_ADVICE[theme]}\n\n" for theme in detect_themes(content))
+        
+        return f"{base_response}\n\n{theme_advice}{advice}\n\n今日も一日お疲れ様でした。あなたの成長を応援しています。"
+
+_bot = None
+
+def get_counseling_bot() -> CounselingBot:
+    """プロセス共通のボット。再実行のたびに作り直さない"""
+    global _bot
+    if _bot is None:
+        _bot = CounselingBot()
+    return _bot
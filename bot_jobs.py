@@ -0,0 +1,194 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
+from data_models import DiaryEntry
+from bot_counselor import CounselingBot, get_counseling_bot
+from data_manager import DiaryManager
+from errors import raise_error
+from instrumentation import trace_methods
+from metrics import BOT_CALL_SECONDS
+
+# 同時に応答を生成するワーカー数と、1件あたりの制限時間（秒）
+DEFAULT_BOT_WORKERS = 4
+DEFAULT_BOT_TIMEOUT = 30.0
+# 待ち行列に積める件数。あふれた分はその場でルールベースの応答を書き込む
+DEFAULT_BOT_MAX_PENDING = 64
+# 状態を覚えておくジョブの数（古い完了済みのものから忘れる）
+MAX_TRACKED_JOBS = 1000
+
+FINISHED_STATUSES = ("done", "timeout", "failed", "fallback")
+
+@trace_methods("bot_jobs")
+class BotJobQueue:
+    """ボットの応答をバックグラウンドで生成し、保存済みの記録の bot_response に書き込む。
+
+    ジョブは記録の id で引ける。状態は pending -> running -> done と進み、
+    制限時間切れ・失敗・待ち行列あふれのときはルールベースの応答で埋めて timeout / failed / fallback になる。
+    生成中の応答は chunks に少しずつ溜まり、stream() で画面に流せる。
+    """
+
+    def __init__(self, bot: CounselingBot, max_workers: int = DEFAULT_BOT_WORKERS,
+                 timeout: float = DEFAULT_BOT_TIMEOUT, max_pending: int = DEFAULT_BOT_MAX_PENDING):
+        self.bot = bot
+        self.timeout = timeout
+        # 他のプロセスが予約したジョブをこの秒数のあいだは生成中とみなす（待ち行列で最も長く待った場合と生成の時間）
+        self.lease_seconds = timeout * (max_pending // max(max_workers, 1) + 2)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bot-worker")
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _track(self, job: dict):
+        with self.lock:
+            self.jobs[job["entry_id"]] = job
+            self.jobs.move_to_end(job["entry_id"])
+            if len(self.jobs) > MAX_TRACKED_JOBS:
+                for entry_id in [key for key, item in self.jobs.items() if item["status"] in FINISHED_STATUSES]:
+                    del self.jobs[entry_id]
+                    if len(self.jobs) <= MAX_TRACKED_JOBS:
+                        break
+
+    def _fallback(self, entry: DiaryEntry) -> str:
+        return self.bot.get_counseling_response(entry.content, entry.mood, entry.mood_intensity, entry.category)
+
+    def _lease_path(self, diary_manager, entry_id: str) -> str:
+        # 予約済みの印。API を複数のプロセスで動かしても、どのプロセスからも見えるようデータの隣に置く
+        return diary_manager.backend.sidecar_path(diary_manager.user_email, "bot_job_" + hashlib.md5(entry_id.encode()).hexdigest(), ".lease")
+
+    def _take_lease(self, diary_manager, entry_id: str):
+        with open(self._lease_path(diary_manager, entry_id), 'w', encoding='utf-8') as f:
+            f.write(str(time.time()))
+
+    def _release_lease(self, diary_manager, entry_id: str):
+        try:
+            os.remove(self._lease_path(diary_manager, entry_id))
+        except OSError:
+            pass
+
+    def leased_elsewhere(self, diary_manager, entry_id: str) -> bool:
+        """このプロセスにないジョブを、他のプロセスが期限内に予約しているか"""
+        try:
+            age = time.time() - os.path.getmtime(self._lease_path(diary_manager, entry_id))
+        except OSError:
+            return False
+        return age < self.lease_seconds
+
+    def _finish(self, job: dict, diary_manager, entry: DiaryEntry, status: str, bot_response: str, error: str = ""):
+        diary_manager.update_bot_response(entry, bot_response)
+        self._release_lease(diary_manager, entry.id)
+        with job["changed"]:
+            if not job["chunks"]:
+                job["chunks"].append(bot_response)
+            job.update(status=status, bot_response=bot_response, error=error, finished_at=time.time())
+            job["event"].set()
+            job["changed"].notify_all()
+
+    def _fail(self, job: dict, error: Exception):
+        # 書き込みにも失敗したときは状態だけ残す
+        with job["changed"]:
+            job.update(status="failed", error=str(error), finished_at=time.time())
+            job["event"].set()
+            job["changed"].notify_all()
+
+    def submit(self, diary_manager, entry: DiaryEntry) -> dict:
+        """保存済みの entry の応答生成を予約する。すぐに戻り、ジョブの状態を返す"""
+        job = {"entry_id": entry.id, "user_email": entry.user_email, "status": "pending", "bot_response": "",
+               "error": "", "submitted_at": time.time(), "finished_at": None,
+               "chunks": [], "event": threading.Event(), "changed": threading.Condition()}
+        self._track(job)
+        # 呼び出し元の画面や API に例外を返さないよう、書き込みの失敗は例外で受け取ってジョブの状態に残す
+        writer = DiaryManager(diary_manager.user_email, diary_manager.backend, on_error=raise_error)
+        if not self.slots.acquire(blocking=False):
+            try:
+                self._finish(job, writer, entry, "fallback", self._fallback(entry), "待ち行列がいっぱいです")
+            except Exception as e:
+                self._fail(job, e)
+            return public_job(job)
+        try:
+            self._take_lease(writer, entry.id)
+            self.executor.submit(self._run, job, writer, entry)
+        except Exception:
+            self.slots.release()
+            raise
+        return public_job(job)
+
+    def _run(self, job: dict, diary_manager, entry: DiaryEntry):
+        try:
+            job["status"] = "running"
+            started = time.perf_counter()
+            try:
+                for chunk in self.bot.stream_response(entry.content, entry.mood, entry.mood_intensity, entry.category, timeout=self.timeout):
+                    with job["changed"]:
+                        job["chunks"].append(chunk)
+                        job["changed"].notify_all()
+                BOT_CALL_SECONDS.observe(time.perf_counter() - started, "done")
+                self._finish(job, diary_manager, entry, "done", "".join(job["chunks"]))
+            except TimeoutError as e:
+                BOT_CALL_SECONDS.observe(time.perf_counter() - started, "timeout")
+                self._finish(job, diary_manager, entry, "timeout", self._fallback(entry), str(e))
+            except Exception as e:
+                BOT_CALL_SECONDS.observe(time.perf_counter() - started, "failed")
+                self._finish(job, diary_manager, entry, "failed", self._fallback(entry), str(e))
+        except Exception as e:
+            self._fail(job, e)
+        finally:
+            self.slots.release()
+
+    def status(self, entry_id: str) -> Optional[dict]:
+        with self.lock:
+            job = self.jobs.get(entry_id)
+        return public_job(job) if job is not None else None
+
+    def wait(self, entry_id: str, timeout: float = None) -> Optional[dict]:
+        """ジョブが終わるまで最大 timeout 秒待って状態を返す"""
+        with self.lock:
+            job = self.jobs.get(entry_id)
+        if job is None:
+            return None
+        job["event"].wait(timeout)
+        return public_job(job)
+
+    def stream(self, entry_id: str, timeout: float = None) -> Iterator[str]:
+        """生成済みの部分から順に応答を返す。ジョブが終わるか、timeout 秒新しい部分が来なければ止まる"""
+        with self.lock:
+            job = self.jobs.get(entry_id)
+        if job is None:
+            return
+        position = 0
+        while True:
+            with job["changed"]:
+                while position == len(job["chunks"]) and not job["event"].is_set():
+                    if not job["changed"].wait(timeout):
+                        return
+                chunks = job["chunks"][position:]
+                finished = job["event"].is_set()
+            position += len(chunks)
+            yield from chunks
+            if finished:
+                return
+
+def public_job(job: dict) -> dict:
+    public = {key: value for key, value in job.items() if key not in ("event", "changed", "chunks")}
+    # ここまでに生成された部分
+    public["partial"] = "".join(job["chunks"])
+    return public
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue() -> BotJobQueue:
+    """プロセス共通の待ち行列。DIARY_BOT_WORKERS / DIARY_BOT_TIMEOUT / DIARY_BOT_MAX_PENDING で調整できる"""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = BotJobQueue(
+                get_counseling_bot(),
+                max_workers=int(os.environ.get("DIARY_BOT_WORKERS", DEFAULT_BOT_WORKERS)),
+                timeout=float(os.environ.get("DIARY_BOT_TIMEOUT", DEFAULT_BOT_TIMEOUT)),
+                max_pending=int(os.environ.get("DIARY_BOT_MAX_PENDING", DEFAULT_BOT_MAX_PENDING)),
+            )
+        return _job_queue
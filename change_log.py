@@ -0,0 +1,156 @@
+import base64
+import json
+import os
+import uuid
+from typing import List, Optional
+from dataclasses import asdict
+try:
+    import fcntl
+except ImportError:  # Windows ではプロセス間ロックなしで動かす
+    fcntl = None
+
+# 変更ログがこのサイズを超えたら新しい世代に切り替える（古いトークンは全件同期になる）
+CHANGE_LOG_MAX_BYTES = 4 * 1024 * 1024
+
+class ChangeLog:
+    """利用者ごとの変更ログ（JSONL）。日記と目標の変更に単調増加の通し番号を振る
+
+    1行目はヘッダ {"generation": ..., "base_seq": ...}、2行目以降が
+    {"seq": n, "kind": "entry" | "goal", "op": "upsert" | "delete", "id": ..., "data": {...}}。
+    同期トークンは (世代, 通し番号, 読み終えたバイト位置) なので、差分はログの末尾だけ読めば返せる。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _open_locked(self, exclusive: bool):
+        """ロックを取って開く。待っている間に世代が切り替わっていたら開き直す"""
+        while True:
+            f = open(self.path, 'r+b' if exclusive else 'rb')
+            if fcntl is None:
+                return f
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                if os.fstat(f.fileno()).st_ino == os.stat(self.path).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            f.close()
+
+    def _new_header(self, base_seq: int) -> bytes:
+        return (json.dumps({"generation": uuid.uuid4().hex, "base_seq": base_seq}) + "\n").encode('utf-8')
+
+    def _read_header(self, f) -> dict:
+        f.seek(0)
+        return json.loads(f.readline())
+
+    def _last_seq(self, f, header: dict) -> int:
+        # 末尾から読める最後の行を探す
+        position = f.seek(0, os.SEEK_END)
+        tail = b""
+        while position > 0:
+            read_size = min(4096, position)
+            position -= read_size
+            f.seek(position)
+            tail = f.read(read_size) + tail
+            lines = tail.split(b"\n")
+            # 先頭の断片は行の途中かもしれないので、ファイル先頭まで読んだとき以外は使わない
+            for line in reversed(lines if position == 0 else lines[1:]):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                return record.get("seq", header["base_seq"])
+        return header["base_seq"]
+
+    def _ensure_exists(self):
+        if not os.path.exists(self.path):
+            with open(self.path, 'ab') as f:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                if f.tell() == 0:
+                    f.write(self._new_header(0))
+
+    def append(self, changes: List[tuple]) -> int:
+        """changes は (kind, op, id, data) のリスト。最後に振った通し番号を返す"""
+        self._ensure_exists()
+        with self._open_locked(True) as f:
+            header = self._read_header(f)
+            seq = self._last_seq(f, header)
+            lines = []
+            for kind, op, item_id, data in changes:
+                seq += 1
+                lines.append(json.dumps({"seq": seq, "kind": kind, "op": op, "id": item_id, "data": data}, ensure_ascii=False) + "\n")
+            end = f.seek(0, os.SEEK_END)
+            f.seek(end - 1)
+            if f.read(1) != b"\n":
+                # 前回の書き込みが途中で切れていたら改行を補う
+                lines.insert(0, "\n")
+            f.seek(0, os.SEEK_END)
+            f.write("".join(lines).encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+            if f.tell() > CHANGE_LOG_MAX_BYTES:
+                self._rotate(seq)
+        return seq
+
+    def _rotate(self, base_seq: int):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(self._new_header(base_seq))
+        os.replace(tmp_path, self.path)
+
+    def current_token(self) -> str:
+        self._ensure_exists()
+        with self._open_locked(False) as f:
+            header = self._read_header(f)
+            seq = self._last_seq(f, header)
+            return encode_token(header["generation"], seq, f.seek(0, os.SEEK_END))
+
+    def read_since(self, token: str, limit: int = 0) -> Optional[tuple]:
+        """token 以降の変更を (レコード一覧, 次のトークン) で返す。差分で返せないときは None（全件同期が必要）"""
+        parsed = decode_token(token)
+        if parsed is None or not os.path.exists(self.path):
+            return None
+        generation, seq, offset = parsed
+        with self._open_locked(False) as f:
+            header = self._read_header(f)
+            if header["generation"] != generation:
+                return None
+            f.seek(offset)
+            records = []
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    offset += len(line)
+                    continue
+                if not records and record["seq"] != seq + 1:
+                    return None
+                records.append(record)
+                offset += len(line)
+                if limit and len(records) >= limit:
+                    break
+        if records:
+            seq = records[-1]["seq"]
+        return records, encode_token(generation, seq, offset)
+
+def diff_changes(kind: str, old_items: list, new_items: list) -> List[tuple]:
+    """id を持つ dataclass の一覧を比べ、変わったものだけを (kind, op, id, data) にする"""
+    old = {item.id: asdict(item) for item in old_items}
+    new = {item.id: asdict(item) for item in new_items}
+    changes = [(kind, "upsert", item_id, data) for item_id, data in new.items() if old.get(item_id) != data]
+    changes += [(kind, "delete", item_id, None) for item_id in old if item_id not in new]
+    return changes
+
+def encode_token(generation: str, seq: int, offset: int) -> str:
+    return base64.urlsafe_b64encode(f"{generation}:{seq}:{offset}".encode()).decode()
+
+def decode_token(token: str) -> Optional[tuple]:
+    try:
+        generation, seq, offset = base64.urlsafe_b64decode(token.encode()).decode().split(":")
+        return generation, int(seq), int(offset)
+    except Exception:
+        return None
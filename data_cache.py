@@ -0,0 +1,75 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+# 既定の上限（ファイルサイズ換算）。環境変数 DIARY_CACHE_MAX_BYTES で変更できる
+DEFAULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+class ParsedDataCache:
+    """読み込み済みデータのプロセス共通LRUキャッシュ。
+
+    ファイルパスをキーに、(inode, mtime, サイズ) の組を署名として保持し、
+    署名が一致する間はファイルを読み直さずに前回の結果を返す。
+    値はすべての呼び出し元で共有されるので、書き換えるものはコピーしてから渡すこと（JsonBackend._cached_load を参照）。
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, signature: Hashable) -> Optional[Any]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] == signature:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, signature: Hashable, value: Any, cost: int):
+        with self._lock:
+            self._discard(key)
+            if cost > self.max_bytes:
+                return
+            self._items[key] = (signature, value, cost)
+            self.current_bytes += cost
+            while self.current_bytes > self.max_bytes:
+                oldest = next(iter(self._items))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.current_bytes = 0
+
+    def _discard(self, key: str):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.current_bytes -= item[2]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "items": len(self._items),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+parsed_data_cache = ParsedDataCache(int(os.environ.get("DIARY_CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES)))
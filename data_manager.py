@@ -1,78 +1,297 @@
-import streamlit as st
-import json
-import os
-import hashlib
-from typing import List
+import uuid
+from typing import Iterator, List, Optional
 from dataclasses import asdict
-from data_models import Goal, DiaryEntry
+from data_models import Goal, DiaryEntry, EntrySummary
+from storage import StorageBackend, get_backend, entries_filename, goals_filename
+from change_log import ChangeLog, diff_changes
+from errors import ConflictError, ErrorHandler, StorageError, log_error
+from instrumentation import trace_methods
+import search_index
+import mood_rollups
 
+def change_log_for(backend: StorageBackend, user_email: str) -> ChangeLog:
+    # 日記と目標で1本の変更ログを共有し、利用者ごとに通し番号を振る
+    return ChangeLog(backend.sidecar_path(user_email, "changes", ".jsonl"))
+
+@trace_methods("goals")
 class GoalManager:
-    def __init__(self, user_email: str = ""):
+    def __init__(self, user_email: str = "", backend: StorageBackend = None, on_error: ErrorHandler = None):
         self.user_email = user_email
-        self.goals_file = f"goals_{hashlib.md5(user_email.encode()).hexdigest()}.json" if user_email else "goals.json"
+        self.backend = backend or get_backend()
+        # 保存の失敗は on_error に渡す（画面では st.error、API では例外になる）
+        self.on_error = on_error or log_error
+        self.goals_file = goals_filename(user_email)
+        self.change_log = change_log_for(self.backend, user_email)
     
     def load_goals(self) -> List[Goal]:
         try:
-            if os.path.exists(self.goals_file):
-                with open(self.goals_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    goals = []
-                    for goal_data in data:
-                        if 'progress' in goal_data:
-                            del goal_data['progress']
-                        goals.append(Goal(**goal_data))
-                    return goals
+            return self.backend.load_goals(self.user_email)
         except:
             pass
         return []
     
-    def save_goals(self, goals: List[Goal]):
+    def goals_version(self) -> str:
+        return self.backend.goals_version(self.user_email)
+    
+    def save_goals(self, goals: List[Goal], expected_version: str = None) -> bool:
+        """目標を全件書き換える。読み込んだときの goals_version() を渡すと、その後に他で更新されていれば保存しない"""
         try:
-            with open(self.goals_file, 'w', encoding='utf-8') as f:
-                json.dump([asdict(goal) for goal in goals], f, ensure_ascii=False, indent=2)
+            old_goals = self.backend.load_goals(self.user_email)
+            self.backend.save_goals(self.user_email, goals, expected_version)
+            changes = diff_changes("goal", old_goals, goals)
+            if changes:
+                self.change_log.append(changes)
+            return True
+        except ConflictError as e:
+            self.on_error(e)
         except Exception as e:
-            st.error(f"目標の保存に失敗しました: {e}")
+            self.on_error(StorageError(f"目標の保存に失敗しました: {e}"))
+        return False
     
     def add_goal(self, goal: Goal):
         goal.user_email = self.user_email
-        goals = self.load_goals()
-        goals.append(goal)
-        self.save_goals(goals)
+        try:
+            self.backend.add_goal(self.user_email, goal)
+            self.change_log.append([("goal", "upsert", goal.id, asdict(goal))])
+        except Exception as e:
+            self.on_error(StorageError(f"目標の保存に失敗しました: {e}"))
+    
+    def add_goals(self, goals: List[Goal]) -> Optional[List[Goal]]:
+        """複数の目標をまとめて追加する。同じ id の目標が既にあるものは飛ばし、追加したものを返す。
+        保存に失敗したら on_error に渡したうえで None を返す"""
+        for goal in goals:
+            goal.user_email = self.user_email
+        try:
+            added = self.backend.add_goals(self.user_email, goals)
+            if added:
+                self.change_log.append([("goal", "upsert", goal.id, asdict(goal)) for goal in added])
+        except Exception as e:
+            self.on_error(StorageError(f"目標の保存に失敗しました: {e}"))
+            return None
+        return added
     
     def delete_goal(self, goal_id: str):
-        goals = self.load_goals()
-        goals = [goal for goal in goals if goal.id != goal_id]
-        self.save_goals(goals)
+        try:
+            self.backend.delete_goal(self.user_email, goal_id)
+            self.change_log.append([("goal", "delete", goal_id, None)])
+        except Exception as e:
+            self.on_error(StorageError(f"目標の保存に失敗しました: {e}"))
 
+@trace_methods("diary")
 class DiaryManager:
-    def __init__(self, user_email: str = ""):
+    def __init__(self, user_email: str = "", backend: StorageBackend = None, on_error: ErrorHandler = None):
         self.user_email = user_email
-        self.entries_file = f"diary_entries_{hashlib.md5(user_email.encode()).hexdigest()}.json" if user_email else "diary_entries.json"
+        self.backend = backend or get_backend()
+        self.on_error = on_error or log_error
+        self.entries_file = entries_filename(user_email)
+        self.search_index_file = self.backend.sidecar_path(user_email, "search_index")
+        self.rollups_file = self.backend.sidecar_path(user_email, "mood_rollups")
+        self.change_log = change_log_for(self.backend, user_email)
         
     def load_entries(self) -> List[DiaryEntry]:
         try:
-            if os.path.exists(self.entries_file):
-                with open(self.entries_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    entries = []
-                    for entry_data in data:
-                        if 'mood_intensity' not in entry_data:
-                            entry_data['mood_intensity'] = 3
-                        entries.append(DiaryEntry(**entry_data))
-                    return entries
+            return self.backend.load_entries(self.user_email)
         except:
             pass
         return []
     
-    def save_entries(self, entries: List[DiaryEntry]):
+    def load_summaries(self) -> List[EntrySummary]:
+        """一覧表示用の見出し（本文なし）。load_entries() と同じ並び"""
         try:
-            with open(self.entries_file, 'w', encoding='utf-8') as f:
-                json.dump([asdict(entry) for entry in entries], f, ensure_ascii=False, indent=2)
+            return self.backend.load_entry_summaries(self.user_email)
+        except:
+            pass
+        return []
+    
+    def load_entry(self, summary: EntrySummary) -> Optional[DiaryEntry]:
+        """見出しの記録を本文つきで読む"""
+        try:
+            return self.backend.load_entry(self.user_email, summary)
+        except:
+            pass
+        return None
+    
+    def load_entries_for(self, summaries: List[EntrySummary]) -> List[Optional[DiaryEntry]]:
+        """見出しの並びに対応する記録を本文つきでまとめて読む。読めなかったものは None"""
+        try:
+            return self.backend.load_entries_for(self.user_email, summaries)
+        except:
+            pass
+        return [None] * len(summaries)
+    
+    def iter_entries(self) -> Iterator[DiaryEntry]:
+        """load_entries() と同じ並びで1件ずつ返す（エクスポート用）。読み込みの失敗は例外のまま呼び出し側に渡す"""
+        return self.backend.iter_entries(self.user_email)
+    
+    def entries_version(self) -> str:
+        """日記が変わるたびに変わる版数（ETag などに使う）。ファイルの中身は読まない"""
+        return self.backend.entries_version(self.user_email)
+    
+    def _cached_version(self) -> Optional[str]:
+        # 集計・検索索引の版合わせに使う。取れなければ None（次に読むときに確かめ直される）
+        try:
+            return self.backend.entries_version(self.user_email)
+        except Exception:
+            return None
+    
+    def save_entries(self, entries: List[DiaryEntry], expected_version: str = None) -> bool:
+        """日記を全件書き換える。読み込んだときの entries_version() を渡すと、その後に他で更新されていれば保存しない"""
+        try:
+            old_entries = self.backend.load_entries(self.user_email)
+            self.backend.save_entries(self.user_email, entries, expected_version)
+            changes = diff_changes("entry", old_entries, entries)
+            if changes:
+                self.change_log.append(changes)
+        except ConflictError as e:
+            self.on_error(e)
+            return False
         except Exception as e:
-            st.error(f"保存に失敗しました: {e}")
+            self.on_error(StorageError(f"保存に失敗しました: {e}"))
+            return False
+        try:
+            mood_rollups.replace_entries(self.rollups_file, entries, self._cached_version())
+        except Exception:
+            pass
+        # 検索索引は次の検索で版の違いに気づいて作り直される
+        return True
+    
+    def compact(self):
+        """ジャーナルをスナップショットに畳み込む（JSONバックエンドのみ）"""
+        before = self._cached_version()
+        try:
+            self.backend.compact_entries(self.user_email)
+        except Exception as e:
+            self.on_error(StorageError(f"保存に失敗しました: {e}"))
+            return
+        after = self._cached_version()
+        try:
+            mood_rollups.record_version(self.rollups_file, before, after)
+            search_index.record_version(self.search_index_file, before, after)
+        except Exception:
+            pass
     
     def add_entry(self, entry: DiaryEntry):
         entry.user_email = self.user_email
-        entries = self.load_entries()
-        entries.append(entry)
-        self.save_entries(entries)
\ No newline at end of file
+        if not entry.id:
+            entry.id = uuid.uuid4().hex
+        before = self._cached_version()
+        try:
+            self.backend.add_entry(self.user_email, entry)
+            self.change_log.append([("entry", "upsert", entry.id, asdict(entry))])
+        except Exception as e:
+            self.on_error(StorageError(f"保存に失敗しました: {e}"))
+            return
+        after = self._cached_version()
+        # 検索索引がメモリにあれば1件分だけ追加する（ずれていれば検索時に補正される）
+        try:
+            search_index.record_entries(self.search_index_file, [entry], before, after)
+        except Exception:
+            pass
+        try:
+            mood_rollups.record_entry(self.rollups_file, entry, before, after)
+        except Exception:
+            pass
+    
+    def add_entries(self, entries: List[DiaryEntry]) -> Optional[List[DiaryEntry]]:
+        """複数の記録を1回の書き込みで追加する。同じ id の記録が既にあるものは飛ばし、追加したものを返す。
+        保存に失敗したら on_error に渡したうえで None を返す（何も追加しなかった [] と区別する）"""
+        for entry in entries:
+            entry.user_email = self.user_email
+            if not entry.id:
+                entry.id = uuid.uuid4().hex
+        before = self._cached_version()
+        try:
+            added = self.backend.add_entries(self.user_email, entries)
+            if added:
+                self.change_log.append([("entry", "upsert", entry.id, asdict(entry)) for entry in added])
+        except Exception as e:
+            self.on_error(StorageError(f"保存に失敗しました: {e}"))
+            return None
+        if not added:
+            return added
+        after = self._cached_version()
+        try:
+            search_index.record_entries(self.search_index_file, added, before, after)
+        except Exception:
+            pass
+        try:
+            mood_rollups.record_entries(self.rollups_file, added, before, after)
+        except Exception:
+            pass
+        return added
+    
+    def update_bot_response(self, entry: DiaryEntry, bot_response: str):
+        """保存済みの記録にボットの応答を後から書き込む"""
+        entry.bot_response = bot_response
+        before = self._cached_version()
+        try:
+            self.backend.update_entry(self.user_email, entry.id, {"bot_response": bot_response})
+            self.change_log.append([("entry", "upsert", entry.id, asdict(entry))])
+        except Exception as e:
+            self.on_error(StorageError(f"保存に失敗しました: {e}"))
+            return
+        # 応答は集計も索引もしないので、版だけを進める
+        after = self._cached_version()
+        try:
+            mood_rollups.record_version(self.rollups_file, before, after)
+            search_index.record_version(self.search_index_file, before, after)
+        except Exception:
+            pass
+    
+    def load_rollups(self, entries: List[DiaryEntry] = None, version: str = None) -> mood_rollups.MoodRollups:
+        """日・週・月ごとの気分集計を返す。entries（見出しの一覧でもよい）を渡すとそれに合わせて補正する。
+        version には entries を読む前に取った entries_version() を渡す（省略時は件数と最後の記録だけで確かめる）"""
+        if entries is None:
+            version = self._cached_version()
+            entries = self.load_entries()
+        return mood_rollups.synced_rollups(self.rollups_file, entries, version)
+    
+    def search_entries(self, search_term: str) -> List[DiaryEntry]:
+        """タイトル・本文にキーワードを含む記録を関連度の高い順に返す。
+        索引は見出しと版で確かめ、本文は索引に足りない分と候補の分だけ読む"""
+        version = self._cached_version()
+        try:
+            # 読み込みに失敗した空の一覧で索引を作り直さないよう、例外はそのまま受ける
+            summaries = self.backend.load_entry_summaries(self.user_email)
+            return search_index.search_entries(self.search_index_file, summaries, search_term, version, self)
+        except Exception:
+            needle = search_term.lower()
+            return [e for e in reversed(self.load_entries()) if needle in e.content.lower() or needle in e.title.lower()]
+
+
+def sync_changes(diary_manager: DiaryManager, goal_manager: GoalManager, token: str = "", limit: int = 0) -> dict:
+    """token 以降に作成・変更・削除された日記と目標を返す。
+
+    token が空・古い世代・不正な場合は reset=True で現在の全件を返すので、
+    クライアントは手元のデータを置き換える。
+    """
+    result = diary_manager.change_log.read_since(token, limit) if token else None
+    if result is None:
+        # 先にトークンを取ってから読むので、その間の変更は次回の差分にも含まれる（upsert なので重複しても問題ない）
+        new_token = diary_manager.change_log.current_token()
+        return {
+            "reset": True,
+            "sync_token": new_token,
+            "has_more": False,
+            "entries": {"upserted": [asdict(entry) for entry in diary_manager.load_entries()], "deleted": []},
+            "goals": {"upserted": [asdict(goal) for goal in goal_manager.load_goals()], "deleted": []},
+        }
+    records, new_token = result
+    # 同じ id が何度も変わっていれば最後の状態だけ返す
+    latest = {"entry": {}, "goal": {}}
+    for record in records:
+        latest[record["kind"]].pop(record["id"], None)
+        latest[record["kind"]][record["id"]] = record
+    def collect(kind: str) -> dict:
+        changes = latest[kind].values()
+        return {
+            "upserted": [record["data"] for record in changes if record["op"] == "upsert"],
+            "deleted": [record["id"] for record in changes if record["op"] == "delete"],
+        }
+    return {
+        "reset": False,
+        "sync_token": new_token,
+        "has_more": bool(limit) and len(records) >= limit,
+        "entries": collect("entry"),
+        "goals": collect("goal"),
+    }
@@ -29,6 +29,28 @@ class DiaryEntry:
     category: str
     user_email: str = ""
     bot_response: str = ""
+    id: str = ""
+
+@dataclass
+class EntrySummary:
+    """一覧表示用の見出し。本文とメッセージは持たず、必要になったら locations から読む"""
+    id: str
+    date: str
+    title: str
+    mood: str
+    mood_intensity: int
+    category: str
+    # (ファイルの種類, バイト位置, 長さ) の並び。先頭が記録そのもので、続きはジャーナル上の部分更新
+    locations: tuple = ()
+
+SUMMARY_FIELDS = ("date", "title", "mood", "mood_intensity", "category")
+
+def summarize_entry(entry: DiaryEntry, locations: tuple = ()) -> EntrySummary:
+    return EntrySummary(entry.id, entry.date, entry.title, entry.mood, entry.mood_intensity, entry.category, locations)
+
+def entry_key(entry: DiaryEntry) -> str:
+    # 索引や集計が load_entries() の並びとずれていないか確かめるための目印
+    return entry.id or f"{entry.date}\t{entry.title}"
 
 # Define constants for themes, moods, and tips
 THEME_PALETTES = {
@@ -103,6 +125,20 @@ MOOD_OPTIONS = {
     ]
 }
 
+# 心模様の名前 → 強さ（画面では心模様を選ぶと強さが決まる）
+MOOD_INTENSITIES = {mood["name"]: mood["intensity"] for moods in MOOD_OPTIONS.values() for mood in moods}
+MIN_MOOD_INTENSITY = min(MOOD_INTENSITIES.values())
+MAX_MOOD_INTENSITY = max(MOOD_INTENSITIES.values())
+
+def validate_entry(entry: DiaryEntry) -> str:
+    """外から受け取った記録の問題点。なければ空文字。
+    保存・一括保存・取り込みで同じ基準を使う（強さは範囲だけを見る。古い記録には心模様と合わないものがある）"""
+    if not entry.title.strip() or not entry.content.strip() or not entry.mood.strip():
+        return "タイトル、内容、心模様を指定してください"
+    if not MIN_MOOD_INTENSITY <= entry.mood_intensity <= MAX_MOOD_INTENSITY:
+        return f"mood_intensity は{MIN_MOOD_INTENSITY}〜{MAX_MOOD_INTENSITY}で指定してください"
+    return ""
+
 ACHIEVEMENT_TIPS = {
     "習慣化のコツ": [
         {"title": "小さく始める", "content": "大きな目標も小さな習慣から。1日1ページの読書、5分の運動など、必ず継続できる小さなことから始めましょう。"},
@@ -0,0 +1,25 @@
+import logging
+from typing import Callable
+
+logger = logging.getLogger("diary")
+
+class DiaryError(Exception):
+    """アプリ内の処理で利用者に伝えるべき失敗"""
+
+class StorageError(DiaryError):
+    """保存・読み込みの失敗"""
+
+class ValidationError(DiaryError):
+    """入力内容の誤り"""
+
+# 失敗を受け取る関数。画面側は st.error に、API 側は例外に変換する
+ErrorHandler = Callable[[DiaryError], None]
+
+def log_error(error: DiaryError):
+    logger.error("%s", error)
+
+def raise_error(error: DiaryError):
+    raise error
+
+class ConflictError(StorageError):
+    """他の書き込みと競合した。読み直してからやり直す"""
@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, ContextManager
+
+# 遅延の分位点を出すために覚えておく直近の件数
+LATENCY_SAMPLES = 4096
+
+def percentile(samples: list, ratio: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * ratio), len(ordered) - 1)]
+
+class _Batch:
+    def __init__(self):
+        self.chunks = []
+        self.done = threading.Event()
+        self.error = None
+
+class GroupCommitQueue:
+    """同じファイルへの追記を window 秒だけ待ってまとめ、1回の書き込みと1回の fsync で確定させる。
+
+    最初に来た書き込みが「まとめ役」になって待ち、その間に来た分を一緒に書く。
+    append() はまとめ役の fsync が終わるまで戻らないので、戻った時点でディスクに載っている。
+    """
+
+    def __init__(self, window: float):
+        self.window = window
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.records = 0
+        self.bytes = 0
+        self.max_batch = 0
+        self._wait_ms = deque(maxlen=LATENCY_SAMPLES)
+        self._flush_ms = deque(maxlen=LATENCY_SAMPLES)
+
+    def append(self, path: str, data: bytes, write: Callable[[str, bytes], None], lock: Callable[[], ContextManager]):
+        """data を path に追記する。write(path, まとめたデータ) は lock() の中で1回だけ呼ばれる"""
+        started = time.perf_counter()
+        with self._lock:
+            batch = self._pending.get(path)
+            leader = batch is None
+            if leader:
+                batch = self._pending[path] = _Batch()
+            batch.chunks.append(data)
+        if leader:
+            time.sleep(self.window)
+            with self._lock:
+                # ここから後に来た書き込みは次のまとめに回る
+                del self._pending[path]
+            flush_started = time.perf_counter()
+            try:
+                with lock():
+                    write(path, b"".join(batch.chunks))
+            except BaseException as e:
+                batch.error = e
+            with self._stats_lock:
+                self.batches += 1
+                self.records += len(batch.chunks)
+                self.bytes += sum(len(chunk) for chunk in batch.chunks)
+                self.max_batch = max(self.max_batch, len(batch.chunks))
+                self._flush_ms.append((time.perf_counter() - flush_started) * 1000)
+            batch.done.set()
+        else:
+            batch.done.wait()
+        with self._stats_lock:
+            self._wait_ms.append((time.perf_counter() - started) * 1000)
+        if batch.error is not None:
+            raise batch.error
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            wait_ms = list(self._wait_ms)
+            flush_ms = list(self._flush_ms)
+            elapsed = time.monotonic() - self._started
+            return {
+                "window_ms": self.window * 1000,
+                "batches": self.batches,
+                "records": self.records,
+                "bytes": self.bytes,
+                "avg_batch": self.records / self.batches if self.batches else 0.0,
+                "max_batch": self.max_batch,
+                "records_per_sec": self.records / elapsed if elapsed else 0.0,
+                "ack_ms_p50": percentile(wait_ms, 0.50),
+                "ack_ms_p99": percentile(wait_ms, 0.99),
+                "flush_ms_p50": percentile(flush_ms, 0.50),
+                "flush_ms_p99": percentile(flush_ms, 0.99),
+            }
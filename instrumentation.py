@@ -0,0 +1,113 @@
+import cProfile
+import contextvars
+import functools
+import inspect
+import io
+import json
+import logging
+import os
+import pstats
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+logger = logging.getLogger("diary.perf")
+
+# この時間（ミリ秒）を超えた再実行はログに残す。環境変数 DIARY_SLOW_RERUN_MS で変更できる
+DEFAULT_SLOW_RERUN_MS = 500.0
+# プロファイル結果として残す関数の数
+PROFILE_TOP_FUNCTIONS = 30
+
+class Trace:
+    """1回の再実行（またはリクエスト）で計った区間の記録"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.total_ms = 0.0
+        # (区間名, 入れ子の深さ, 開始までのミリ秒, かかったミリ秒) を終わった順に
+        self.spans = []
+        self.depth = 0
+        self.profile = ""
+
+    def ordered_spans(self) -> list:
+        """始まった順（入れ子の外側が先）"""
+        return sorted(self.spans, key=lambda item: (item[2], item[1]))
+
+    def summary(self) -> dict:
+        """区間名ごとの回数と合計時間（入れ子の内側も含む）"""
+        totals = {}
+        for name, _, _, ms in self.spans:
+            count, total = totals.get(name, (0, 0.0))
+            totals[name] = (count + 1, total + ms)
+        return {name: {"count": count, "ms": round(total, 2)} for name, (count, total) in totals.items()}
+
+_current = contextvars.ContextVar("diary_trace", default=None)
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+@contextmanager
+def span(name: str):
+    """計測中の再実行があれば、その中の1区間として時間を記録する。なければ何もしない"""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    trace.depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.depth -= 1
+        trace.spans.append((name, trace.depth, (started - trace.started) * 1000, (time.perf_counter() - started) * 1000))
+
+def traced(name: str):
+    """関数の呼び出しを1区間として記録するデコレータ"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def trace_methods(prefix: str):
+    """クラスに定義された公開メソッドをすべて「prefix.メソッド名」の区間にするクラスデコレータ。
+    ジェネレータは作るだけで時間がかからないので、パスを組み立てるだけの *_path も細かすぎるので対象にしない"""
+    def decorator(cls):
+        for attr, value in list(vars(cls).items()):
+            if attr.startswith("_") or attr.endswith("_path") or not inspect.isfunction(value) or inspect.isgeneratorfunction(value):
+                continue
+            setattr(cls, attr, traced(f"{prefix}.{attr}")(value))
+        return cls
+    return decorator
+
+def slow_rerun_ms() -> float:
+    return float(os.environ.get("DIARY_SLOW_RERUN_MS", DEFAULT_SLOW_RERUN_MS))
+
+@contextmanager
+def trace_rerun(name: str, profile: bool = False):
+    """with の中を1回の再実行として計る。遅かったものは構造化ログに出す。
+    profile=True なら cProfile もかけ、上位の関数を trace.profile に文字列で残す"""
+    trace = Trace(name)
+    token = _current.set(trace)
+    profiler = cProfile.Profile() if profile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield trace
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        _current.reset(token)
+        trace.total_ms = (time.perf_counter() - trace.started) * 1000
+        if profiler is not None:
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+            trace.profile = output.getvalue()
+        if trace.total_ms > slow_rerun_ms():
+            logger.warning(json.dumps({"event": "slow_rerun", "name": trace.name, "total_ms": round(trace.total_ms, 2),
+                                       "spans": trace.summary()}, ensure_ascii=False))
@@ -0,0 +1,182 @@
+import csv
+import hashlib
+import io
+import json
+import tempfile
+from dataclasses import fields
+from typing import BinaryIO, Iterable, Iterator
+from data_models import DiaryEntry, Goal, validate_entry
+from data_manager import DiaryManager, GoalManager
+from storage import legacy_entry_id
+
+EXPORT_FORMATS = ("ndjson", "csv")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+ENTRY_FIELDS = [field.name for field in fields(DiaryEntry)]
+GOAL_FIELDS = [field.name for field in fields(Goal)]
+# CSV は日記と目標を1つの表にし、kind 列で見分ける（目標だけの列は後ろに足す）
+CSV_FIELDS = ["kind"] + ENTRY_FIELDS + [name for name in GOAL_FIELDS if name not in ENTRY_FIELDS]
+# この大きさ（文字数）まで溜めてから1かたまりとして返す
+EXPORT_CHUNK_CHARS = 64 * 1024
+# export_file() がメモリに置く上限（超えた分は一時ファイルに書く）
+EXPORT_SPOOL_BYTES = 1024 * 1024
+# 取り込みで1回に書き込む件数
+IMPORT_CHUNK_SIZE = 500
+# 取り込み結果に残すエラーの数
+MAX_IMPORT_ERRORS = 100
+
+def export_records(diary_manager: DiaryManager, goal_manager: GoalManager) -> Iterator[tuple]:
+    """(kind, レコードの辞書) を日記（古い順）、目標の順に返す。日記は1件ずつ読む。辞書は書き換えないこと"""
+    # 項目はすべて文字列と数値なので、asdict() の深いコピーは省いて属性の辞書をそのまま使う
+    for entry in diary_manager.iter_entries():
+        yield "entry", vars(entry)
+    for goal in goal_manager.load_goals():
+        yield "goal", vars(goal)
+
+def export_chunks(diary_manager: DiaryManager, goal_manager: GoalManager, export_format: str) -> Iterator[str]:
+    """エクスポートの中身を少しずつ返す。履歴の長さによらず、溜めるのは1かたまり分だけ"""
+    buffer = io.StringIO()
+    writer = None
+    if export_format == "csv":
+        # Excel で文字化けしないよう BOM を付ける
+        buffer.write("\ufeff")
+        writer = csv.DictWriter(buffer, CSV_FIELDS)
+        writer.writeheader()
+    for kind, record in export_records(diary_manager, goal_manager):
+        if writer is not None:
+            writer.writerow(dict(record, kind=kind))
+        else:
+            buffer.write(json.dumps(dict(record, kind=kind), ensure_ascii=False) + "\n")
+        if buffer.tell() >= EXPORT_CHUNK_CHARS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def export_file(diary_manager: DiaryManager, goal_manager: GoalManager, export_format: str) -> BinaryIO:
+    """エクスポートの中身を UTF-8 で書いたファイル（先頭に戻してある）。大きければメモリではなく一時ファイルに溜まる"""
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES)
+    for chunk in export_chunks(diary_manager, goal_manager, export_format):
+        spool.write(chunk.encode('utf-8'))
+    spool.seek(0)
+    return spool
+
+def export_filename(export_format: str) -> str:
+    return f"journal_export.{export_format}"
+
+def read_records(lines: Iterable[str], import_format: str) -> Iterator[tuple]:
+    """取り込むファイルを1行ずつ読み、(行番号, レコードの辞書) を返す。読めない行は辞書の代わりに None"""
+    if import_format == "csv":
+        lines = (line.lstrip("\ufeff") if i == 0 else line for i, line in enumerate(lines))
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(lines, 1):
+        line = line.lstrip("\ufeff").strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield line_number, record if isinstance(record, dict) else None
+
+def entry_from_record(record: dict) -> DiaryEntry:
+    values = {name: record.get(name) or "" for name in ENTRY_FIELDS if name != "user_email"}
+    missing = [name for name in ("date", "title", "content", "mood", "category") if not values[name]]
+    if missing:
+        raise ValueError(f"{', '.join(missing)} がありません")
+    values["mood_intensity"] = int(values["mood_intensity"] or 0)
+    # id がない行は内容から決めるので、同じファイルを取り込み直しても二重にならない
+    values["id"] = values["id"] or legacy_entry_id(values["date"], values["title"], values["content"])
+    entry = DiaryEntry(**values)
+    error = validate_entry(entry)
+    if error:
+        raise ValueError(error)
+    return entry
+
+def goal_from_record(record: dict) -> Goal:
+    values = {name: record.get(name) or "" for name in GOAL_FIELDS if name != "user_email"}
+    if not values["title"]:
+        raise ValueError("title がありません")
+    # id がない行は内容から決めるので、同じファイルを取り込み直しても二重にならない（利用者ごとの id には flush_goals でする）
+    values["id"] = values["id"] or "import-" + hashlib.md5(
+        f"{values['created_date']}\t{values['title']}\t{values['deadline']}".encode()).hexdigest()
+    return Goal(**values)
+
+def import_records(diary_manager: DiaryManager, goal_manager: GoalManager, records: Iterable[tuple],
+                   chunk_size: int = IMPORT_CHUNK_SIZE) -> dict:
+    """read_records() の結果を chunk_size 件ずつまとめて保存する。
+    日記は add_entries で書くので、保存済みの id のもの（取り込み直しなど）は飛ばされる。
+    保存に失敗した件数は failed に数える（skipped は登録済みで飛ばしたものだけ）"""
+    result = {"entries": 0, "goals": 0, "skipped": 0, "failed": 0, "errors": []}
+    entries = []
+    goals = []
+
+    def error(line_number: int, message: str):
+        if len(result["errors"]) < MAX_IMPORT_ERRORS:
+            result["errors"].append(f"{line_number}行目: {message}")
+
+    def flush_entries():
+        added = diary_manager.add_entries(entries)
+        if added is None:
+            result["failed"] += len(entries)
+        else:
+            result["entries"] += len(added)
+            result["skipped"] += len(entries) - len(added)
+        entries.clear()
+
+    def flush_goals():
+        # 取り込み中に画面で足したり消したりした目標を上書きしないよう、一覧は書き直さず add_goals で足す
+        known = {goal.id for goal in goal_manager.load_goals()}
+        for goal in goals:
+            if goal.id not in known:
+                # SQLite では目標の id が利用者をまたいで一意なので、他の人のファイルを取り込んでも
+                # その人の目標を上書きしないよう利用者ごとの id にする（同じファイルを取り込み直せば同じ id になる）
+                goal.id = hashlib.md5(f"{goal_manager.user_email}|{goal.id}".encode()).hexdigest()
+        added = goal_manager.add_goals(goals)
+        if added is None:
+            result["failed"] += len(goals)
+        else:
+            result["goals"] += len(added)
+            result["skipped"] += len(goals) - len(added)
+        goals.clear()
+
+    for line_number, record in records:
+        if record is None:
+            error(line_number, "読めない行です")
+            continue
+        kind = record.get("kind") or "entry"
+        try:
+            if kind == "entry":
+                entries.append(entry_from_record(record))
+            elif kind == "goal":
+                goals.append(goal_from_record(record))
+            else:
+                raise ValueError(f"不明な kind です: {kind}")
+        except (ValueError, TypeError) as e:
+            error(line_number, str(e))
+            continue
+        if len(entries) >= chunk_size:
+            flush_entries()
+        if len(goals) >= chunk_size:
+            flush_goals()
+    if entries:
+        flush_entries()
+    if goals:
+        flush_goals()
+    return result
+
+def import_file(diary_manager: DiaryManager, goal_manager: GoalManager, binary: BinaryIO, import_format: str) -> dict:
+    """バイナリで開いたファイルを UTF-8 として1行ずつ読んで取り込む（binary は閉じない）"""
+    # 改行は \n と \r だけで区切る（本文中の U+2028 などで NDJSON の行が切れないように）
+    lines = io.TextIOWrapper(binary, encoding="utf-8", errors="replace", newline="")
+    try:
+        return import_records(diary_manager, goal_manager, read_records(lines, import_format))
+    finally:
+        lines.detach()
+
+def detect_format(filename: str) -> str:
+    """ファイル名の拡張子から形式を決める。分からなければ ndjson"""
+    return "csv" if filename.lower().endswith(".csv") else "ndjson"
@@ -0,0 +1,62 @@
+from collections import Counter, deque
+from typing import Dict, Iterator, List, Tuple
+# 検索と同じ正規化を使う
+from search_index import normalize
+
+class KeywordAutomaton:
+    """Aho–Corasick 法の多パターン照合器。
+
+    キーワード -> ラベルの辞書から一度だけ組み立て、以降は本文を1回なめるだけで
+    含まれるキーワードをすべて見つける（本文の長さ + 一致数に比例する時間）。
+    """
+
+    def __init__(self, keywords: Dict[str, str]):
+        # 状態ごとの遷移・失敗リンク・その状態で確定するキーワード
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[Tuple[str, str]]] = [[]]
+        for keyword, label in keywords.items():
+            self._insert(normalize(keyword), label)
+        self._link()
+
+    def _insert(self, keyword: str, label: str):
+        state = 0
+        for char in keyword:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][char] = next_state
+            state = next_state
+        self.output[state].append((keyword, label))
+
+    def _link(self):
+        # 浅い状態から順に失敗リンクを張り、接尾辞で一致するキーワードも出力に含める
+        # （深さ1の状態の失敗リンクは根のまま）
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, str, str]]:
+        """(終わりの位置, キーワード, ラベル) を本文の先頭から順に返す"""
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for position, char in enumerate(normalize(text)):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for keyword, label in output[state]:
+                yield position + 1, keyword, label
+
+    def count_labels(self, text: str) -> Counter:
+        """ラベルごとの一致数"""
+        return Counter(label for _, _, label in self.iter_matches(text))
@@ -1,11 +1,13 @@
 import streamlit as st
 import datetime
+import os
 from data_models import THEME_PALETTES, MOOD_OPTIONS
 from auth_manager import AuthManager
 from data_manager import DiaryManager, GoalManager
-from bot_counselor import CounselingBot
-from ui_components import get_css
-from pages import login_page, goals_page, write_diary_page, history_page, tips_page, settings_page
+from bot_counselor import get_counseling_bot
+from ui_components import debug_panel, get_css, show_error
+from instrumentation import span, trace_rerun
+from pages import login_page, goals_page, write_diary_page, history_page, analytics_page, tips_page, settings_page
 
 # ページ設定
 st.set_page_config(
@@ -15,6 +17,18 @@ st.set_page_config(
 )
 
 def main():
+    # ?debug=1（または DIARY_DEBUG=1）で区間ごとの時間をサイドバーに出す。
+    # ?profile=1 はその1回の再実行だけ cProfile をかける
+    debug = st.query_params.get("debug") == "1" or os.environ.get("DIARY_DEBUG") == "1"
+    profile = st.query_params.get("profile") == "1"
+    if profile:
+        del st.query_params["profile"]
+    with trace_rerun("rerun", profile=profile) as trace:
+        run_app()
+    if debug or profile:
+        debug_panel(trace)
+
+def run_app():
     # セッション状態の初期化
     if 'logged_in' not in st.session_state:
         st.session_state.logged_in = False
@@ -35,7 +49,8 @@ def main():
         return
     
     # CSS適用
-    st.markdown(get_css(st.session_state.theme_name), unsafe_allow_html=True)
+    with span("ui.css"):
+        st.markdown(get_css(st.session_state.theme_name), unsafe_allow_html=True)
     
     # フローティング日記ボタン
     if st.session_state.get('current_page') != "📝 今日の振り返り":
@@ -70,7 +85,7 @@ def main():
     st.sidebar.title(" メニュー")
     page = st.sidebar.selectbox(
         "ページを選択",
-        [" 今日の振り返り", " 目標設定・管理", " 記録を振り返る", " 目標達成Tips", " 設定"],
+        [" 今日の振り返り", " 目標設定・管理", " 記録を振り返る", " 分析レポート", " 目標達成Tips", " 設定"],
         index=0
     )
     
@@ -78,22 +93,29 @@ def main():
         st.session_state.current_page = page
     
     # インスタンス作成
-    diary_manager = DiaryManager(st.session_state.user_email)
-    goal_manager = GoalManager(st.session_state.user_email)
-    bot = CounselingBot()
-    auth_manager = AuthManager()
+    with span("ui.managers"):
+        diary_manager = DiaryManager(st.session_state.user_email, on_error=show_error)
+        goal_manager = GoalManager(st.session_state.user_email, on_error=show_error)
+        bot = get_counseling_bot()
+        auth_manager = AuthManager(on_error=show_error)
     
     # ページルーティング
+    with span(f"page:{st.session_state.current_page.strip()}"):
+        route_page(diary_manager, goal_manager, bot, auth_manager)
+
+def route_page(diary_manager: DiaryManager, goal_manager: GoalManager, bot, auth_manager: AuthManager):
     if st.session_state.current_page == " 今日の振り返り":
         write_diary_page(diary_manager, bot, goal_manager)
     elif st.session_state.current_page == " 目標設定・管理":
         goals_page(goal_manager)
     elif st.session_state.current_page == " 記録を振り返る":
         history_page(diary_manager, goal_manager)
+    elif st.session_state.current_page == " 分析レポート":
+        analytics_page(diary_manager)
     elif st.session_state.current_page == " 目標達成Tips":
         tips_page()
     elif st.session_state.current_page == " 設定":
-        settings_page(auth_manager)
+        settings_page(auth_manager, diary_manager, goal_manager)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
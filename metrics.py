@@ -0,0 +1,142 @@
+import threading
+from bisect import bisect_left
+from typing import Callable, List
+
+# 応答時間などの既定のバケット（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# パースのように短い処理向けのバケット（秒）
+FAST_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class Metric:
+    """Prometheus 形式で出す指標。
+
+    値はスレッドごとの置き場に書き、出力するときに合計する。
+    各スレッドは自分の置き場しか書き換えないので、記録のたびにロックを取らない
+    （ロックを取るのはスレッドが初めて記録するときと出力のときだけ）。
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _new_values(self) -> list:
+        raise NotImplementedError
+
+    def _values(self, label_values: tuple) -> list:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+        values = shard.get(label_values)
+        if values is None:
+            values = shard[label_values] = self._new_values()
+        return values
+
+    def merged(self) -> dict:
+        """ラベルの値 -> 全スレッドの合計"""
+        with self._lock:
+            shards = list(self._shards)
+        merged = {}
+        for shard in shards:
+            for label_values, values in list(shard.items()):
+                total = merged.get(label_values)
+                if total is None:
+                    merged[label_values] = list(values)
+                else:
+                    for i, value in enumerate(values):
+                        total[i] += value
+        return merged
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_values(self) -> list:
+        return [0]
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values(label_values)[0] += amount
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(values[0])}"
+                for label_values, values in sorted(self.merged().items())]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, help_text, labels)
+
+    def _new_values(self) -> list:
+        # バケットごとの件数（最後は上限超え）と合計値
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def observe(self, value: float, *label_values):
+        values = self._values(label_values)
+        values[bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def render(self) -> List[str]:
+        lines = []
+        for label_values, values in sorted(self.merged().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                bucket_labels = _format_labels(self.labels, label_values, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, label_values)} {_format_value(values[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, label_values)} {cumulative}")
+        return lines
+
+REGISTRY: List[Metric] = []
+# 出力のたびに呼ばれ、(名前, 説明, 種類, [(ラベルの辞書, 値), ...]) の一覧を返す関数（キャッシュの統計など）
+COLLECTORS: List[Callable[[], list]] = []
+
+def register_collector(collector: Callable[[], list]):
+    COLLECTORS.append(collector)
+
+def render() -> str:
+    """登録された指標をすべて Prometheus のテキスト形式で返す"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    for collector in COLLECTORS:
+        for name, help_text, kind, samples in collector():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+HTTP_REQUESTS = Counter("diary_http_requests_total", "API へのリクエスト数", ("route", "method", "status"))
+HTTP_LATENCY = Histogram("diary_http_request_duration_seconds", "API の応答時間（秒）", ("route", "method"))
+STORAGE_READ_BYTES = Counter("diary_storage_read_bytes_total", "データファイルから読んだバイト数")
+STORAGE_WRITTEN_BYTES = Counter("diary_storage_written_bytes_total", "データファイルに書いたバイト数")
+STORAGE_PARSE_SECONDS = Histogram("diary_storage_parse_seconds", "データファイルの JSON のパース時間（秒）", buckets=FAST_BUCKETS)
+BOT_CALL_SECONDS = Histogram("diary_bot_call_seconds", "ボットの応答生成にかかった時間（秒）", ("outcome",))
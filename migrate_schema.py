@@ -0,0 +1,29 @@
+# migrate_schema.py
+# JSONファイルを現在の形式（見出し行つき・1行1レコード）に一括で書き直します。
+# 書き直さなくても各ファイルは最初に読まれたときに移行されますが、起動直後の遅延をなくしたいときに使います。
+# 使い方: python migrate_schema.py --data-dir .
+
+import argparse
+from storage import JsonBackend, SCHEMA_VERSION
+from migrate_to_sqlite import find_user_emails
+
+def migrate(data_dir: str) -> int:
+    json_backend = JsonBackend(data_dir)
+    migrated = 0
+    if json_backend.migrate_users():
+        migrated += 1
+        print("ユーザー: 移行しました")
+    for user_email in sorted(set(find_user_emails(json_backend).values())):
+        entries_migrated = json_backend.migrate_entries(user_email)
+        goals_migrated = json_backend.migrate_goals(user_email)
+        if entries_migrated or goals_migrated:
+            migrated += 1
+            print(f"{user_email or '(未ログイン)'}: 日記 {'移行' if entries_migrated else '済'} / 目標 {'移行' if goals_migrated else '済'}")
+    return migrated
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=f"JSONファイルを形式 {SCHEMA_VERSION} に移行します")
+    parser.add_argument("--data-dir", default="", help="JSONファイルのあるディレクトリ（既定: カレントディレクトリ）")
+    args = parser.parse_args()
+    count = migrate(args.data_dir)
+    print(f"完了しました（{count}件）。")
@@ -0,0 +1,58 @@
+# migrate_to_sqlite.py
+# 既存のJSONファイル（users.json / diary_entries_*.json / goals_*.json）をSQLiteへ一括投入します。
+# 使い方: python migrate_to_sqlite.py --data-dir . --db diary_app.db
+
+import argparse
+import glob
+import os
+from storage import JsonBackend, SqliteBackend, SQLITE_FILE, user_key
+
+def find_user_emails(json_backend: JsonBackend) -> dict:
+    """ファイル名のハッシュ -> メールアドレス の対応表を作る"""
+    emails = {"": ""}
+    for user in json_backend.load_users():
+        emails[user_key(user.email)] = user.email
+    # users.json に無い利用者はレコードに残っている user_email から拾う
+    patterns = ["diary_entries_*.json", "diary_entries_*.jsonl", "goals_*.json"]
+    for path in sorted(p for pattern in patterns for p in glob.glob(os.path.join(json_backend.data_dir, pattern))):
+        file_key = os.path.basename(path).rsplit("_", 1)[1].split(".")[0]
+        if file_key in emails:
+            continue
+        owner = ""
+        records = json_backend._read_records(path)
+        for record in records:
+            if record.get("user_email") and user_key(record["user_email"]) == file_key:
+                owner = record["user_email"]
+                break
+        if owner:
+            emails[file_key] = owner
+        else:
+            print(f"スキップ: 持ち主が分からないファイルです {path}")
+    return emails
+
+def migrate(data_dir: str, db_path: str):
+    json_backend = JsonBackend(data_dir)
+    sqlite_backend = SqliteBackend(db_path)
+
+    users = json_backend.load_users()
+    sqlite_backend.save_users(users)
+    print(f"ユーザー: {len(users)}件")
+
+    for user_email in sorted(set(find_user_emails(json_backend).values())):
+        # 利用者ごとに削除 + 一括挿入するので、何度実行しても重複しない
+        entries = json_backend.load_entries(user_email)
+        goals = json_backend.load_goals(user_email)
+        if entries:
+            sqlite_backend.save_entries(user_email, entries)
+        if goals:
+            sqlite_backend.save_goals(user_email, goals)
+        if entries or goals:
+            print(f"{user_email or '(未ログイン)'}: 日記 {len(entries)}件 / 目標 {len(goals)}件")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="JSONファイルのデータをSQLiteへ移行します")
+    parser.add_argument("--data-dir", default="", help="JSONファイルのあるディレクトリ（既定: カレントディレクトリ）")
+    parser.add_argument("--db", default=SQLITE_FILE, help="移行先のSQLiteファイル")
+    args = parser.parse_args()
+    migrate(args.data_dir, args.db)
+    print(f"完了しました。DIARY_STORAGE_BACKEND=sqlite DIARY_SQLITE_PATH={args.db} で起動してください。")
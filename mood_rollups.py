@@ -0,0 +1,226 @@
+import datetime
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+from data_models import DiaryEntry, MOOD_OPTIONS, entry_key
+from storage import replace_file
+
+# メモリに載せておく集計の数（利用者数）
+MAX_RESIDENT_ROLLUPS = 256
+# 差分ログがこの行数を超えたらスナップショットに畳み込む
+MAX_LOG_RECORDS = 1000
+PERIODS = ("day", "week", "month")
+
+# 気持ちの名前 -> MOOD_OPTIONS のグループ名
+MOOD_GROUPS = {mood['name']: group for group, moods in MOOD_OPTIONS.items() for mood in moods}
+
+def new_bucket() -> dict:
+    return {"count": 0, "mood_sum": 0, "mood_hist": {}, "categories": {}, "mood_groups": {}}
+
+def bucket_average(bucket: dict) -> float:
+    return bucket["mood_sum"] / bucket["count"] if bucket["count"] else 0.0
+
+def period_keys(date: str) -> dict:
+    """'2024-01-05 21:00:00' -> {'day': '2024-01-05', 'week': '2024-W01', 'month': '2024-01'}"""
+    try:
+        day = datetime.date.fromisoformat(date[:10])
+    except ValueError:
+        return {}
+    year, week, _ = day.isocalendar()
+    return {"day": day.isoformat(), "week": f"{year}-W{week:02d}", "month": day.strftime("%Y-%m")}
+
+class MoodRollups:
+    """1利用者分の日・週・月ごとの気分集計。1件の追加は O(1) で反映する。
+    ファイルはスナップショット（path）と、その後の追加を1行ずつ書く差分ログ（path + "l"）に分けて持つ"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.log_path = path + "l"
+        self.entry_count = 0
+        self.last_key = ""
+        # 集計がどの版の日記（entries_version()）に合っているか。分からなければ None
+        self.version = None
+        # 差分ログの通し番号。スナップショットに含めた分より後の行だけを読み込み時に足す
+        self.seq = 0
+        self.log_records = 0
+        self.total = new_bucket()
+        self.periods = {period: {} for period in PERIODS}
+        self.lock = threading.RLock()
+
+    def _apply(self, bucket: dict, mood: str, mood_intensity: int, category: str):
+        bucket["count"] += 1
+        bucket["mood_sum"] += mood_intensity
+        intensity = str(mood_intensity)
+        bucket["mood_hist"][intensity] = bucket["mood_hist"].get(intensity, 0) + 1
+        bucket["categories"][category] = bucket["categories"].get(category, 0) + 1
+        group = MOOD_GROUPS.get(mood, "その他")
+        bucket["mood_groups"][group] = bucket["mood_groups"].get(group, 0) + 1
+
+    def _add_values(self, date: str, mood: str, mood_intensity: int, category: str, key: str):
+        self._apply(self.total, mood, mood_intensity, category)
+        for period, period_key in period_keys(date).items():
+            self._apply(self.periods[period].setdefault(period_key, new_bucket()), mood, mood_intensity, category)
+        self.entry_count += 1
+        self.last_key = key
+
+    def add(self, entry: DiaryEntry):
+        self._add_values(entry.date, entry.mood, entry.mood_intensity, entry.category, entry_key(entry))
+
+    def rebuild(self, entries: List[DiaryEntry]):
+        """生データから集計し直す"""
+        self.entry_count = 0
+        self.last_key = ""
+        self.total = new_bucket()
+        self.periods = {period: {} for period in PERIODS}
+        for entry in entries:
+            self.add(entry)
+
+    def sync(self, entries: List[DiaryEntry], version: str = None) -> bool:
+        """entries（version の版）と食い違っていれば追いつかせて保存する。書き換えたら True"""
+        if self.entry_count == len(entries) and (not entries or entry_key(entries[-1]) == self.last_key):
+            if version is None or version == self.version:
+                return False
+            # 件数も最後の記録も同じなのに版が違う（途中の記録が書き換えられたかもしれない）
+            self.rebuild(entries)
+            self.version = version
+            self.save()
+        elif self.entry_count < len(entries) and (self.entry_count == 0 or entry_key(entries[self.entry_count - 1]) == self.last_key):
+            # 後ろに足されただけなら、その分を差分ログに書く
+            added = entries[self.entry_count:]
+            for entry in added:
+                self.add(entry)
+            self.append_log(added, version)
+        else:
+            self.rebuild(entries)
+            self.version = version
+            self.save()
+        return True
+
+    def bucket(self, period: str, key: str) -> dict:
+        return self.periods[period].get(key, new_bucket())
+
+    def series(self, period: str) -> List[tuple]:
+        """(期間キー, 集計) を古い順に返す"""
+        return sorted(self.periods[period].items())
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.entry_count = data["entry_count"]
+            self.last_key = data["last_key"]
+            self.total = data["total"]
+            self.periods = data["periods"]
+            self.version = data.get("version")
+            self.seq = data.get("seq", 0)
+        snapshot_seq = self.seq
+        if not os.path.exists(self.log_path):
+            return
+        broken = False
+        with open(self.log_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 書きかけの行から先は当てにしない（版が分からないので次の sync で確かめ直す）
+                    self.version = None
+                    broken = True
+                    break
+                self.log_records += 1
+                # スナップショットに畳み込み済みの行（畳み込み直後に落ちて残ったもの）は飛ばす
+                if record["seq"] <= snapshot_seq:
+                    continue
+                for values in record.get("add", []):
+                    self._add_values(*values)
+                self.version = record.get("version")
+                self.seq = max(self.seq, record["seq"])
+        if broken:
+            # 壊れた行の後ろに追記しないよう、読めた分で書き直す
+            self.save()
+
+    def save(self):
+        """スナップショットを書き直し、差分ログを空にする"""
+        replace_file(self.path, json.dumps({"entry_count": self.entry_count, "last_key": self.last_key, "version": self.version, "seq": self.seq,
+                                            "total": self.total, "periods": self.periods}, ensure_ascii=False).encode('utf-8'))
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+        self.log_records = 0
+
+    def append_log(self, entries: List[DiaryEntry], version: Optional[str]):
+        """add() 済みの entries と、その後の版を差分ログに1行で追記する。行が溜まったら畳み込む"""
+        self.version = version
+        self.seq += 1
+        record = {"seq": self.seq, "version": version}
+        if entries:
+            record["add"] = [[entry.date, entry.mood, entry.mood_intensity, entry.category, entry_key(entry)] for entry in entries]
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.log_records += 1
+        if self.log_records >= MAX_LOG_RECORDS:
+            self.save()
+
+_rollups = OrderedDict()
+_rollups_lock = threading.Lock()
+
+def get_rollups(path: str) -> MoodRollups:
+    with _rollups_lock:
+        rollups = _rollups.get(path)
+        if rollups is not None:
+            _rollups.move_to_end(path)
+            return rollups
+        rollups = MoodRollups(path)
+        # 読み込みが終わるまで他のスレッドに使わせない
+        rollups.lock.acquire()
+        _rollups[path] = rollups
+        while len(_rollups) > MAX_RESIDENT_ROLLUPS:
+            _rollups.popitem(last=False)
+    try:
+        rollups.load()
+    except Exception:
+        # 壊れた集計は次の sync で作り直される
+        rollups.rebuild([])
+    finally:
+        rollups.lock.release()
+    return rollups
+
+def clear_rollups():
+    """メモリに載っている集計をすべて捨てる（次に使うときにファイルから読み直す）"""
+    with _rollups_lock:
+        _rollups.clear()
+
+def record_entry(path: str, entry: DiaryEntry, before: str = None, after: str = None):
+    record_entries(path, [entry], before, after)
+
+def record_entries(path: str, entries: List[DiaryEntry], before: str = None, after: str = None):
+    """追加した entries を集計に足す。before / after は書き込み前後の entries_version()。
+    集計が before の版に合っていたときだけ after の版に合っているとみなす"""
+    rollups = get_rollups(path)
+    with rollups.lock:
+        verified = before is not None and before == rollups.version
+        for entry in entries:
+            rollups.add(entry)
+        rollups.append_log(entries, after if verified else None)
+
+def record_version(path: str, before: str, after: str):
+    """集計する項目の変わらない書き込み（ボットの応答・畳み込み）の後に、集計の版だけを進める"""
+    rollups = get_rollups(path)
+    with rollups.lock:
+        if before is not None and before == rollups.version and after != before:
+            rollups.append_log([], after)
+
+def replace_entries(path: str, entries: List[DiaryEntry], version: str = None):
+    """全件を書き換えたときに集計し直す"""
+    rollups = get_rollups(path)
+    with rollups.lock:
+        rollups.rebuild(entries)
+        rollups.version = version
+        rollups.save()
+
+def synced_rollups(path: str, entries: List[DiaryEntry], version: str = None) -> MoodRollups:
+    """entries（version の版）に合わせた集計を返す"""
+    rollups = get_rollups(path)
+    with rollups.lock:
+        rollups.sync(entries, version)
+    return rollups
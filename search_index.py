@@ -0,0 +1,233 @@
+import json
+import math
+import os
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import List
+from data_models import DiaryEntry, entry_key
+from storage import replace_file
+
+# タイトルに含まれる語は本文より重く数える
+TITLE_WEIGHT = 3
+# メモリに載せておく索引の数（利用者数）
+MAX_RESIDENT_INDEXES = 128
+# 追記ログがこのサイズを超えたらスナップショットを書き直す
+INDEX_JOURNAL_COMPACT_BYTES = 1024 * 1024
+
+def normalize(text: str) -> str:
+    # 全角英数・半角カナの揺れを吸収してから小文字にそろえる
+    return unicodedata.normalize("NFKC", text).lower()
+
+def text_grams(text: str) -> Counter:
+    """1文字と2文字の部分文字列（ユニグラム + バイグラム）を数える。日本語は分かち書きしないため"""
+    text = normalize(text)
+    grams = Counter(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    for gram in [g for g in grams if not g.strip()]:
+        del grams[gram]
+    return grams
+
+def query_grams(query: str) -> List[str]:
+    query = normalize(query)
+    if len(query) == 1:
+        grams = {query}
+    else:
+        grams = {query[i:i + 2] for i in range(len(query) - 1)}
+    return [g for g in grams if g.strip()]
+
+class SearchIndex:
+    """1利用者分の転置索引。文書IDは load_entries() の並び順（0始まり）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.journal_path = path + "l"
+        self.postings = {}
+        self.doc_count = 0
+        self.last_key = ""
+        # 索引がどの版の日記（entries_version()）に合っているか。分からなければ None
+        self.version = None
+        self.lock = threading.RLock()
+
+    def _add_grams(self, doc_id: int, grams: dict):
+        for gram, count in grams.items():
+            self.postings.setdefault(gram, {})[doc_id] = count
+
+    def _entry_grams(self, entry: DiaryEntry) -> Counter:
+        grams = text_grams(entry.content)
+        for gram, count in text_grams(entry.title).items():
+            grams[gram] += count * TITLE_WEIGHT
+        return grams
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.postings = {gram: {int(doc_id): count for doc_id, count in docs.items()} for gram, docs in data["postings"].items()}
+            self.doc_count = data["doc_count"]
+            self.last_key = data["last_key"]
+            self.version = data.get("version")
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if "doc" not in record:
+                        # 版だけを進める行
+                        self.version = record.get("version")
+                        continue
+                    if record["doc"] != self.doc_count:
+                        continue
+                    self._add_grams(record["doc"], record["grams"])
+                    self.doc_count += 1
+                    self.last_key = record["key"]
+                    self.version = record.get("version")
+
+    def save(self):
+        replace_file(self.path, json.dumps({"doc_count": self.doc_count, "last_key": self.last_key, "version": self.version,
+                                            "postings": self.postings}, ensure_ascii=False).encode('utf-8'))
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+    def _append(self, lines: List[str]):
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.writelines(lines)
+        if os.path.getsize(self.journal_path) > INDEX_JOURNAL_COMPACT_BYTES:
+            self.save()
+
+    def add(self, entries: List[DiaryEntry], version: str = None):
+        """末尾に追加し、追記ログにもまとめて書く。version は追加した後の日記の版（分からなければ None）"""
+        self.version = version
+        lines = []
+        for entry in entries:
+            doc_id = self.doc_count
+            grams = self._entry_grams(entry)
+            self._add_grams(doc_id, grams)
+            self.doc_count += 1
+            self.last_key = entry_key(entry)
+            lines.append(json.dumps({"doc": doc_id, "key": self.last_key, "grams": grams, "version": version}, ensure_ascii=False) + "\n")
+        self._append(lines)
+
+    def set_version(self, version: str):
+        """索引する項目の変わらない書き込みの後に、版だけを進める"""
+        self.version = version
+        self._append([json.dumps({"version": version}, ensure_ascii=False) + "\n"])
+
+    def sync(self, entries: list, version: str = None, reader=None):
+        """entries（version の版）と食い違っていれば、足りない末尾だけ追加するか作り直す。
+        entries に見出し（EntrySummary）を渡すときは、本文を読むための reader（load_entries_for と iter_entries を持つもの）も渡す"""
+        if self.doc_count == len(entries) and (not entries or entry_key(entries[-1]) == self.last_key):
+            if version is None or version == self.version:
+                return
+            # 件数も最後の記録も同じなのに版が違う（途中の記録が書き換えられたかもしれない）ので作り直す
+        elif self.doc_count < len(entries) and (self.doc_count == 0 or entry_key(entries[self.doc_count - 1]) == self.last_key):
+            # 本文を読むのは足りない末尾の分だけ
+            self.add(_load_bodies(entries[self.doc_count:], reader), version)
+            return
+        self.postings = {}
+        self.doc_count = 0
+        self.last_key = ""
+        for doc_id, entry in enumerate(entries if reader is None else reader.iter_entries()):
+            self._add_grams(doc_id, self._entry_grams(entry))
+            self.doc_count = doc_id + 1
+            self.last_key = entry_key(entry)
+        # 見出しを読んだ後に書き込まれて並びが合わなければ、版は分からないことにする（次の検索で作り直す）
+        matched = self.doc_count == len(entries) and (not entries or entry_key(entries[-1]) == self.last_key)
+        self.version = version if matched else None
+        self.save()
+
+    def search(self, query: str) -> List[int]:
+        """クエリの全バイグラムを含む文書を、スコアの高い順（同点は新しい順）に返す"""
+        grams = query_grams(query)
+        if not grams:
+            return list(range(self.doc_count - 1, -1, -1))
+        postings = sorted((self.postings.get(gram, {}) for gram in grams), key=len)
+        candidates = set(postings[0])
+        if not candidates:
+            return []
+        for docs in postings[1:]:
+            candidates.intersection_update(docs)
+            if not candidates:
+                return []
+        scores = {}
+        for docs in postings:
+            idf = math.log(1 + self.doc_count / len(docs))
+            for doc_id in candidates:
+                scores[doc_id] = scores.get(doc_id, 0.0) + docs[doc_id] * idf
+        return sorted(candidates, key=lambda doc_id: (scores[doc_id], doc_id), reverse=True)
+
+def _load_bodies(entries: list, reader) -> List[DiaryEntry]:
+    if reader is None:
+        return entries
+    bodies = reader.load_entries_for(entries)
+    for summary, entry in zip(entries, bodies):
+        if entry is None:
+            raise LookupError(f"記録が読めません: {summary.id}")
+    return bodies
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+def get_index(path: str, load: bool = True):
+    """プロセス共通の索引を返す。load=False ならメモリに載っているものだけを返す"""
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is not None:
+            _indexes.move_to_end(path)
+            return index
+        if not load:
+            return None
+        index = SearchIndex(path)
+        # 読み込みが終わるまで他のスレッドに使わせない
+        index.lock.acquire()
+        _indexes[path] = index
+        while len(_indexes) > MAX_RESIDENT_INDEXES:
+            _indexes.popitem(last=False)
+    try:
+        index.load()
+    except Exception:
+        # 壊れた索引は空から作り直す
+        index.postings, index.doc_count, index.last_key, index.version = {}, 0, "", None
+    finally:
+        index.lock.release()
+    return index
+
+def clear_indexes():
+    """メモリに載っている索引をすべて捨てる（次に使うときにファイルから読み直す）"""
+    with _indexes_lock:
+        _indexes.clear()
+
+def record_entries(path: str, entries: List[DiaryEntry], before: str = None, after: str = None):
+    """追加した entries を、メモリに載っている索引にだけ足す（載っていなければ検索時に補正される）。
+    before / after は書き込み前後の entries_version()。索引が before の版に合っていたときだけ after の版とみなす"""
+    index = get_index(path, load=False)
+    if index is None:
+        return
+    with index.lock:
+        index.add(entries, after if before is not None and before == index.version else None)
+
+def record_version(path: str, before: str, after: str):
+    """索引する項目の変わらない書き込み（ボットの応答・畳み込み）の後に、索引の版だけを進める"""
+    index = get_index(path, load=False)
+    if index is None:
+        return
+    with index.lock:
+        if before is not None and before == index.version and after != before:
+            index.set_version(after)
+
+def search_entries(path: str, entries: list, query: str, version: str = None, reader=None) -> List[DiaryEntry]:
+    """entries（version の版）からタイトル・本文に query を含むものを関連度の高い順に返す。
+    entries が見出しなら、本文は reader から候補の分だけ読む（SearchIndex.sync を参照）"""
+    index = get_index(path)
+    with index.lock:
+        index.sync(entries, version, reader)
+        doc_ids = index.search(query)
+    # バイグラムの一致は候補の絞り込みなので、最後に部分文字列として確かめる
+    needle = normalize(query)
+    candidates = [entries[doc_id] for doc_id in doc_ids if doc_id < len(entries)]
+    if reader is not None:
+        candidates = reader.load_entries_for(candidates)
+    return [entry for entry in candidates
+            if entry is not None and (needle in normalize(entry.title) or needle in normalize(entry.content))]
@@ -0,0 +1,1148 @@
+import json
+import os
+import hashlib
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+from dataclasses import asdict, replace
+from data_models import Goal, DiaryEntry, EntrySummary, User, SUMMARY_FIELDS, summarize_entry
+from data_cache import parsed_data_cache
+from group_commit import GroupCommitQueue
+from errors import ConflictError
+from instrumentation import trace_methods
+from metrics import STORAGE_PARSE_SECONDS, STORAGE_READ_BYTES, STORAGE_WRITTEN_BYTES
+try:
+    import fcntl
+except ImportError:  # Windows ではプロセス内のロックだけで動かす
+    fcntl = None
+
+# ジャーナルがこのサイズを超えたらスナップショットに畳み込む
+JOURNAL_COMPACT_BYTES = 1024 * 1024
+
+USERS_FILE = "users.json"
+SQLITE_FILE = "diary_app.db"
+
+# データファイルの形式の版数。1 は見出し行のない旧形式（JSON の配列 / 見出しなしの JSONL）。
+# 2 からは1行目が {"schema": 種類, "version": 版数} で、2行目以降が1行1レコード
+SCHEMA_VERSION = 2
+# SQLite の DB の版数（PRAGMA user_version）。2 までは上と同じ値を使っていた。3 で (利用者, id) の一意索引を足した
+SQLITE_SCHEMA_VERSION = 3
+
+def user_key(user_email: str) -> str:
+    return hashlib.md5(user_email.encode()).hexdigest()
+
+def entries_filename(user_email: str) -> str:
+    return f"diary_entries_{user_key(user_email)}.json" if user_email else "diary_entries.json"
+
+def goals_filename(user_email: str) -> str:
+    return f"goals_{user_key(user_email)}.json" if user_email else "goals.json"
+
+def replace_file(path: str, data: bytes):
+    """path の中身を data に置き換える。途中で落ちても古い中身か新しい中身のどちらかが残る"""
+    # 一時ファイル名は書き込みごとに変え、別プロセスの書き込みと混ざらないようにする
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _copy_items(items: list) -> list:
+    # dataclass の浅いコピー。フィールドは文字列・数値・タプルだけなので浅いコピーで足り、copy.copy より数倍速い
+    copies = []
+    for item in items:
+        item_copy = object.__new__(type(item))
+        item_copy.__dict__.update(item.__dict__)
+        copies.append(item_copy)
+    return copies
+
+def legacy_entry_id(date: str, title: str, content: str) -> str:
+    # id が導入される前の記録には、内容から決まる固定の id を振る
+    return "legacy-" + hashlib.md5(f"{date}\t{title}\t{content}".encode()).hexdigest()
+
+def _entry_from_dict(entry_data: dict) -> DiaryEntry:
+    if 'mood_intensity' not in entry_data:
+        entry_data['mood_intensity'] = 3
+    if not entry_data.get('id'):
+        entry_data['id'] = legacy_entry_id(entry_data['date'], entry_data['title'], entry_data['content'])
+    return DiaryEntry(**entry_data)
+
+def _goal_from_dict(goal_data: dict) -> Goal:
+    if 'progress' in goal_data:
+        del goal_data['progress']
+    return Goal(**goal_data)
+
+def _user_from_dict(user_data: dict) -> User:
+    if 'nickname' not in user_data:
+        user_data['nickname'] = user_data['email'].split('@')[0]
+    return User(**user_data)
+
+def _migrate_entry_v1(entry_data: dict) -> dict:
+    if "_update" in entry_data:
+        return entry_data
+    return asdict(_entry_from_dict(entry_data))
+
+def _migrate_goal_v1(goal_data: dict) -> dict:
+    return asdict(_goal_from_dict(goal_data))
+
+def _migrate_user_v1(user_data: dict) -> dict:
+    return asdict(_user_from_dict(user_data))
+
+# 種類 -> {変換元の版数: 1レコードを次の版に変換する関数}
+MIGRATIONS = {
+    "entries": {1: _migrate_entry_v1},
+    "goals": {1: _migrate_goal_v1},
+    "users": {1: _migrate_user_v1},
+}
+
+def migrate_records(kind: str, version: int, records: list) -> list:
+    """version の形式で書かれたレコードを現在の形式まで順に変換する"""
+    while version < SCHEMA_VERSION:
+        step = MIGRATIONS[kind][version]
+        records = [step(record) for record in records]
+        version += 1
+    return records
+
+def schema_header(kind: str) -> bytes:
+    return (json.dumps({"schema": kind, "version": SCHEMA_VERSION}) + "\n").encode('utf-8')
+
+class StorageBackend:
+    """日記・目標・ユーザーの保存先。DiaryManager / GoalManager / AuthManager から使われる"""
+
+    def load_entries(self, user_email: str) -> List[DiaryEntry]:
+        raise NotImplementedError
+
+    def save_entries(self, user_email: str, entries: List[DiaryEntry], expected_version: str = None):
+        """全件を書き換える。expected_version が現在の版数と違えば ConflictError"""
+        raise NotImplementedError
+
+    def add_entry(self, user_email: str, entry: DiaryEntry):
+        raise NotImplementedError
+
+    def add_entries(self, user_email: str, entries: List[DiaryEntry]) -> List[DiaryEntry]:
+        """まとめて追記する。同じ id の記録が既にあるもの（再送など）は書かずに飛ばし、書いたものを返す"""
+        existing = {summary.id for summary in self.load_entry_summaries(user_email)}
+        added = []
+        for entry in entries:
+            if entry.id not in existing:
+                self.add_entry(user_email, entry)
+                existing.add(entry.id)
+                added.append(entry)
+        return added
+
+    def update_entry(self, user_email: str, entry_id: str, changes: dict):
+        """id で指定した記録の一部の項目（bot_response など）だけを書き換える"""
+        raise NotImplementedError
+
+    def load_entry_summaries(self, user_email: str) -> List[EntrySummary]:
+        """本文を除いた見出しの一覧（load_entries() と同じ並び）"""
+        return [summarize_entry(entry) for entry in self.load_entries(user_email)]
+
+    def iter_entries(self, user_email: str) -> Iterator[DiaryEntry]:
+        """load_entries() と同じ並びで1件ずつ返す。全件をメモリに載せずに読めるバックエンドはそうする"""
+        yield from self.load_entries(user_email)
+
+    def load_entry(self, user_email: str, summary: EntrySummary) -> Optional[DiaryEntry]:
+        """見出しに対応する記録を本文つきで読む。見つからなければ None"""
+        matches = [entry for entry in self.load_entries(user_email) if entry.id == summary.id]
+        return matches[-1] if matches else None
+
+    def load_entries_for(self, user_email: str, summaries: List[EntrySummary]) -> List[Optional[DiaryEntry]]:
+        """summaries と同じ並びで記録を本文つきで読む（見つからないものは None）。まとめて読めるバックエンドはそうする"""
+        return [self.load_entry(user_email, summary) for summary in summaries]
+
+    def compact_entries(self, user_email: str):
+        pass
+
+    def entries_version(self, user_email: str) -> str:
+        """日記の内容が変わるたびに変わる版数。中身を読まずに取得できる"""
+        raise NotImplementedError
+
+    def sidecar_path(self, user_email: str, kind: str, ext: str = ".json") -> str:
+        """データファイルの隣に置く補助ファイル（索引など）のパス"""
+        raise NotImplementedError
+
+    def load_goals(self, user_email: str) -> List[Goal]:
+        raise NotImplementedError
+
+    def goals_version(self, user_email: str) -> str:
+        raise NotImplementedError
+
+    def save_goals(self, user_email: str, goals: List[Goal], expected_version: str = None):
+        raise NotImplementedError
+
+    def add_goal(self, user_email: str, goal: Goal):
+        raise NotImplementedError
+
+    def add_goals(self, user_email: str, goals: List[Goal]) -> List[Goal]:
+        """まとめて追加する。同じ id の目標が既にあるものは書かずに飛ばし、書いたものを返す"""
+        existing = {goal.id for goal in self.load_goals(user_email)}
+        added = []
+        for goal in goals:
+            if goal.id not in existing:
+                self.add_goal(user_email, goal)
+                existing.add(goal.id)
+                added.append(goal)
+        return added
+
+    def delete_goal(self, user_email: str, goal_id: str):
+        raise NotImplementedError
+
+    def load_users(self) -> List[User]:
+        raise NotImplementedError
+
+    def save_users(self, users: List[User]):
+        raise NotImplementedError
+
+    def get_user(self, email: str) -> Optional[User]:
+        raise NotImplementedError
+
+    def add_user(self, user: User):
+        """既に登録済みのメールアドレスなら ConflictError"""
+        raise NotImplementedError
+
+    def update_user(self, user: User):
+        raise NotImplementedError
+
+class _WriteLock:
+    """利用者ごとの書き込みロック。プロセス内はスレッドロック、プロセス間はロックファイルへの flock で排他する"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._owner = None
+        self._file = None
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            # 同じプロセスでも別に開いたファイルの flock は競合するので、最初の1回だけ取る
+            try:
+                self._file = open(self.path, 'a+b')
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            except BaseException:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+        self._owner = threading.get_ident()
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            self._owner = None
+            if self._file is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+                self._file.close()
+                self._file = None
+        self._thread_lock.release()
+
+    def held_by_current_thread(self) -> bool:
+        return self._owner == threading.get_ident()
+
+@trace_methods("storage")
+class JsonBackend(StorageBackend):
+    """作業ディレクトリ上のJSONファイルに保存する従来の方式"""
+
+    def __init__(self, data_dir: str = "", group_commit_ms: float = 0):
+        self.data_dir = data_dir
+        # group_commit_ms > 0 なら、同じジャーナルへの追記をその時間だけ待ってまとめて fsync する
+        self.group_commit = GroupCommitQueue(group_commit_ms / 1000) if group_commit_ms > 0 else None
+        # email -> User の索引。users.json と users.jsonl の状態が変わったときだけ読み直す
+        self._users = {}
+        self._users_snapshot_stat = None
+        self._users_journal_stat = None
+        self._users_journal_offset = 0
+        self._users_lock = threading.RLock()
+        # 書き込みロック（利用者ごと。ユーザー一覧は user_email="" で1つ）
+        self._write_locks = {}
+        self._write_locks_guard = threading.Lock()
+
+    def entries_path(self, user_email: str) -> str:
+        return os.path.join(self.data_dir, entries_filename(user_email))
+
+    def journal_path(self, user_email: str) -> str:
+        # 追記専用ジャーナル（1行1エントリーのJSONL）。entries_path はスナップショットとして扱う
+        return self.entries_path(user_email) + "l"
+
+    def goals_path(self, user_email: str) -> str:
+        return os.path.join(self.data_dir, goals_filename(user_email))
+
+    def users_path(self) -> str:
+        return os.path.join(self.data_dir, USERS_FILE)
+
+    def sidecar_path(self, user_email: str, kind: str, ext: str = ".json") -> str:
+        return os.path.join(self.data_dir, f"{kind}_{user_key(user_email)}{ext}" if user_email else f"{kind}{ext}")
+
+    def users_journal_path(self) -> str:
+        return self.users_path() + "l"
+
+    def summaries_path(self, user_email: str) -> str:
+        # スナップショットの見出しとバイト位置。スナップショットを書き換えたときに作り直す
+        return self.sidecar_path(user_email, "entry_summaries")
+
+    def _write_lock(self, user_email: str) -> _WriteLock:
+        with self._write_locks_guard:
+            lock = self._write_locks.get(user_email)
+            if lock is None:
+                lock = self._write_locks[user_email] = _WriteLock(self.sidecar_path(user_email, "write", ".lock"))
+            return lock
+
+    @contextmanager
+    def _locked(self, user_email: str):
+        """その利用者のファイルを読み書きする間、他のスレッド・プロセスの書き込みを待たせる"""
+        lock = self._write_lock(user_email)
+        lock.acquire()
+        try:
+            yield
+        finally:
+            lock.release()
+
+    def _stat_version(self, paths: list) -> str:
+        # (inode, 更新時刻, サイズ) から作る版数。置き換え・追記のたびに変わる
+        stats = [self._file_stat(path) for path in paths]
+        return "-".join(f"{stat[0]}.{stat[1]}.{stat[2]}" if stat else "0" for stat in stats)
+
+    def _file_stat(self, path: str) -> Optional[tuple]:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _cached_load(self, key: str, paths: list, loader) -> list:
+        # ファイルの状態が前回と同じならパースせずキャッシュから返す。
+        # 呼び出し側が要素を書き換えても（update_bot_response など）キャッシュに響かないよう、毎回コピーを渡す
+        stats = tuple(self._file_stat(path) for path in paths)
+        value = parsed_data_cache.get(key, stats)
+        if value is None:
+            value = loader()
+            parsed_data_cache.put(key, stats, value, sum(stat[2] for stat in stats if stat))
+        return _copy_items(value)
+
+    def _file_version(self, path: str) -> int:
+        """1行目の見出しから形式の版数を読む。ファイルが無い・空なら現在の版数"""
+        try:
+            with open(path, 'rb') as f:
+                first_line = f.readline()
+        except FileNotFoundError:
+            return SCHEMA_VERSION
+        if not first_line.strip():
+            return SCHEMA_VERSION
+        try:
+            header = json.loads(first_line)
+        except ValueError:
+            # 複数行にわたる JSON の配列（旧形式）
+            return 1
+        if isinstance(header, dict) and "schema" in header:
+            return header["version"]
+        return 1
+
+    def _is_current(self, paths: list) -> bool:
+        return all(self._file_version(path) >= SCHEMA_VERSION for path in paths)
+
+    def _read_records(self, path: str) -> list:
+        """見出し行を除いたレコード一覧。旧形式の JSON の配列もそのまま読む"""
+        if not os.path.exists(path):
+            return []
+        with open(path, 'rb') as f:
+            data = f.read()
+        STORAGE_READ_BYTES.inc(amount=len(data))
+        started = time.perf_counter()
+        records = json.loads(data) if data[:64].lstrip()[:1] == b"[" else self._parse_lines(data)
+        STORAGE_PARSE_SECONDS.observe(time.perf_counter() - started)
+        return records
+
+    def _write_records(self, path: str, kind: str, records: list) -> list:
+        """見出し行と1行1レコードで書き直し、各レコードの (バイト位置, 長さ) を返す"""
+        header = schema_header(kind)
+        lines = [(json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8') for record in records]
+        spans = []
+        position = len(header)
+        for line in lines:
+            spans.append((position, len(line) - 1))
+            position += len(line)
+        self._replace_file(path, header + b"".join(lines))
+        return spans
+
+    def _replace_file(self, path: str, data: bytes):
+        replace_file(path, data)
+        STORAGE_WRITTEN_BYTES.inc(amount=len(data))
+
+    def _read_journal(self, path: str) -> list:
+        return self._read_journal_from(path, 0)[0]
+
+    def _parse_lines(self, data: bytes) -> list:
+        """1行1レコードのデータを読む。見出し行は除く"""
+        # 先に str にしておく（bytes のまま json.loads に渡すより速い）
+        text = data.decode('utf-8', 'replace')
+        start = text.find("\n") + 1 if text.startswith('{"schema"') else 0
+        body = text[start:].rstrip()
+        if not body:
+            return []
+        try:
+            # JSON の文字列は改行を含まないので、改行を区切りに置き換えて1回でパースする（1行ずつより速い）
+            return json.loads("[" + body.replace("\n", ",") + "]")
+        except ValueError:
+            pass
+        records = []
+        for line in body.split("\n"):
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # 書き込み途中で落ちた行は読み飛ばす
+                continue
+        return records
+
+    def _iter_records(self, path: str) -> Iterator[dict]:
+        """1行1レコードのファイルを1行ずつ読む。見出し行と書き込み途中で切れた行は飛ばす"""
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            for line in f:
+                STORAGE_READ_BYTES.inc(amount=len(line))
+                if not line.strip() or line.startswith(b'{"schema"'):
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def _read_journal_from(self, path: str, offset: int) -> tuple:
+        """offset 以降の完結した行を読み、(レコード一覧, 読み終えた位置) を返す"""
+        records = []
+        if not os.path.exists(path):
+            return records, 0
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        STORAGE_READ_BYTES.inc(amount=len(data))
+        # 改行で終わっていない末尾は書き込み途中の可能性があるので次回に回す
+        end = data.rfind(b"\n") + 1
+        started = time.perf_counter()
+        records = self._parse_lines(data[:end])
+        STORAGE_PARSE_SECONDS.observe(time.perf_counter() - started)
+        return records, offset + end
+
+    def _append_journal(self, path: str, kind: str, record: dict):
+        self._append_lines(path, kind, (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8'))
+
+    def _append_lines(self, path: str, kind: str, data: bytes):
+        with open(path, 'a+b') as f:
+            # 前回の書き込みが途中で切れていたら改行を補って行を分ける
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    data = b"\n" + data
+            else:
+                data = schema_header(kind) + data
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        STORAGE_WRITTEN_BYTES.inc(amount=len(data))
+
+    def load_entries(self, user_email: str) -> List[DiaryEntry]:
+        entries_path = self.entries_path(user_email)
+        journal_path = self.journal_path(user_email)
+        def parse():
+            if not self._is_current([entries_path, journal_path]):
+                self.migrate_entries(user_email)
+            return self._entries_from_records(self._read_records(entries_path) + self._read_records(journal_path))
+        return self._cached_load(entries_path, [entries_path, journal_path], parse)
+
+    def iter_entries(self, user_email: str) -> Iterator[DiaryEntry]:
+        entries_path = self.entries_path(user_email)
+        journal_path = self.journal_path(user_email)
+        if not self._is_current([entries_path, journal_path]):
+            self.migrate_entries(user_email)
+        # ジャーナルは畳み込みで小さく保たれるので先に全部読み、部分更新を振り分けておく
+        snapshot_changes = {}
+        journal_entries = {}
+        for record in self._read_records(journal_path):
+            if "_update" in record:
+                target = journal_entries.get(record["_update"])
+                if target is not None:
+                    target.update(record["changes"])
+                else:
+                    snapshot_changes.setdefault(record["_update"], {}).update(record["changes"])
+                continue
+            # 同じ id が既にあれば置き換える（並びは最初に現れた位置のまま。_entries_from_records と同じ）
+            if record["id"] in journal_entries:
+                journal_entries[record["id"]].clear()
+                journal_entries[record["id"]].update(record)
+            else:
+                journal_entries[record["id"]] = dict(record)
+        # スナップショットは1行ずつ読んで返す。ジャーナルに同じ id があればそちらを返す
+        for record in self._iter_records(entries_path):
+            journal_record = journal_entries.pop(record.get("id"), None)
+            if journal_record is not None:
+                yield DiaryEntry(**journal_record)
+                continue
+            changes = snapshot_changes.get(record.get("id"))
+            yield DiaryEntry(**dict(record, **changes)) if changes else DiaryEntry(**record)
+        for record in journal_entries.values():
+            yield DiaryEntry(**record)
+
+    def _entries_from_records(self, records: list) -> List[DiaryEntry]:
+        # 現在の形式のレコードは補正せずにそのまま組み立てる
+        entries = []
+        positions = {}
+        for entry_data in records:
+            if "_update" in entry_data:
+                # ジャーナル上の部分更新を、対象の記録に重ねる
+                position = positions.get(entry_data["_update"])
+                if position is not None:
+                    entries[position] = replace(entries[position], **entry_data["changes"])
+                continue
+            entry = DiaryEntry(**entry_data)
+            position = positions.get(entry.id)
+            if position is not None:
+                # 同じ id がもう一度現れたら置き換える（スナップショットを書いた直後、ジャーナルを消す前に
+                # 落ちると、スナップショットに畳み込み済みのジャーナルが残るため）
+                entries[position] = entry
+                continue
+            positions[entry.id] = len(entries)
+            entries.append(entry)
+        return entries
+
+    def migrate_entries(self, user_email: str) -> bool:
+        """旧形式の日記ファイルを現在の形式に書き直す。書き直したら True"""
+        entries_path = self.entries_path(user_email)
+        journal_path = self.journal_path(user_email)
+        with self._locked(user_email):
+            if self._is_current([entries_path, journal_path]):
+                return False
+            records = migrate_records("entries", self._file_version(entries_path), self._read_records(entries_path))
+            records += migrate_records("entries", self._file_version(journal_path), self._read_records(journal_path))
+            self.save_entries(user_email, self._entries_from_records(records))
+            return True
+
+    def save_entries(self, user_email: str, entries: List[DiaryEntry], expected_version: str = None):
+        with self._locked(user_email):
+            if expected_version is not None and self.entries_version(user_email) != expected_version:
+                raise ConflictError("他の画面や端末で日記が更新されています。読み込み直してからもう一度保存してください")
+            parsed_data_cache.invalidate(self.entries_path(user_email))
+            parsed_data_cache.invalidate(self.summaries_path(user_email))
+            spans = self._write_records(self.entries_path(user_email), "entries", [asdict(entry) for entry in entries])
+            # スナップショットに全件含まれたのでジャーナルは不要
+            journal_path = self.journal_path(user_email)
+            if os.path.exists(journal_path):
+                os.remove(journal_path)
+            # 書いた位置が分かっているので、見出しの索引もここで作っておく
+            self._save_summaries(user_email, [summarize_entry(entry, (("entries",) + span,)) for entry, span in zip(entries, spans)])
+
+    def _append_entry_record(self, user_email: str, record: dict):
+        journal_path = self.journal_path(user_email)
+        # すでにロックを持っている呼び出しは、まとめ役を待つとデッドロックするので直接書く
+        grouped = self.group_commit is not None and not self._write_lock(user_email).held_by_current_thread()
+        if grouped:
+            # まとめ役がロックを取って書くので、ここではロックを持たずに確定を待つ
+            data = (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+            self.group_commit.append(journal_path, data, lambda path, lines: self._append_lines(path, "entries", lines), lambda: self._locked(user_email))
+        # 畳み込みの最中に追記が消えないよう、追記も同じロックの中で行う
+        with self._locked(user_email):
+            if not grouped:
+                self._append_journal(journal_path, "entries", record)
+            parsed_data_cache.invalidate(self.entries_path(user_email))
+            parsed_data_cache.invalidate(self.summaries_path(user_email))
+            if os.path.getsize(journal_path) > JOURNAL_COMPACT_BYTES:
+                self.compact_entries(user_email)
+
+    def add_entry(self, user_email: str, entry: DiaryEntry):
+        self._append_entry_record(user_email, asdict(entry))
+
+    def add_entries(self, user_email: str, entries: List[DiaryEntry]) -> List[DiaryEntry]:
+        journal_path = self.journal_path(user_email)
+        # 既にある id の確認から追記までを同じロックの中で行い、同時の再送でも二重に書かない
+        with self._locked(user_email):
+            existing = {summary.id for summary in self.load_entry_summaries(user_email)}
+            added = []
+            for entry in entries:
+                if entry.id not in existing:
+                    existing.add(entry.id)
+                    added.append(entry)
+            if not added:
+                return added
+            # 何件あっても追記と fsync は1回
+            data = "".join(json.dumps(asdict(entry), ensure_ascii=False) + "\n" for entry in added).encode('utf-8')
+            self._append_lines(journal_path, "entries", data)
+            parsed_data_cache.invalidate(self.entries_path(user_email))
+            parsed_data_cache.invalidate(self.summaries_path(user_email))
+            if os.path.getsize(journal_path) > JOURNAL_COMPACT_BYTES:
+                self.compact_entries(user_email)
+        return added
+
+    def update_entry(self, user_email: str, entry_id: str, changes: dict):
+        self._append_entry_record(user_email, {"_update": entry_id, "changes": changes})
+
+    def entries_version(self, user_email: str) -> str:
+        return self._stat_version([self.entries_path(user_email), self.journal_path(user_email)])
+
+    def load_entry_summaries(self, user_email: str) -> List[EntrySummary]:
+        entries_path = self.entries_path(user_email)
+        journal_path = self.journal_path(user_email)
+        def parse():
+            if not self._is_current([entries_path, journal_path]):
+                self.migrate_entries(user_email)
+            summaries = self._snapshot_summaries(user_email)
+            positions = {summary.id: i for i, summary in enumerate(summaries)}
+            # ジャーナルは畳み込みで小さく保たれるので、毎回読み直す
+            for record, location in self._records_with_locations(journal_path, "journal"):
+                if "_update" in record:
+                    position = positions.get(record["_update"])
+                    if position is not None:
+                        summary = summaries[position]
+                        changes = {name: value for name, value in record["changes"].items() if name in SUMMARY_FIELDS}
+                        summaries[position] = replace(summary, locations=summary.locations + (location,), **changes)
+                    continue
+                # 同じ id が既にあれば置き換える（_entries_from_records と同じ）
+                position = positions.get(record["id"])
+                if position is not None:
+                    summaries[position] = self._summary_from_record(record, (location,))
+                    continue
+                positions[record["id"]] = len(summaries)
+                summaries.append(self._summary_from_record(record, (location,)))
+            return summaries
+        return self._cached_load(self.summaries_path(user_email), [entries_path, journal_path], parse)
+
+    def _summary_from_record(self, record: dict, locations: tuple) -> EntrySummary:
+        return EntrySummary(record["id"], record["date"], record["title"], record["mood"], record["mood_intensity"], record["category"], locations)
+
+    def _records_with_locations(self, path: str, source: str) -> list:
+        """1行ずつ読み、(レコード, (source, バイト位置, 長さ)) の一覧を返す。書き込み途中の末尾と壊れた行は飛ばす"""
+        if not os.path.exists(path):
+            return []
+        with open(path, 'rb') as f:
+            data = f.read()
+        STORAGE_READ_BYTES.inc(amount=len(data))
+        started = time.perf_counter()
+        items = []
+        position = 0
+        # 改行で終わっていない最後の断片は使わない
+        for line in data.split(b"\n")[:-1]:
+            if line.strip() and not line.startswith(b'{"schema"'):
+                try:
+                    items.append((json.loads(line), (source, position, len(line))))
+                except ValueError:
+                    pass
+            position += len(line) + 1
+        STORAGE_PARSE_SECONDS.observe(time.perf_counter() - started)
+        return items
+
+    def _snapshot_summaries(self, user_email: str) -> List[EntrySummary]:
+        """スナップショットの見出し。索引ファイルが今のスナップショットのものでなければ作り直す"""
+        entries_path = self.entries_path(user_email)
+        snapshot_stat = self._file_stat(entries_path)
+        try:
+            with open(self.summaries_path(user_email), 'rb') as f:
+                raw = f.read()
+            STORAGE_READ_BYTES.inc(amount=len(raw))
+            data = json.loads(raw)
+            if snapshot_stat is not None and tuple(data["snapshot"]) == snapshot_stat:
+                return [EntrySummary(*row[:6], (("entries", row[6], row[7]),)) for row in data["summaries"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        with self._locked(user_email):
+            summaries = [self._summary_from_record(record, (location,)) for record, location in self._records_with_locations(entries_path, "entries")]
+            self._save_summaries(user_email, summaries)
+        return summaries
+
+    def _save_summaries(self, user_email: str, summaries: List[EntrySummary]):
+        snapshot_stat = self._file_stat(self.entries_path(user_email))
+        if snapshot_stat is None:
+            return
+        rows = [[s.id, s.date, s.title, s.mood, s.mood_intensity, s.category, s.locations[0][1], s.locations[0][2]] for s in summaries]
+        self._replace_file(self.summaries_path(user_email), json.dumps({"snapshot": snapshot_stat, "summaries": rows}, ensure_ascii=False).encode('utf-8'))
+
+    def load_entry(self, user_email: str, summary: EntrySummary) -> Optional[DiaryEntry]:
+        return self.load_entries_for(user_email, [summary])[0]
+
+    def load_entries_for(self, user_email: str, summaries: List[EntrySummary]) -> List[Optional[DiaryEntry]]:
+        # スナップショットとジャーナルは1回ずつだけ開き、各記録の位置を読む
+        paths = {"entries": self.entries_path(user_email), "journal": self.journal_path(user_email)}
+        files = {}
+        try:
+            return [self._read_entry_at(user_email, summary, paths, files) for summary in summaries]
+        finally:
+            for f in files.values():
+                f.close()
+
+    def _read_entry_at(self, user_email: str, summary: EntrySummary, paths: dict, files: dict) -> Optional[DiaryEntry]:
+        if not summary.locations:
+            return super().load_entry(user_email, summary)
+        entry_data = None
+        try:
+            for source, offset, length in summary.locations:
+                f = files.get(source)
+                if f is None:
+                    f = files[source] = open(paths[source], 'rb')
+                f.seek(offset)
+                line = f.read(length)
+                STORAGE_READ_BYTES.inc(amount=len(line))
+                record = json.loads(line)
+                if entry_data is None and record.get("id") == summary.id:
+                    entry_data = record
+                elif entry_data is not None and record.get("_update") == summary.id:
+                    entry_data.update(record["changes"])
+                else:
+                    raise ValueError("位置がずれています")
+            return DiaryEntry(**entry_data)
+        except (OSError, ValueError, KeyError, TypeError):
+            # 見出しを読んだ後にファイルが書き換わっていたら全件から探す
+            return super().load_entry(user_email, summary)
+
+    def compact_entries(self, user_email: str):
+        """ジャーナルをスナップショットに畳み込む"""
+        with self._locked(user_email):
+            if os.path.exists(self.journal_path(user_email)):
+                self.save_entries(user_email, self.load_entries(user_email))
+
+    def load_goals(self, user_email: str) -> List[Goal]:
+        goals_path = self.goals_path(user_email)
+        def parse():
+            if not self._is_current([goals_path]):
+                self.migrate_goals(user_email)
+            return [Goal(**goal_data) for goal_data in self._read_records(goals_path)]
+        return self._cached_load(goals_path, [goals_path], parse)
+
+    def migrate_goals(self, user_email: str) -> bool:
+        """旧形式の目標ファイルを現在の形式に書き直す。書き直したら True"""
+        goals_path = self.goals_path(user_email)
+        with self._locked(user_email):
+            if self._is_current([goals_path]):
+                return False
+            records = migrate_records("goals", self._file_version(goals_path), self._read_records(goals_path))
+            self.save_goals(user_email, [Goal(**goal_data) for goal_data in records])
+            return True
+
+    def goals_version(self, user_email: str) -> str:
+        return self._stat_version([self.goals_path(user_email)])
+
+    def save_goals(self, user_email: str, goals: List[Goal], expected_version: str = None):
+        with self._locked(user_email):
+            if expected_version is not None and self.goals_version(user_email) != expected_version:
+                raise ConflictError("他の画面や端末で目標が更新されています。読み込み直してからもう一度保存してください")
+            parsed_data_cache.invalidate(self.goals_path(user_email))
+            self._write_records(self.goals_path(user_email), "goals", [asdict(goal) for goal in goals])
+
+    def add_goal(self, user_email: str, goal: Goal):
+        # 読んでから書くまでをロックで囲み、同時に追加された目標を失わないようにする
+        with self._locked(user_email):
+            goals = self.load_goals(user_email)
+            goals.append(goal)
+            self.save_goals(user_email, goals)
+
+    def add_goals(self, user_email: str, goals: List[Goal]) -> List[Goal]:
+        # 既にある id の確認から書き込みまでを同じロックの中で行い、その間の追加・削除を上書きしない
+        with self._locked(user_email):
+            current = self.load_goals(user_email)
+            existing = {goal.id for goal in current}
+            added = []
+            for goal in goals:
+                if goal.id not in existing:
+                    existing.add(goal.id)
+                    added.append(goal)
+            if added:
+                self.save_goals(user_email, current + added)
+        return added
+
+    def delete_goal(self, user_email: str, goal_id: str):
+        with self._locked(user_email):
+            goals = self.load_goals(user_email)
+            self.save_goals(user_email, [goal for goal in goals if goal.id != goal_id])
+
+    def _refresh_users(self):
+        snapshot_stat = self._file_stat(self.users_path())
+        journal_stat = self._file_stat(self.users_journal_path())
+        journal_replaced = (journal_stat is None or self._users_journal_stat is None
+                            or journal_stat[0] != self._users_journal_stat[0]
+                            or journal_stat[2] < self._users_journal_offset)
+        if snapshot_stat != self._users_snapshot_stat or (journal_replaced and journal_stat != self._users_journal_stat):
+            # スナップショットが書き換わった / ジャーナルが作り直された場合は全体を読み直す
+            if not self._is_current([self.users_path(), self.users_journal_path()]):
+                self.migrate_users()
+                return self._refresh_users()
+            users = {}
+            for user_data in self._read_records(self.users_path()):
+                user = User(**user_data)
+                users[user.email] = user
+            records, offset = self._read_journal_from(self.users_journal_path(), 0)
+            self._users = users
+            self._users_snapshot_stat = snapshot_stat
+        elif journal_stat is not None and journal_stat[2] > self._users_journal_offset:
+            # 追記された分だけ読む
+            records, offset = self._read_journal_from(self.users_journal_path(), self._users_journal_offset)
+        else:
+            return
+        for user_data in records:
+            user = User(**user_data)
+            self._users[user.email] = user
+        self._users_journal_stat = journal_stat
+        self._users_journal_offset = offset
+
+    def load_users(self) -> List[User]:
+        with self._users_lock:
+            self._refresh_users()
+            return [replace(user) for user in self._users.values()]
+
+    def save_users(self, users: List[User]):
+        with self._users_lock, self._locked(""):
+            self._write_records(self.users_path(), "users", [asdict(user) for user in users])
+            journal_path = self.users_journal_path()
+            if os.path.exists(journal_path):
+                os.remove(journal_path)
+            self._users_snapshot_stat = None
+
+    def get_user(self, email: str) -> Optional[User]:
+        with self._users_lock:
+            self._refresh_users()
+            user = self._users.get(email)
+            return replace(user) if user is not None else None
+
+    def _put_user(self, user: User, new: bool = False):
+        # 1件分だけジャーナルに追記する。他の利用者の行は書き換えない
+        with self._users_lock, self._locked(""):
+            if new:
+                # 別のプロセスが先に登録していないか、ロックを取ってから確かめる
+                self._refresh_users()
+                if user.email in self._users:
+                    raise ConflictError("このメールアドレスは既に登録されています")
+            journal_path = self.users_journal_path()
+            self._append_journal(journal_path, "users", asdict(user))
+            self._refresh_users()
+            if os.path.getsize(journal_path) > JOURNAL_COMPACT_BYTES:
+                self.save_users(list(self._users.values()))
+
+    def add_user(self, user: User):
+        self._put_user(user, new=True)
+
+    def migrate_users(self) -> bool:
+        """旧形式のユーザーファイルを現在の形式に書き直す。書き直したら True"""
+        with self._users_lock, self._locked(""):
+            paths = [self.users_path(), self.users_journal_path()]
+            if self._is_current(paths):
+                return False
+            users = {}
+            for path in paths:
+                for user_data in migrate_records("users", self._file_version(path), self._read_records(path)):
+                    users[user_data["email"]] = User(**user_data)
+            self.save_users(list(users.values()))
+            return True
+
+    def update_user(self, user: User):
+        self._put_user(user)
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS diary_entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_email TEXT NOT NULL,
+    date TEXT NOT NULL,
+    title TEXT NOT NULL,
+    content TEXT NOT NULL,
+    mood TEXT NOT NULL,
+    mood_intensity INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    bot_response TEXT NOT NULL DEFAULT '',
+    entry_id TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_diary_entries_user_date ON diary_entries (user_email, date);
+CREATE INDEX IF NOT EXISTS idx_diary_entries_user_category ON diary_entries (user_email, category);
+CREATE TABLE IF NOT EXISTS goals (
+    id TEXT PRIMARY KEY,
+    user_email TEXT NOT NULL,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    category TEXT NOT NULL,
+    deadline TEXT NOT NULL,
+    created_date TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_goals_user ON goals (user_email);
+CREATE TABLE IF NOT EXISTS users (
+    email TEXT PRIMARY KEY,
+    password_hash TEXT NOT NULL,
+    nickname TEXT NOT NULL,
+    created_date TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS data_versions (
+    user_email TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    PRIMARY KEY (user_email, kind)
+);
+"""
+
+ENTRY_COLUMNS = "date, title, content, mood, mood_intensity, category, user_email, bot_response, entry_id"
+# 同じ利用者の同じ id は1行だけ。既にあれば中身を差し替える（ジャーナルの再生と同じ扱い）
+UPSERT_ENTRY_SQL = (f"INSERT INTO diary_entries ({ENTRY_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (user_email, entry_id) DO UPDATE SET date = excluded.date, title = excluded.title, "
+                    "content = excluded.content, mood = excluded.mood, mood_intensity = excluded.mood_intensity, "
+                    "category = excluded.category, bot_response = excluded.bot_response")
+UPDATABLE_ENTRY_COLUMNS = ("title", "content", "mood", "mood_intensity", "category", "bot_response")
+GOAL_COLUMNS = "id, title, description, category, deadline, created_date, user_email"
+USER_COLUMNS = "email, password_hash, nickname, created_date"
+# iter_entries() で1回に読む行数
+ITER_PAGE_ROWS = 500
+
+@trace_methods("storage")
+class SqliteBackend(StorageBackend):
+    """SQLite（WALモード）に保存する方式。接続はプロセスごとに1本だけ張って使い回す"""
+
+    def __init__(self, db_path: str = SQLITE_FILE):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._conn = None
+        self._pid = None
+
+    def connection(self) -> sqlite3.Connection:
+        # fork後の子プロセスでは親の接続を使わずに張り直す
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # スキーマの版数は user_version に持ち、現在の版なら何もしない
+            if conn.execute("PRAGMA user_version").fetchone()[0] < SQLITE_SCHEMA_VERSION:
+                self._migrate(conn)
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def _migrate(self, conn: sqlite3.Connection):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 別のプロセスが先に済ませていれば何もしない
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= SQLITE_SCHEMA_VERSION:
+                conn.execute("COMMIT")
+                return
+            for statement in SQLITE_SCHEMA.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+            # 古いスキーマで作られたDBには後から足した列を追加する
+            entry_columns = [row[1] for row in conn.execute("PRAGMA table_info(diary_entries)")]
+            if "entry_id" not in entry_columns:
+                conn.execute("ALTER TABLE diary_entries ADD COLUMN entry_id TEXT NOT NULL DEFAULT ''")
+            # id の無い記録には一度だけ固定の id を振っておき、読み込み時には補わない
+            rows = conn.execute("SELECT id, date, title, content FROM diary_entries WHERE entry_id = ''").fetchall()
+            conn.executemany("UPDATE diary_entries SET entry_id = ? WHERE id = ?",
+                             [(legacy_entry_id(date, title, content), row_id) for row_id, date, title, content in rows])
+            # (利用者, id) を一意にする。以前の版で重複して入った行は、load_entry が返していた最後の行だけ残す
+            conn.execute("DELETE FROM diary_entries WHERE id NOT IN (SELECT MAX(id) FROM diary_entries GROUP BY user_email, entry_id)")
+            conn.execute("DROP INDEX IF EXISTS idx_diary_entries_user_entry_id")
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_diary_entries_user_entry_unique ON diary_entries (user_email, entry_id)")
+            conn.execute(f"PRAGMA user_version = {SQLITE_SCHEMA_VERSION}")
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+
+    def sidecar_path(self, user_email: str, kind: str, ext: str = ".json") -> str:
+        return os.path.join(os.path.dirname(self.db_path), f"{kind}_{user_key(user_email)}{ext}" if user_email else f"{kind}{ext}")
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self.connection().execute(sql, params).fetchall()
+
+    def _write(self, statements: list, user_email: str = None, kind: str = None, expected_version: str = None):
+        """複数の文を1トランザクションで実行する。kind を渡すとその利用者の版数も進める。
+        expected_version を渡すと、書き込みロックを取った後の版数と比べて違えば ConflictError"""
+        with self._lock:
+            conn = self.connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if expected_version is not None:
+                    rows = conn.execute("SELECT version FROM data_versions WHERE user_email = ? AND kind = ?", (user_email, kind)).fetchall()
+                    if f"{kind}-{rows[0][0] if rows else 0}" != expected_version:
+                        raise ConflictError("他の画面や端末でデータが更新されています。読み込み直してからもう一度保存してください")
+                for sql, params in statements:
+                    if isinstance(params, list):
+                        conn.executemany(sql, params)
+                    else:
+                        conn.execute(sql, params)
+                if kind is not None:
+                    self._bump_version(conn, user_email, kind)
+                conn.execute("COMMIT")
+            except:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _bump_version(self, conn: sqlite3.Connection, user_email: str, kind: str):
+        conn.execute("INSERT INTO data_versions (user_email, kind, version) VALUES (?, ?, 1) "
+                     "ON CONFLICT (user_email, kind) DO UPDATE SET version = version + 1", (user_email, kind))
+
+    def _version(self, user_email: str, kind: str) -> str:
+        rows = self._query("SELECT version FROM data_versions WHERE user_email = ? AND kind = ?", (user_email, kind))
+        return f"{kind}-{rows[0][0] if rows else 0}"
+
+    def _entry_row(self, user_email: str, entry: DiaryEntry) -> tuple:
+        return (entry.date, entry.title, entry.content, entry.mood, entry.mood_intensity, entry.category, user_email, entry.bot_response,
+                entry.id or legacy_entry_id(entry.date, entry.title, entry.content))
+
+    def _entry_from_row(self, row: tuple) -> DiaryEntry:
+        return DiaryEntry(*row)
+
+    def _goal_row(self, user_email: str, goal: Goal) -> tuple:
+        return (goal.id, goal.title, goal.description, goal.category, goal.deadline, goal.created_date, user_email)
+
+    def load_entries(self, user_email: str) -> List[DiaryEntry]:
+        rows = self._query(f"SELECT {ENTRY_COLUMNS} FROM diary_entries WHERE user_email = ? ORDER BY id", (user_email,))
+        return [self._entry_from_row(row) for row in rows]
+
+    def save_entries(self, user_email: str, entries: List[DiaryEntry], expected_version: str = None):
+        self._write([
+            ("DELETE FROM diary_entries WHERE user_email = ?", (user_email,)),
+            (UPSERT_ENTRY_SQL, [self._entry_row(user_email, entry) for entry in entries]),
+        ], user_email, "entries", expected_version)
+
+    def add_entry(self, user_email: str, entry: DiaryEntry):
+        self._write([(UPSERT_ENTRY_SQL, self._entry_row(user_email, entry))], user_email, "entries")
+
+    def add_entries(self, user_email: str, entries: List[DiaryEntry]) -> List[DiaryEntry]:
+        # 既にある id は一意索引で弾き、実際に入った行だけを返す。確かめるのと書くのが同じトランザクションなので、
+        # 別のプロセスが同じ一括保存を同時に送ってきても二重にならない
+        with self._lock:
+            conn = self.connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                added = [entry for entry in entries
+                         if conn.execute(f"INSERT OR IGNORE INTO diary_entries ({ENTRY_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                         self._entry_row(user_email, entry)).rowcount == 1]
+                if added:
+                    self._bump_version(conn, user_email, "entries")
+                conn.execute("COMMIT")
+            except:
+                conn.execute("ROLLBACK")
+                raise
+            return added
+
+    def update_entry(self, user_email: str, entry_id: str, changes: dict):
+        columns = [name for name in changes if name in UPDATABLE_ENTRY_COLUMNS]
+        if not columns:
+            return
+        assignments = ", ".join(f"{name} = ?" for name in columns)
+        params = tuple(changes[name] for name in columns) + (user_email, entry_id)
+        self._write([(f"UPDATE diary_entries SET {assignments} WHERE user_email = ? AND entry_id = ?", params)], user_email, "entries")
+
+    def entries_version(self, user_email: str) -> str:
+        return self._version(user_email, "entries")
+
+    def iter_entries(self, user_email: str) -> Iterator[DiaryEntry]:
+        # 長く読み続けても書き込みを止めないよう、ロックは1ページ読むあいだだけ取る
+        last_id = 0
+        while True:
+            rows = self._query(f"SELECT id, {ENTRY_COLUMNS} FROM diary_entries WHERE user_email = ? AND id > ? ORDER BY id LIMIT ?",
+                               (user_email, last_id, ITER_PAGE_ROWS))
+            for row in rows:
+                yield self._entry_from_row(row[1:])
+            if len(rows) < ITER_PAGE_ROWS:
+                return
+            last_id = rows[-1][0]
+
+    def load_entry_summaries(self, user_email: str) -> List[EntrySummary]:
+        rows = self._query("SELECT entry_id, date, title, mood, mood_intensity, category FROM diary_entries WHERE user_email = ? ORDER BY id", (user_email,))
+        return [EntrySummary(*row) for row in rows]
+
+    def load_entry(self, user_email: str, summary: EntrySummary) -> Optional[DiaryEntry]:
+        rows = self._query(f"SELECT {ENTRY_COLUMNS} FROM diary_entries WHERE user_email = ? AND entry_id = ? ORDER BY id DESC LIMIT 1", (user_email, summary.id))
+        return self._entry_from_row(rows[0]) if rows else None
+
+    def load_entries_for(self, user_email: str, summaries: List[EntrySummary]) -> List[Optional[DiaryEntry]]:
+        entries = {}
+        ids = [summary.id for summary in summaries]
+        # SQLite のプレースホルダ数の上限を超えないよう分けて引く
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            sql = f"SELECT {ENTRY_COLUMNS} FROM diary_entries WHERE user_email = ? AND entry_id IN ({', '.join('?' * len(chunk))})"
+            for row in self._query(sql, (user_email, *chunk)):
+                entry = self._entry_from_row(row)
+                entries[entry.id] = entry
+        return [entries.get(entry_id) for entry_id in ids]
+
+    def load_goals(self, user_email: str) -> List[Goal]:
+        rows = self._query(f"SELECT {GOAL_COLUMNS} FROM goals WHERE user_email = ? ORDER BY rowid", (user_email,))
+        return [Goal(*row) for row in rows]
+
+    def goals_version(self, user_email: str) -> str:
+        return self._version(user_email, "goals")
+
+    def save_goals(self, user_email: str, goals: List[Goal], expected_version: str = None):
+        self._write([
+            ("DELETE FROM goals WHERE user_email = ?", (user_email,)),
+            (f"INSERT OR REPLACE INTO goals ({GOAL_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)", [self._goal_row(user_email, goal) for goal in goals]),
+        ], user_email, "goals", expected_version)
+
+    def add_goal(self, user_email: str, goal: Goal):
+        self._write([(f"INSERT OR REPLACE INTO goals ({GOAL_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)", self._goal_row(user_email, goal))], user_email, "goals")
+
+    def delete_goal(self, user_email: str, goal_id: str):
+        self._write([("DELETE FROM goals WHERE id = ? AND user_email = ?", (goal_id, user_email))], user_email, "goals")
+
+    def add_goals(self, user_email: str, goals: List[Goal]) -> List[Goal]:
+        # add_entries と同じく、既にある id は弾いて実際に入った行だけを返す
+        with self._lock:
+            conn = self.connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                added = [goal for goal in goals
+                         if conn.execute(f"INSERT OR IGNORE INTO goals ({GOAL_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                         self._goal_row(user_email, goal)).rowcount == 1]
+                if added:
+                    self._bump_version(conn, user_email, "goals")
+                conn.execute("COMMIT")
+            except:
+                conn.execute("ROLLBACK")
+                raise
+            return added
+
+    def load_users(self) -> List[User]:
+        return [User(*row) for row in self._query(f"SELECT {USER_COLUMNS} FROM users ORDER BY rowid")]
+
+    def save_users(self, users: List[User]):
+        self._write([
+            ("DELETE FROM users", ()),
+            (f"INSERT OR REPLACE INTO users ({USER_COLUMNS}) VALUES (?, ?, ?, ?)", [(user.email, user.password_hash, user.nickname, user.created_date) for user in users]),
+        ])
+
+    def get_user(self, email: str) -> Optional[User]:
+        rows = self._query(f"SELECT {USER_COLUMNS} FROM users WHERE email = ?", (email,))
+        return User(*rows[0]) if rows else None
+
+    def add_user(self, user: User):
+        try:
+            self._write([(f"INSERT INTO users ({USER_COLUMNS}) VALUES (?, ?, ?, ?)", (user.email, user.password_hash, user.nickname, user.created_date))])
+        except sqlite3.IntegrityError:
+            raise ConflictError("このメールアドレスは既に登録されています")
+
+    def update_user(self, user: User):
+        self._write([("UPDATE users SET password_hash = ?, nickname = ?, created_date = ? WHERE email = ?", (user.password_hash, user.nickname, user.created_date, user.email))])
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend() -> StorageBackend:
+    """環境変数 DIARY_STORAGE_BACKEND（json / sqlite）に応じたプロセス共通のバックエンドを返す。
+    json のときは DIARY_GROUP_COMMIT_MS（既定 0 = 無効）でグループコミットの待ち時間を指定できる"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if os.environ.get("DIARY_STORAGE_BACKEND", "json") == "sqlite":
+                    _backend = SqliteBackend(os.environ.get("DIARY_SQLITE_PATH", SQLITE_FILE))
+                else:
+                    _backend = JsonBackend(group_commit_ms=float(os.environ.get("DIARY_GROUP_COMMIT_MS", "0")))
+    return _backend
+
+def set_backend(backend: StorageBackend):
+    global _backend
+    _backend = backend
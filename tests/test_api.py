@@ -0,0 +1,85 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+# 外部のモデルを呼ばないよう、api1 を読み込む前に決めておく
+os.environ.setdefault("DIARY_BOT_MODEL", "local")
+from fastapi.testclient import TestClient
+from data_cache import parsed_data_cache
+from data_manager import DiaryManager
+from data_models import DiaryEntry
+from storage import JsonBackend, set_backend
+import api1
+
+USER = "user@example.com"
+
+def entry_payload(**changes) -> dict:
+    return dict({"title": "t", "content": "本文", "mood": "怒り", "mood_intensity": 0, "category": "その他", "user_email": USER}, **changes)
+
+class ApiTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        parsed_data_cache.clear()
+        set_backend(JsonBackend(self.data_dir))
+        self.addCleanup(set_backend, None)
+        self.client = TestClient(api1.app)
+
+    def tearDown(self):
+        # バックグラウンドの応答の書き込みを、データを消す前に終わらせる
+        for entry_id in list(api1.job_queue.jobs):
+            api1.job_queue.wait(entry_id, 5)
+
+class EntryValidationTest(ApiTestCase):
+    """保存・一括保存・取り込みで同じ記録を同じように扱う"""
+
+    def check(self, payload: dict, accepted: bool):
+        self.assertEqual(self.client.post("/save_diary/", json=payload).status_code, 200 if accepted else 400)
+        result = self.client.post("/save_diary/batch", json={"entries": [payload]}).json()["results"][0]
+        self.assertEqual(result["status"], "created" if accepted else "invalid")
+        record = dict(payload, kind="entry", date="2024-01-01 10:00:00")
+        imported = self.client.post(f"/import/{USER}", content=json.dumps(record).encode()).json()
+        self.assertEqual(imported["entries"], 1 if accepted else 0)
+
+    def test_zero_intensity_is_accepted(self):
+        self.check(entry_payload(), True)
+
+    def test_intensity_not_matching_mood_is_accepted(self):
+        self.check(entry_payload(mood="喜び", mood_intensity=3), True)
+
+    def test_out_of_range_intensity_is_rejected(self):
+        self.check(entry_payload(mood_intensity=9), False)
+
+class DiaryHistoryTest(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        DiaryManager(USER).add_entries([DiaryEntry("2024-01-01 10:00:00", f"t{i}", "本文", "穏やか", 3, "その他", id=f"e{i}")
+                                        for i in range(3)])
+        self.url = f"/get_diary_history/{USER}"
+
+    def test_unchanged_history_returns_304(self):
+        first = self.client.get(self.url, params={"limit": 2})
+        etag = first.headers["ETag"]
+        second = self.client.get(self.url, params={"limit": 2}, headers={"If-None-Match": etag})
+        self.assertEqual((second.status_code, second.content), (304, b""))
+        # ページが違えば別の ETag になる
+        other_page = self.client.get(self.url, params={"limit": 2, "cursor": first.json()["next_cursor"]}, headers={"If-None-Match": etag})
+        self.assertEqual(other_page.status_code, 200)
+        DiaryManager(USER).add_entry(DiaryEntry("2024-01-02 10:00:00", "t3", "本文", "穏やか", 3, "その他", id="e3"))
+        changed = self.client.get(self.url, params={"limit": 2}, headers={"If-None-Match": etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers["ETag"], etag)
+
+    def test_fields_projection(self):
+        body = self.client.get(self.url, params={"fields": "id,title"}).json()
+        self.assertEqual(body["entries"], [{"id": f"e{i}", "title": f"t{i}"} for i in range(3)])
+        # 見出しにない項目を求められたら本文つきで読む
+        body = self.client.get(self.url, params={"fields": "content", "limit": 1}).json()
+        self.assertEqual(body["entries"], [{"content": "本文"}])
+        self.assertEqual(self.client.get(self.url, params={"fields": "id,password"}).status_code, 400)
+
+if __name__ == "__main__":
+    unittest.main()
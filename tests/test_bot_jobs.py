@@ -0,0 +1,59 @@
+import shutil
+import tempfile
+import threading
+import unittest
+from bot_jobs import BotJobQueue
+from data_cache import parsed_data_cache
+from data_manager import DiaryManager
+from data_models import DiaryEntry
+from storage import JsonBackend
+
+USER = "user@example.com"
+
+class StubBot:
+    """release が立つまで応答を返さないボット"""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def get_counseling_response(self, content, mood, mood_intensity, category):
+        return "ルールベースの応答"
+
+    def stream_response(self, content, mood, mood_intensity, category, timeout=None):
+        self.release.wait(5)
+        yield "生成した応答"
+
+class BotJobQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        parsed_data_cache.clear()
+        self.backend = JsonBackend(self.data_dir)
+        self.manager = DiaryManager(USER, self.backend)
+        self.entry = DiaryEntry("2024-01-01 10:00:00", "t", "本文", "穏やか", 3, "その他", id="e0")
+        self.manager.add_entry(self.entry)
+        self.bot = StubBot()
+
+    def test_failed_fallback_write_is_recorded_in_job(self):
+        def broken_update(user_email, entry_id, changes):
+            raise OSError("disk full")
+        self.backend.update_entry = broken_update
+        # 待ち行列がいっぱいのときはその場で書き込むが、失敗しても呼び出し側には例外を返さない
+        job = BotJobQueue(self.bot, max_workers=1, max_pending=0).submit(self.manager, self.entry)
+        self.assertEqual(job["status"], "failed")
+        self.assertIn("disk full", job["error"])
+
+    def test_other_worker_sees_pending_job(self):
+        worker = BotJobQueue(self.bot, max_workers=1)
+        self.addCleanup(worker.executor.shutdown, wait=True)
+        other = BotJobQueue(self.bot, max_workers=1)
+        worker.submit(self.manager, self.entry)
+        self.assertIsNone(other.status("e0"))
+        self.assertTrue(other.leased_elsewhere(self.manager, "e0"))
+        self.bot.release.set()
+        self.assertEqual(worker.wait("e0", 5)["status"], "done")
+        self.assertFalse(other.leased_elsewhere(self.manager, "e0"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import shutil
+import tempfile
+import unittest
+from data_cache import parsed_data_cache
+from data_manager import DiaryManager, GoalManager
+from data_models import Goal
+from storage import JsonBackend
+import journal_io
+
+USER = "user@example.com"
+
+def goal_record(title: str) -> dict:
+    return {"kind": "goal", "title": title, "description": "", "category": "week", "deadline": "2030-12-31",
+            "created_date": "2024-01-01 00:00:00"}
+
+class ImportGoalsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        parsed_data_cache.clear()
+        self.backend = JsonBackend(self.data_dir)
+        self.goal_manager = GoalManager(USER, self.backend)
+        self.goal_manager.add_goal(Goal("existing", "既存の目標", "", "week", "2030-12-31", "2024-01-01 00:00:00"))
+
+    def test_goals_changed_during_import_are_kept(self):
+        def records():
+            yield 1, goal_record("一つ目")
+            # 取り込みの途中で、画面から目標を消して別の目標を足す
+            self.goal_manager.delete_goal("existing")
+            self.goal_manager.add_goal(Goal("added", "途中で足した目標", "", "week", "2030-12-31", "2024-01-02 00:00:00"))
+            yield 2, goal_record("二つ目")
+
+        result = journal_io.import_records(DiaryManager(USER, self.backend), self.goal_manager, records(), chunk_size=1)
+        self.assertEqual(result["goals"], 2)
+        self.assertEqual([goal.title for goal in self.goal_manager.load_goals()], ["一つ目", "途中で足した目標", "二つ目"])
+
+    def test_reimport_skips_goals_without_id(self):
+        lines = [goal_record("目標")]
+        journal_io.import_records(DiaryManager(USER, self.backend), self.goal_manager, enumerate(lines, 1))
+        result = journal_io.import_records(DiaryManager(USER, self.backend), self.goal_manager, enumerate(lines, 1))
+        self.assertEqual((result["goals"], result["skipped"]), (0, 1))
+        self.assertEqual(len(self.goal_manager.load_goals()), 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,26 @@
+import unittest
+from bot_counselor import detect_themes
+from keyword_automaton import KeywordAutomaton
+
+class KeywordAutomatonTest(unittest.TestCase):
+
+    def test_overlapping_keywords_are_all_found(self):
+        matcher = KeywordAutomaton({"he": "a", "she": "b", "his": "c", "hers": "d"})
+        self.assertEqual(sorted(matcher.iter_matches("ushers")), [(4, "he", "a"), (4, "she", "b"), (6, "hers", "d")])
+
+    def test_keyword_inside_longer_keyword_is_counted(self):
+        # 「サービス残業」の中の「残業」も、失敗リンクをたどって見つける
+        matcher = KeywordAutomaton({"残業": "残業", "サービス残業": "残業", "業務": "仕事"})
+        self.assertEqual(sorted(matcher.iter_matches("サービス残業務")), [(6, "サービス残業", "残業"), (6, "残業", "残業"), (7, "業務", "仕事")])
+        self.assertEqual(matcher.count_labels("サービス残業と残業"), {"残業": 3})
+
+    def test_width_and_case_are_normalized(self):
+        matcher = KeywordAutomaton({"テスト": "試験", "pc": "機器"})
+        self.assertEqual(matcher.count_labels("ﾃｽﾄ前にＰＣが壊れた"), {"試験": 1, "機器": 1})
+
+    def test_detect_themes_orders_by_count(self):
+        self.assertEqual(detect_themes("上司に言われて残業、終電で帰って寝不足"), ["残業", "睡眠"])
+        self.assertEqual(detect_themes("今日は晴れ"), [])
+
+if __name__ == "__main__":
+    unittest.main()
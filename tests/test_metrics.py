@@ -0,0 +1,128 @@
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from data_cache import parsed_data_cache
+from storage import JsonBackend, set_backend
+import metrics
+
+SAMPLE_LINE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{(?:[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*",?)*\})? (-?[0-9.e+-]+|\+Inf|NaN)$')
+LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+def parse_exposition(text: str) -> dict:
+    """名前 -> {"type": 種類, "samples": [(サンプル名, ラベル, 値)]}。形式の誤りは AssertionError"""
+    families = {}
+    current = None
+    for line in text.splitlines():
+        if line.startswith("# HELP "):
+            continue
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ", 3)
+            assert name not in families, f"TYPE が重複しています: {name}"
+            current = families[name] = {"type": kind, "samples": []}
+            continue
+        match = SAMPLE_LINE.match(line)
+        assert match, f"読めない行です: {line!r}"
+        assert current is not None, f"TYPE より前にサンプルがあります: {line!r}"
+        labels = dict(LABEL.findall(match.group(2) or ""))
+        current["samples"].append((match.group(1), labels, float(match.group(3))))
+    return families
+
+def check_histograms(families: dict):
+    """ヒストグラムのバケットが累積になっていて、+Inf が件数と合うか"""
+    for name, family in families.items():
+        if family["type"] != "histogram":
+            continue
+        series = {}
+        for sample_name, labels, value in family["samples"]:
+            key = tuple(sorted((k, v) for k, v in labels.items() if k != "le"))
+            series.setdefault(key, {"buckets": [], "count": None})
+            if sample_name == name + "_bucket":
+                series[key]["buckets"].append((labels["le"], value))
+            elif sample_name == name + "_count":
+                series[key]["count"] = value
+        for key, data in series.items():
+            counts = [value for _, value in data["buckets"]]
+            assert counts == sorted(counts), f"{name}{key} のバケットが累積になっていません"
+            assert data["buckets"][-1][0] == "+Inf" and counts[-1] == data["count"], f"{name}{key} の件数が合いません"
+
+def request_count(families: dict) -> float:
+    # /metrics 自体の取得は数えない
+    return sum(value for _, labels, value in families["diary_http_requests_total"]["samples"] if labels["route"] != "/metrics")
+
+def check_concurrent_records(threads: int, increments: int) -> float:
+    """同じカウンターとヒストグラムに全スレッドから記録し、取りこぼしがないか確かめる。かかった秒数を返す"""
+    counter = metrics.Counter("test_increments_total", "テスト用")
+    histogram = metrics.Histogram("test_latency_seconds", "テスト用", ("worker",))
+    start = threading.Barrier(threads)
+
+    def worker(worker_id: int):
+        start.wait()
+        for i in range(increments):
+            counter.inc()
+            histogram.observe(i * 1e-4, str(worker_id % 2))
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    try:
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        total = counter.merged()[()][0]
+        observed = sum(sum(values[:-1]) for values in histogram.merged().values())
+    finally:
+        metrics.REGISTRY.remove(counter)
+        metrics.REGISTRY.remove(histogram)
+    assert total == threads * increments and observed == threads * increments, "記録の取りこぼしがあります"
+    return elapsed
+
+class MetricsTest(unittest.TestCase):
+
+    def test_no_lost_records_across_threads(self):
+        check_concurrent_records(4, 2000)
+
+    def test_label_values_are_escaped(self):
+        counter = metrics.Counter("test_escaped_total", "テスト用", ("path",))
+        self.addCleanup(metrics.REGISTRY.remove, counter)
+        counter.inc('a"b\\c\nd')
+        families = parse_exposition(metrics.render())
+        self.assertEqual(families["test_escaped_total"]["samples"][0][1]["path"], 'a\\"b\\\\c\\nd')
+
+class ScrapeTest(unittest.TestCase):
+
+    def setUp(self):
+        data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_dir)
+        parsed_data_cache.clear()
+        set_backend(JsonBackend(data_dir))
+        self.addCleanup(set_backend, None)
+
+    def test_exposition_after_concurrent_requests(self):
+        os.environ.setdefault("DIARY_BOT_MODEL", "local")
+        from fastapi.testclient import TestClient
+        import api1
+        client = TestClient(api1.app)
+        before = request_count(parse_exposition(client.get("/metrics").text))
+
+        def worker(worker_id: int):
+            for i in range(10):
+                client.get(f"/get_diary_history/user{worker_id}@example.com", params={"limit": 10})
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        response = client.get("/metrics")
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+        families = parse_exposition(response.text)
+        check_histograms(families)
+        self.assertEqual(request_count(families) - before, 40)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import shutil
+import tempfile
+import unittest
+from data_cache import parsed_data_cache
+from data_manager import DiaryManager
+from data_models import DiaryEntry
+from storage import JsonBackend
+import mood_rollups
+
+USER = "user@example.com"
+
+def diary_entry(i: int) -> DiaryEntry:
+    return DiaryEntry("2024-01-01 10:00:00", f"t{i}", "本文", "穏やか", 3, "その他", id=f"e{i}")
+
+class MoodRollupsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        parsed_data_cache.clear()
+        mood_rollups.clear_rollups()
+        self.addCleanup(mood_rollups.clear_rollups)
+        self.backend = JsonBackend(self.data_dir)
+        self.manager = DiaryManager(USER, self.backend)
+        self.manager.add_entries([diary_entry(i) for i in range(3)])
+        self.manager.load_rollups()
+
+    def test_edit_in_the_middle_is_noticed_by_version(self):
+        # 件数も最後の記録も変わらない書き換えを、集計を通さずに行う
+        entries = self.backend.load_entries(USER)
+        entries[1].mood, entries[1].mood_intensity = "怒り", 0
+        self.backend.save_entries(USER, entries)
+        self.assertEqual(self.manager.load_rollups().total["mood_sum"], 6)
+
+    def test_log_folded_into_snapshot_is_not_applied_twice(self):
+        self.manager.add_entry(diary_entry(3))
+        rollups = mood_rollups.get_rollups(self.manager.rollups_file)
+        with open(rollups.log_path, 'r', encoding='utf-8') as f:
+            log = f.read()
+        # 畳み込んだ後、差分ログを消す前に落ちた状態
+        rollups.save()
+        with open(rollups.log_path, 'w', encoding='utf-8') as f:
+            f.write(log)
+        mood_rollups.clear_rollups()
+        rollups = mood_rollups.get_rollups(self.manager.rollups_file)
+        self.assertEqual(rollups.total["count"], 4)
+        self.assertEqual(rollups.version, self.backend.entries_version(USER))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import json
+import shutil
+import tempfile
+import unittest
+from data_cache import parsed_data_cache
+from storage import JsonBackend, SCHEMA_VERSION, legacy_entry_id, schema_header
+import migrate_schema
+
+USER = "user@example.com"
+
+# id と mood_intensity が入る前の記録（見出し行のない JSON の配列）
+LEGACY_ENTRIES = [
+    {"date": "2023-01-01 10:00:00", "title": "古い記録", "content": "本文", "mood": "穏やか", "category": "その他", "user_email": USER},
+    {"date": "2023-01-02 10:00:00", "title": "二件目", "content": "本文2", "mood": "喜び", "category": "その他", "user_email": USER},
+]
+LEGACY_GOALS = [
+    {"id": "g0", "title": "目標", "description": "", "category": "week", "deadline": "2030-12-31",
+     "created_date": "2023-01-01 00:00:00", "user_email": USER, "progress": 50},
+]
+
+class LegacyFileMigrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        parsed_data_cache.clear()
+        self.backend = JsonBackend(self.data_dir)
+        with open(self.backend.entries_path(USER), 'w', encoding='utf-8') as f:
+            json.dump(LEGACY_ENTRIES, f, ensure_ascii=False, indent=2)
+        with open(self.backend.goals_path(USER), 'w', encoding='utf-8') as f:
+            json.dump(LEGACY_GOALS, f, ensure_ascii=False, indent=2)
+
+    def test_first_load_migrates_once(self):
+        entries = self.backend.load_entries(USER)
+        self.assertEqual([entry.mood_intensity for entry in entries], [3, 3])
+        self.assertEqual(entries[0].id, legacy_entry_id("2023-01-01 10:00:00", "古い記録", "本文"))
+        with open(self.backend.entries_path(USER), 'rb') as f:
+            self.assertEqual(f.readline(), schema_header("entries"))
+        # 書き直した後は、キャッシュを捨てて読み直してもファイルに触らない
+        version = self.backend.entries_version(USER)
+        parsed_data_cache.clear()
+        self.assertEqual(JsonBackend(self.data_dir).load_entries(USER), entries)
+        self.assertEqual(self.backend.entries_version(USER), version)
+
+    def test_summaries_and_appends_on_legacy_file(self):
+        # 見出しの一覧から読み始めても移行され、ジャーナルへの追記はその後に重なる
+        summaries = self.backend.load_entry_summaries(USER)
+        self.assertEqual([summary.title for summary in summaries], ["古い記録", "二件目"])
+        self.backend.update_entry(USER, summaries[1].id, {"bot_response": "応答"})
+        self.assertEqual(self.backend.load_entry(USER, self.backend.load_entry_summaries(USER)[1]).bot_response, "応答")
+
+    def test_bulk_migration_script(self):
+        self.assertEqual(migrate_schema.migrate(self.data_dir), 1)
+        self.assertEqual(migrate_schema.migrate(self.data_dir), 0)
+        with open(self.backend.goals_path(USER), 'rb') as f:
+            self.assertEqual(json.loads(f.readline())["version"], SCHEMA_VERSION)
+            self.assertNotIn("progress", json.loads(f.readline()))
+        self.assertEqual([goal.id for goal in self.backend.load_goals(USER)], ["g0"])
+
+if __name__ == "__main__":
+    unittest.main()
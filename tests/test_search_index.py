@@ -0,0 +1,64 @@
+import shutil
+import tempfile
+import unittest
+from data_cache import parsed_data_cache
+from data_manager import DiaryManager
+from data_models import DiaryEntry
+from storage import JsonBackend
+import search_index
+
+USER = "user@example.com"
+
+def diary_entry(i: int, content: str) -> DiaryEntry:
+    return DiaryEntry("2024-01-01 10:00:00", f"t{i}", content, "穏やか", 3, "その他", id=f"e{i}")
+
+class SearchIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        parsed_data_cache.clear()
+        search_index.clear_indexes()
+        self.addCleanup(search_index.clear_indexes)
+        self.backend = JsonBackend(self.data_dir)
+        self.manager = DiaryManager(USER, self.backend)
+        self.manager.add_entries([diary_entry(0, "朝の散歩"), diary_entry(1, "昼の会議"), diary_entry(2, "夜の読書")])
+        self.assertEqual([e.id for e in self.manager.search_entries("会議")], ["e1"])
+
+    def test_edit_in_the_middle_is_noticed_by_version(self):
+        # 件数も最後の記録も変わらない書き換えを、索引を通さずに行う
+        entries = self.backend.load_entries(USER)
+        entries[1].content = "昼の料理"
+        self.backend.save_entries(USER, entries)
+        self.assertEqual([e.id for e in self.manager.search_entries("料理")], ["e1"])
+        self.assertEqual(self.manager.search_entries("会議"), [])
+
+    def test_search_reads_only_candidate_bodies(self):
+        def load_all(user_email):
+            raise AssertionError("全件を読みました")
+        self.backend.load_entries = load_all
+        loaded = []
+        load_entries_for = self.backend.load_entries_for
+        def load_bodies(user_email, summaries):
+            loaded.extend(summary.id for summary in summaries)
+            return load_entries_for(user_email, summaries)
+        self.backend.load_entries_for = load_bodies
+        # 別の利用者画面から追加された記録（索引はメモリにない）
+        search_index.clear_indexes()
+        DiaryManager(USER, self.backend).add_entry(diary_entry(3, "夕方の会議"))
+        self.assertEqual([e.id for e in self.manager.search_entries("会議")], ["e3", "e1"])
+        # 索引に足りない1件と、候補の2件だけを読む
+        self.assertEqual(loaded, ["e3", "e3", "e1"])
+
+    def test_bot_response_keeps_index_version(self):
+        entry = self.backend.load_entries(USER)[0]
+        self.manager.update_bot_response(entry, "応答")
+        index = search_index.get_index(self.manager.search_index_file, load=False)
+        self.assertEqual(index.version, self.backend.entries_version(USER))
+        # ディスクから読み直しても、版は追記ログから戻る
+        search_index.clear_indexes()
+        index = search_index.get_index(self.manager.search_index_file)
+        self.assertEqual(index.version, self.backend.entries_version(USER))
+
+if __name__ == "__main__":
+    unittest.main()
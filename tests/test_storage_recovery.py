@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+from data_cache import parsed_data_cache
+from data_models import DiaryEntry
+from storage import JsonBackend, SqliteBackend
+
+USER = "user@example.com"
+
+class CachedLoadTest(unittest.TestCase):
+    """キャッシュから返した記録を書き換えても、他の呼び出し元には見えない"""
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        parsed_data_cache.clear()
+        self.backend = JsonBackend(self.data_dir)
+        self.backend.add_entry(USER, DiaryEntry("2024-01-01 10:00:00", "t0", "本文", "穏やか", 3, "その他", id="e0"))
+
+    def test_mutating_loaded_entry_does_not_touch_cache(self):
+        for load in (self.backend.load_entries, self.backend.load_entry_summaries):
+            first = load(USER)
+            first[0].title = "書き換え"
+            self.assertEqual(load(USER)[0].title, "t0")
+            self.assertEqual(load(USER)[0].title, "t0")
+
+class JournalReplayTest(unittest.TestCase):
+    """スナップショットを書いた後、ジャーナルを消す前に落ちた場合"""
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        parsed_data_cache.clear()
+        self.backend = JsonBackend(self.data_dir)
+
+    def crash_after_snapshot(self):
+        # 畳み込み前のジャーナルを取っておき、畳み込み後に戻す（os.remove の直前で落ちたのと同じ状態）
+        journal_path = self.backend.journal_path(USER)
+        with open(journal_path, 'rb') as f:
+            journal = f.read()
+        self.backend.compact_entries(USER)
+        with open(journal_path, 'wb') as f:
+            f.write(journal)
+        parsed_data_cache.clear()
+
+    def test_folded_journal_is_not_replayed_twice(self):
+        for i in range(3):
+            self.backend.add_entry(USER, DiaryEntry("2024-01-01 10:00:00", f"t{i}", "本文", "穏やか", 3, "その他", id=f"e{i}"))
+        self.backend.update_entry(USER, "e1", {"bot_response": "応答"})
+        self.crash_after_snapshot()
+        backend = JsonBackend(self.data_dir)
+        entries = backend.load_entries(USER)
+        self.assertEqual([entry.title for entry in entries], ["t0", "t1", "t2"])
+        self.assertEqual(entries[1].bot_response, "応答")
+        summaries = backend.load_entry_summaries(USER)
+        self.assertEqual([summary.id for summary in summaries], ["e0", "e1", "e2"])
+        self.assertEqual(backend.load_entry(USER, summaries[1]).bot_response, "応答")
+        self.assertEqual([entry.title for entry in backend.iter_entries(USER)], ["t0", "t1", "t2"])
+
+class SqliteEntryIdTest(unittest.TestCase):
+    """SQLite でも同じ利用者の同じ id は1行だけ"""
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        self.backend = SqliteBackend(os.path.join(self.data_dir, "diary.sqlite3"))
+
+    def test_add_entries_returns_only_inserted(self):
+        entries = [DiaryEntry("2024-01-01 10:00:00", f"t{i}", "本文", "穏やか", 3, "その他", id=f"e{i}") for i in range(3)]
+        self.assertEqual(len(self.backend.add_entries(USER, entries[:2])), 2)
+        self.assertEqual([entry.id for entry in self.backend.add_entries(USER, entries + entries)], ["e2"])
+        self.assertEqual(len(self.backend.load_entries(USER)), 3)
+
+    def test_add_entry_replaces_same_id(self):
+        self.backend.add_entry(USER, DiaryEntry("2024-01-01 10:00:00", "前", "本文", "穏やか", 3, "その他", id="e0"))
+        self.backend.add_entry(USER, DiaryEntry("2024-01-01 10:00:00", "後", "本文", "穏やか", 3, "その他", id="e0"))
+        self.assertEqual([entry.title for entry in self.backend.load_entries(USER)], ["後"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from data_cache import parsed_data_cache
+from data_manager import DiaryManager, GoalManager, sync_changes
+from data_models import DiaryEntry, Goal
+from storage import JsonBackend
+import change_log
+
+USER = "user@example.com"
+
+def diary_entry(i: int) -> DiaryEntry:
+    return DiaryEntry("2024-01-01 10:00:00", f"t{i}", "本文", "穏やか", 3, "その他", id=f"e{i}")
+
+class SyncChangesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        parsed_data_cache.clear()
+        backend = JsonBackend(self.data_dir)
+        self.diary_manager = DiaryManager(USER, backend)
+        self.goal_manager = GoalManager(USER, backend)
+        self.diary_manager.add_entry(diary_entry(0))
+
+    def sync(self, token: str = "", limit: int = 0) -> dict:
+        return sync_changes(self.diary_manager, self.goal_manager, token, limit)
+
+    def test_empty_or_broken_token_returns_everything(self):
+        for token in ("", "壊れたトークン"):
+            result = self.sync(token)
+            self.assertTrue(result["reset"])
+            self.assertEqual([entry["id"] for entry in result["entries"]["upserted"]], ["e0"])
+
+    def test_delta_returns_only_changes_since_token(self):
+        token = self.sync()["sync_token"]
+        self.diary_manager.add_entry(diary_entry(1))
+        self.goal_manager.add_goal(Goal("g0", "目標", "", "week", "2030-12-31", "2024-01-01 00:00:00"))
+        self.goal_manager.delete_goal("g0")
+        result = self.sync(token)
+        self.assertFalse(result["reset"])
+        self.assertEqual([entry["id"] for entry in result["entries"]["upserted"]], ["e1"])
+        # 足してから消した目標は、最後の状態（削除）だけを返す
+        self.assertEqual(result["goals"], {"upserted": [], "deleted": ["g0"]})
+        self.assertEqual(self.sync(result["sync_token"])["entries"], {"upserted": [], "deleted": []})
+
+    def test_limit_pages_through_changes(self):
+        token = self.sync()["sync_token"]
+        self.diary_manager.add_entries([diary_entry(i) for i in range(1, 4)])
+        first = self.sync(token, limit=2)
+        self.assertTrue(first["has_more"])
+        second = self.sync(first["sync_token"], limit=2)
+        self.assertFalse(second["has_more"])
+        self.assertEqual([entry["id"] for entry in first["entries"]["upserted"] + second["entries"]["upserted"]], ["e1", "e2", "e3"])
+
+    def test_rotated_generation_forces_reset(self):
+        token = self.sync()["sync_token"]
+        with mock.patch.object(change_log, "CHANGE_LOG_MAX_BYTES", 0):
+            self.diary_manager.add_entry(diary_entry(1))
+        result = self.sync(token)
+        self.assertTrue(result["reset"])
+        self.assertEqual([entry["id"] for entry in result["entries"]["upserted"]], ["e0", "e1"])
+        # 新しい世代のトークンからは差分で続けられる
+        self.diary_manager.add_entry(diary_entry(2))
+        self.assertFalse(self.sync(result["sync_token"])["reset"])
+
+if __name__ == "__main__":
+    unittest.main()
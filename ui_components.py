@@ -1,6 +1,22 @@
 import streamlit as st
 from data_models import THEME_PALETTES, MOOD_OPTIONS
 from data_manager import GoalManager
+from errors import DiaryError
+from instrumentation import Trace, traced
+
+def show_error(error: DiaryError):
+    # 保存処理の失敗を画面に表示する（各 Manager の on_error に渡す）
+    st.error(str(error))
+
+def debug_panel(trace: Trace):
+    """サイドバーに今回の再実行の内訳を出す（?debug=1 / ?profile=1 のとき）"""
+    with st.sidebar.expander("⏱ 計測", expanded=True):
+        st.caption(f"この再実行: {trace.total_ms:.1f} ms")
+        st.dataframe([{"区間": "\u3000" * depth + name, "開始 ms": round(start_ms, 1), "ms": round(ms, 2)}
+                      for name, depth, start_ms, ms in trace.ordered_spans()], hide_index=True)
+        if trace.profile:
+            st.caption("cProfile（累積時間の上位）")
+            st.code(trace.profile)
 
 def get_css(theme_name: str = "ソフトブルー"):
     theme = THEME_PALETTES.get(theme_name, THEME_PALETTES["ソフトブルー"])
@@ -41,6 +57,7 @@ def get_css(theme_name: str = "ソフトブルー"):
 </style>
 """
 
+@traced("ui.goals_overview")
 def goals_overview_widget(goal_manager: GoalManager):
     goals = goal_manager.load_goals()
     
@@ -102,7 +119,12 @@ def goals_overview_widget(goal_manager: GoalManager):
     goals_html += "</div>"
     st.markdown(goals_html, unsafe_allow_html=True)
 
+def select_mood(mood: dict):
+    st.session_state.selected_mood = mood
+
+@st.fragment
 def mood_selector():
+    """心模様の選択欄。押したときはこの欄だけを描き直す（選んだ値は st.session_state.selected_mood に入る）"""
     st.subheader("今の心模様は？")
     
     selected_mood = st.session_state.get('selected_mood', MOOD_OPTIONS["ポジティブ"][0])
@@ -124,9 +146,8 @@ def mood_selector():
                 </div>
                 """, unsafe_allow_html=True)
                 
-                if st.button(mood['name'], key=f"mood_{mood['name']}", help=f"強度: {mood['intensity']}/5"):
-                    st.session_state.selected_mood = mood
-                    st.rerun()
+                # 描く前にコールバックで選択を反映するので、描き直しは1回で済む
+                st.button(mood['name'], key=f"mood_{mood['name']}", help=f"強度: {mood['intensity']}/5", on_click=select_mood, args=(mood,))
         
         st.markdown('</div>', unsafe_allow_html=True)
     